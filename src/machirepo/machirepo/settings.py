@@ -1,4 +1,5 @@
 import os
+import sys
 from pathlib import Path
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -50,6 +51,8 @@ DEFAULT_FROM_EMAIL = EMAIL_HOST_USER
 
 
 MIDDLEWARE = [
+    # セッションの読み書きを含めて数えるため先頭に置く
+    'main.query_inspector.QueryInspectorMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -59,6 +62,16 @@ MIDDLEWARE = [
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
 
+# manage.py test の実行中か
+TESTING = sys.argv[1:2] == ['test']
+
+# 開発時に、同じ形の SQL がこの回数以上実行されたリクエスト（N+1 の疑い）と、
+# 画面ごとの SQL の上限（main/query_inspector.py の BUDGETS）を超えたリクエストをログに出す
+# （テストの実行中はログではなく例外にし、テストを失敗させる）
+QUERY_INSPECTOR = DEBUG or TESTING
+QUERY_INSPECTOR_RAISE = TESTING
+QUERY_INSPECTOR_REPEAT_THRESHOLD = 3
+
 ROOT_URLCONF = 'machirepo.urls'
 
 TEMPLATES = [
@@ -135,6 +148,131 @@ STATIC_URL = '/static/'
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
 MEDIA_URL = '/media/'
 
+# 投稿写真は内容の SHA-256 で名前付けし、photos/ab/cd/<sha256>.jpg のように2階層に分けて保存する。
+# 同じ内容の写真は1つのファイルを共有する（既存の写真は manage.py migrate_photo_storage で移行する）。
+STORAGES = {
+    'default': {
+        'BACKEND': 'django.core.files.storage.FileSystemStorage',
+    },
+    'staticfiles': {
+        'BACKEND': 'django.contrib.staticfiles.storage.StaticFilesStorage',
+    },
+    'photos': {
+        'BACKEND': 'main.media_storage.ContentAddressedStorage',
+        'OPTIONS': {'prefix': 'photos'},
+    },
+}
+
+# 写真を S3 互換のオブジェクトストレージ（AWS S3・MinIO など）に保存する場合は MACHIREPO_S3_ENDPOINT などを設定する。
+# ブラウザは署名付き URL で写真をストレージへ直接アップロードする
+# （バケットには PUT の CORS と ETag ヘッダーの公開、未完了のマルチパートを削除するライフサイクルを設定すること）。
+if os.environ.get('MACHIREPO_S3_ENDPOINT'):
+    STORAGES['photos'] = {
+        'BACKEND': 'main.object_storage.ContentAddressedS3Storage',
+        'OPTIONS': {
+            'prefix': 'photos',
+            'endpoint_url': os.environ['MACHIREPO_S3_ENDPOINT'],
+            'bucket': os.environ.get('MACHIREPO_S3_BUCKET', 'machirepo'),
+            'access_key': os.environ.get('MACHIREPO_S3_ACCESS_KEY', ''),
+            'secret_key': os.environ.get('MACHIREPO_S3_SECRET_KEY', ''),
+            'region': os.environ.get('MACHIREPO_S3_REGION', 'us-east-1'),
+            'addressing_style': os.environ.get('MACHIREPO_S3_ADDRESSING_STYLE', 'path'),
+            'public_url': os.environ.get('MACHIREPO_S3_PUBLIC_URL') or None,
+        },
+    }
+# 直接アップロードの置き場所（バケット内のキーの接頭辞）・この大きさを超えるとマルチパート・署名付き URL の有効期限（秒）
+PHOTO_DIRECT_UPLOAD_PREFIX = 'incoming'
+PHOTO_DIRECT_UPLOAD_PART_BYTES = 8 * 1024 * 1024
+PHOTO_DIRECT_UPLOAD_URL_EXPIRES = 60 * 60
+
+# 投稿写真の配信（main.views.media_file）
+# 本番では Web サーバーに送信を任せる: 'nginx'（X-Accel-Redirect）/ 'apache'（X-Sendfile）/ None（Django が送る）
+#   nginx の例:
+#     location /protected-media/ { internal; alias <MEDIA_ROOT>/; }
+MEDIA_ACCEL_BACKEND = None
+MEDIA_ACCEL_REDIRECT_PREFIX = '/protected-media/'
+# 内容のハッシュで名前付けした写真は1年・immutable、それ以外（縮小画像・旧形式の名前）はこの秒数キャッシュさせる
+MEDIA_CACHE_MAX_AGE = 24 * 60 * 60
+# MEDIA_ROOT 以下で、投稿と関係なく配信するサイトの画像（バッジ・アイコンなど）のディレクトリ
+MEDIA_PUBLIC_DIRECTORIES = ['images']
+
+# 投稿途中の写真の置き場所（公開しない）。投稿確定時に MEDIA_ROOT へリンクで移すため、
+# 同じファイルシステム上に置くとコピーが発生しない。
+PHOTO_STAGING_ROOT = os.path.join(BASE_DIR, 'staging')
+# 投稿されずに放置された写真は、この時間を過ぎると manage.py media_gc で削除される
+PHOTO_STAGING_TTL_HOURS = 24
+# 投稿の下書き（入力内容とステージング中の写真）は最後の更新からこの時間保持し、別の端末からも続きを再開できる
+PHOTO_POST_DRAFT_TTL_HOURS = 7 * 24
+
+# 投稿写真の取り込み時の正規化
+# アップロードされた写真は向きを反映し、長辺 PHOTO_INGEST_MAX_LONG_EDGE px 以下に縮小して再エンコードする。
+# EXIF などのメタデータは保存しない（位置情報・撮影日時は正規化の前に読み取って投稿に使う）。
+PHOTO_UPLOAD_MAX_BYTES = 25 * 1024 * 1024   # 受け付けるアップロードの上限
+PHOTO_STORED_MAX_BYTES = 5 * 1024 * 1024    # 正規化後に保存する写真の上限（超える場合は品質を下げる）
+# ヘッダーの幅×高さがこれを超える写真はデコードせずに断る。
+# JPEG は出力サイズに近い縮尺でデコードするが、PNG などは全画素を展開するためメモリ使用量の上限にもなる。
+PHOTO_INGEST_MAX_PIXELS = 40_000_000
+PHOTO_INGEST_MAX_LONG_EDGE = 2048
+PHOTO_INGEST_FORMAT = 'JPEG'                # 'JPEG' / 'WEBP'
+PHOTO_INGEST_QUALITY = 85
+# 分割アップロード（post/upload/）の1チャンクの大きさ。途中で途切れた場合はチャンク単位で再送する
+PHOTO_UPLOAD_CHUNK_BYTES = 1024 * 1024
+
+
+# 写真分類AI
+# モデルは初回推論時に読み込む。CLASSIFIER_EAGER_LOAD を有効にしたプロセスのみ起動時に読み込む。
+# 近いタイミングの推論リクエストをまとめて1回の順伝播で処理する（マイクロバッチ）
+
+CLASSIFIER_MODEL_PATH = BASE_DIR / 'main' / 'machirepo_ai_v1.pth'
+CLASSIFIER_EAGER_LOAD = os.environ.get('MACHIREPO_CLASSIFIER_EAGER_LOAD') == '1'
+
+# 推論バックエンド: 'eager' / 'torchscript' / 'int8_dynamic' / 'int8_static'
+# （manage.py compare_classifier_backends で速度と判定一致率を比較できる）
+CLASSIFIER_BACKEND = os.environ.get('MACHIREPO_CLASSIFIER_BACKEND', 'eager')
+CLASSIFIER_CALIBRATION_DIR = os.path.join(MEDIA_ROOT, 'photos')
+CLASSIFIER_CALIBRATION_IMAGES = 32
+
+CLASSIFIER_BATCHING = True
+CLASSIFIER_BATCH_MAX_SIZE = 8
+CLASSIFIER_BATCH_MAX_WAIT_MS = 5
+
+# Web ワーカー内での推論の同時実行数と torch のスレッド数。
+# 上限を超えた要求は待たせるか打ち切り、画面には「AI分類待ち」を表示する。
+# CLASSIFIER_BATCHING が有効な場合、順伝播はバッチャーの1スレッドで行うため CLASSIFIER_MAX_CONCURRENT は使わず、
+# バッチャーに溜まる件数を CLASSIFIER_BATCH_MAX_SIZE + CLASSIFIER_MAX_WAITING までに制限する。
+CLASSIFIER_TORCH_THREADS = int(os.environ.get('MACHIREPO_TORCH_THREADS', '2'))
+CLASSIFIER_TORCH_INTEROP_THREADS = 1
+CLASSIFIER_MAX_CONCURRENT = 2
+CLASSIFIER_MAX_WAITING = 8
+CLASSIFIER_QUEUE_TIMEOUT = 5.0
+CLASSIFIER_PAGE_TIMEOUT = 0.5
+
+# 推論サーバー（manage.py run_inference_server）の Unix ソケット。
+# 設定すると各ワーカーはモデルを持たずにサーバーへ分類を依頼し、接続できない場合のみプロセス内で推論する。
+CLASSIFIER_SERVER_SOCKET = os.environ.get('MACHIREPO_CLASSIFIER_SOCKET') or None
+CLASSIFIER_SERVER_TIMEOUT = 10
+CLASSIFIER_SERVER_RETRY_SECONDS = 30
+
+# 重複報告の検出（AI分類時の埋め込みのコサイン類似度）
+# 位置情報がある場合は半径 DUPLICATE_SEARCH_RADIUS_KM 以内の投稿だけを比較する
+DUPLICATE_SIMILARITY_THRESHOLD = 0.9
+DUPLICATE_SEARCH_RADIUS_KM = 0.5
+DUPLICATE_TOP_K = 5
+
+# 同一写真（SHA-256 一致）・ほぼ同一写真（知覚ハッシュのハミング距離がこの値以下）の検出
+# 索引は16ビット×4帯のため、3以下であれば取りこぼしがない（4以上は ImproperlyConfigured）
+PHOTO_NEAR_DUPLICATE_DISTANCE = 3
+
+# 投稿写真の縮小画像（元画像と同じディレクトリに WebP / JPEG で保存する）
+# 投稿の保存後にバックグラウンドのスレッドで生成し、既存の写真は manage.py generate_thumbnails で作成する
+PHOTO_THUMBNAIL_WIDTHS = [160, 480, 1024]
+PHOTO_THUMBNAIL_ASYNC = True
+PHOTO_THUMBNAIL_WORKERS = 1
+
+# 報告一覧（みんなの投稿・管理者の報告一覧）の1ページの件数。?size= で変えられるのは POST_LIST_MAX_PAGE_SIZE まで
+POST_LIST_PAGE_SIZE = 30
+POST_LIST_MAX_PAGE_SIZE = 100
+
 
 # Default primary key field type
 # https://docs.djangoproject.com/en/4.0/ref/settings/#default-auto-field
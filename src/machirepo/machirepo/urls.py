@@ -1,10 +1,12 @@
 import os
+import re
 from django.conf import settings
 from django.contrib import admin 
-from django.urls import path, include
+from django.urls import path, include, re_path
 from django.conf.urls.static import static # static関数をインポート
 from django.contrib.auth import views as auth_views 
 from main.forms import EmailAuthenticationForm 
+from main import views as main_views
 
     
 
@@ -14,8 +16,9 @@ urlpatterns = [
     path('accounts/login/', auth_views.LoginView.as_view(template_name='registration/login.html', authentication_form=EmailAuthenticationForm), name='login'),
     path('main/', include('main.urls')), 
     path('accounts/', include('django.contrib.auth.urls')), 
+    # 投稿写真は DEBUG に関係なくビューで配信する（本番では送信を Web サーバーに任せる）
+    re_path(r'^%s(?P<name>.+)$' % re.escape(settings.MEDIA_URL.lstrip('/')), main_views.media_file, name='media_file'),
 ]
 
 if settings.DEBUG:
-    urlpatterns += static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT)
     urlpatterns += static(settings.STATIC_URL, document_root=settings.STATIC_ROOT)
@@ -3,3 +3,15 @@ from django.apps import AppConfig
 class MainConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'main'
+
+    def ready(self):
+        from django.conf import settings
+
+        from . import photo_hashing, signals  # noqa: F401
+
+        # 設定の誤り（索引で検出できない距離）は起動時に知らせる
+        photo_hashing.near_duplicate_distance()
+
+        if getattr(settings, 'CLASSIFIER_EAGER_LOAD', False):
+            from . import model_loader
+            model_loader.preload()
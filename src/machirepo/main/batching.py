@@ -0,0 +1,191 @@
+import logging
+import queue
+import threading
+import time
+from concurrent.futures import Future, TimeoutError as FutureTimeoutError
+
+import torch
+from django.conf import settings
+
+from . import classifier
+
+
+logger = logging.getLogger(__name__)
+
+
+class BatchingClassifier:
+    """
+    推論リクエストをキューに溜め、一定件数に達するか待ち時間が過ぎた時点で
+    まとめて1回の順伝播で推論するマイクロバッチ推論エンジン。
+    呼び出し元には Future で1件ずつ結果を返す。
+    """
+
+    def __init__(self, predict_fn=None, max_batch_size=8, max_wait_ms=5):
+        self.predict_fn = predict_fn or classifier.predict_batch
+        self.max_batch_size = max(1, int(max_batch_size))
+        self.max_wait = max(0.0, max_wait_ms / 1000.0)
+
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._pending = 0
+        self._stopped = threading.Event()
+        self._reset_counters()
+
+        self._worker = threading.Thread(target=self._run, name='classifier-batcher', daemon=True)
+        self._worker.start()
+
+    def _reset_counters(self):
+        self._images = 0
+        self._batches = 0
+        self._failed = 0
+        self._busy_seconds = 0.0
+        self._latency_total = 0.0
+        self._latency_max = 0.0
+        self._started_at = time.monotonic()
+
+    # -----------------------------------------------------
+    # 呼び出し側 API
+    # -----------------------------------------------------
+
+    def submit(self, input_tensor, on_start=None):
+        """
+        前処理済みテンソル (1, 3, H, W) を投入し、結果の Future を返す。
+        on_start はこのリクエストを含むバッチの推論を始める直前にワーカースレッドで呼ばれる。
+        """
+        if self._stopped.is_set():
+            raise RuntimeError('BatchingClassifier は停止しています。')
+
+        future = Future()
+        with self._lock:
+            self._pending += 1
+        future.add_done_callback(self._release_pending)
+        self._queue.put((input_tensor, future, time.monotonic(), on_start))
+        return future
+
+    def _release_pending(self, future):
+        with self._lock:
+            self._pending -= 1
+
+    def pending(self):
+        """投入済みで結果が出ていない件数（待ち行列と推論中のバッチの合計）。"""
+        with self._lock:
+            return self._pending
+
+    def classify(self, input_tensor, timeout=None, on_start=None):
+        """
+        1件を推論して結果を返す。timeout 秒以内に推論が始まらなければ取り消して TimeoutError を送出する
+        （推論が始まっていれば終わるまで待つ）。
+        """
+        future = self.submit(input_tensor, on_start)
+        try:
+            return future.result(timeout=timeout)
+        except FutureTimeoutError:
+            if future.cancel():
+                raise TimeoutError(f"{timeout:.1f}秒以内にバッチ推論を開始できませんでした。") from None
+            return future.result()
+
+    def stats(self):
+        """スループットとレイテンシの集計値を返す。"""
+        with self._lock:
+            elapsed = time.monotonic() - self._started_at
+            return {
+                'images': self._images,
+                'batches': self._batches,
+                'failed': self._failed,
+                'queue_depth': self._queue.qsize(),
+                'pending': self._pending,
+                'avg_batch_size': self._images / self._batches if self._batches else 0.0,
+                'images_per_sec': self._images / elapsed if elapsed > 0 else 0.0,
+                'images_per_busy_sec': self._images / self._busy_seconds if self._busy_seconds > 0 else 0.0,
+                'avg_latency_ms': self._latency_total / self._images * 1000 if self._images else 0.0,
+                'max_latency_ms': self._latency_max * 1000,
+            }
+
+    def reset_stats(self):
+        with self._lock:
+            self._reset_counters()
+
+    def shutdown(self, wait=True):
+        self._stopped.set()
+        self._queue.put(None)
+        if wait:
+            self._worker.join()
+
+    # -----------------------------------------------------
+    # ワーカースレッド
+    # -----------------------------------------------------
+
+    def _collect_batch(self, first):
+        batch = [first]
+        deadline = time.monotonic() + self.max_wait
+
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.monotonic()
+            try:
+                item = self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if item is None:
+                self._queue.put(None)
+                break
+            batch.append(item)
+
+        return batch
+
+    def _run(self):
+        while True:
+            first = self._queue.get()
+            if first is None:
+                break
+
+            # キャンセル済みのリクエストは推論対象から外す
+            batch = [item for item in self._collect_batch(first) if item[1].set_running_or_notify_cancel()]
+            if not batch:
+                continue
+
+            tensors = [tensor for tensor, _, _, _ in batch]
+            futures = [future for _, future, _, _ in batch]
+            for _, _, _, on_start in batch:
+                if on_start is not None:
+                    on_start()
+
+            started = time.monotonic()
+            try:
+                results = self.predict_fn(torch.cat(tensors, dim=0))
+            except Exception as e:
+                logger.error("バッチ推論に失敗しました (batch=%d)", len(tensors), exc_info=True)
+                for future in futures:
+                    future.set_exception(e)
+                with self._lock:
+                    self._failed += len(futures)
+                continue
+
+            finished = time.monotonic()
+            for future, result in zip(futures, results):
+                future.set_result(result)
+
+            with self._lock:
+                self._images += len(futures)
+                self._batches += 1
+                self._busy_seconds += finished - started
+                for _, _, enqueued_at, _ in batch:
+                    latency = finished - enqueued_at
+                    self._latency_total += latency
+                    self._latency_max = max(self._latency_max, latency)
+
+
+_batcher = None
+_batcher_lock = threading.Lock()
+
+
+def get_batcher():
+    """プロセス内で共有するマイクロバッチ推論エンジンを返す（初回呼び出し時に起動）。"""
+    global _batcher
+    if _batcher is None:
+        with _batcher_lock:
+            if _batcher is None:
+                _batcher = BatchingClassifier(
+                    max_batch_size=getattr(settings, 'CLASSIFIER_BATCH_MAX_SIZE', 8),
+                    max_wait_ms=getattr(settings, 'CLASSIFIER_BATCH_MAX_WAIT_MS', 5),
+                )
+    return _batcher
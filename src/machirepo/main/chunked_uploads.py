@@ -0,0 +1,164 @@
+import contextlib
+import fcntl
+import os
+
+from django.conf import settings
+from django.core.files import File
+from django.utils import timezone
+
+from . import ingest, photo_hashing, staging
+from .models import ChunkedUpload
+
+
+# -----------------------------------------------------
+# 分割・再開可能なアップロード
+#   開始 → チャンクの PUT（offset 指定）→ 完了 の3段階。
+#   チャンクはステージング領域の chunks/<id>.part に直接追記する。通信が途切れた場合は受信済みの offset から再送すればよい。
+#   同じアップロードへの PUT・完了は part ファイルの排他ロック（flock）で1つずつ処理する。
+#   完了時は受信したファイルの SHA-256 を送信元の値と照合し、staging.stage_upload で正規化して
+#   通常の投稿フローと同じ post_data に渡す。
+# -----------------------------------------------------
+
+CHUNK_DIRECTORY = 'chunks'
+
+
+class UploadError(Exception):
+    """受け付けられない要求。メッセージはそのまま利用者に表示する。"""
+
+
+class OffsetMismatch(UploadError):
+    """受信済みの位置と異なる offset のチャンク。送信側は offset から再送する。"""
+
+    def __init__(self, offset):
+        super().__init__(f"受信済みの位置は {offset} バイトです。")
+        self.offset = offset
+
+
+def chunk_size():
+    return getattr(settings, 'PHOTO_UPLOAD_CHUNK_BYTES', 1024 * 1024)
+
+
+def part_name(upload):
+    return f"{CHUNK_DIRECTORY}/{upload.pk}.part"
+
+
+def part_path(upload):
+    return staging.path(part_name(upload))
+
+
+def check_size(size):
+    """アップロードされる写真のサイズを確認する（分割・直接アップロード共通）。"""
+    limit = settings.PHOTO_UPLOAD_MAX_BYTES
+    if size <= 0:
+        raise UploadError("写真のファイルサイズが不正です。")
+    if size > limit:
+        raise UploadError(f"写真のファイルサイズが大きすぎます（最大{limit // (1024 * 1024)}MB）。")
+
+
+def initiate(user, filename, size, sha256=''):
+    """アップロードを開始し、ChunkedUpload を返す。"""
+    check_size(size)
+    if sha256 and (len(sha256) != 64 or any(c not in '0123456789abcdef' for c in sha256.lower())):
+        raise UploadError("SHA-256 の形式が不正です。")
+
+    now = timezone.now()
+    upload = ChunkedUpload.objects.create(
+        user=user,
+        filename=os.path.basename(filename)[:255] or 'photo',
+        size=size,
+        sha256=sha256.lower(),
+        created_at=now,
+        expires_at=now + staging.ttl(),
+    )
+    path = part_path(upload)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    open(path, 'wb').close()
+    return upload
+
+
+@contextlib.contextmanager
+def _locked_part(upload):
+    """
+    part ファイルを排他ロックして開き、ロックした時点の受信済みの位置を upload.offset に読み直す。
+    同じアップロードへの並行した要求はロックを待ち、先の要求が終わった後の位置で処理する。
+    """
+    try:
+        f = open(part_path(upload), 'r+b')
+    except FileNotFoundError:
+        raise UploadError("アップロードの期限が切れています。もう一度アップロードしてください。") from None
+    with f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            upload.refresh_from_db(fields=['offset'])
+        except ChunkedUpload.DoesNotExist:
+            raise UploadError("アップロードの期限が切れています。もう一度アップロードしてください。") from None
+        yield f
+
+
+def append(upload, offset, stream, length):
+    """
+    offset の位置から length バイトのチャンクを stream から読み込んで追記し、新しい offset を返す。
+    チャンクはメモリにまとめずに、読み込んだ分から書き込む。
+    """
+    if length <= 0 or length > chunk_size() * 2:
+        raise UploadError("チャンクのサイズが不正です。")
+    if offset + length > upload.size:
+        raise UploadError("チャンクが写真のサイズを超えています。")
+
+    with _locked_part(upload) as f:
+        if offset != upload.offset:
+            raise OffsetMismatch(upload.offset)
+
+        f.seek(offset)
+        f.truncate()
+        remaining = length
+        while remaining > 0:
+            data = stream.read(min(remaining, 64 * 1024))
+            if not data:
+                break
+            f.write(data)
+            remaining -= len(data)
+
+        if remaining:
+            # 途中で切れたチャンクは捨て、受信済みの位置から再送してもらう（ロック中のため offset は変わっていない）
+            f.truncate(offset)
+            raise OffsetMismatch(offset)
+
+        f.flush()
+        new_offset = offset + length
+        ChunkedUpload.objects.filter(pk=upload.pk).update(
+            offset=new_offset, expires_at=timezone.now() + staging.ttl(),
+        )
+        upload.offset = new_offset
+    return new_offset
+
+
+def finalize(upload):
+    """
+    受信を終えたアップロードを正規化してステージングし、StagedPhoto を返す。
+    分割アップロードの一時ファイルとレコードはここで削除する。
+    """
+    with _locked_part(upload) as f:
+        if upload.offset != upload.size:
+            raise OffsetMismatch(upload.offset)
+
+        # 受信したファイルそのものを照合する
+        if upload.sha256 and photo_hashing.file_sha256(part_path(upload)) != upload.sha256:
+            discard(upload)
+            raise UploadError("受信したデータが送信元と一致しません。もう一度アップロードしてください。")
+
+        try:
+            staged = staging.stage_upload(File(f, name=upload.filename), upload.user)
+        except ingest.RejectedImage as e:
+            discard(upload)
+            raise UploadError(str(e)) from None
+
+        discard(upload)
+    return staged
+
+
+def discard(upload):
+    """分割アップロードの一時ファイルとレコードを削除する。"""
+    with contextlib.suppress(FileNotFoundError):
+        os.unlink(part_path(upload))
+    ChunkedUpload.objects.filter(pk=upload.pk).delete()
@@ -0,0 +1,242 @@
+import base64
+import io
+import logging
+
+import numpy as np
+from django.conf import settings
+from django.utils import timezone
+from PIL import Image
+
+from . import governor, inference_server, model_loader, similarity
+from .model_backends import forward
+
+
+logger = logging.getLogger(__name__)
+
+# 写真分類AIのカテゴリ（モデル出力のインデックス順）
+CATEGORIES = ['倒木', '正常（対象外）', '道路のひび割れ', '水質汚濁']
+NORMAL_LABEL = '正常（対象外）'
+
+INPUT_SIZE = (224, 224)
+
+# 正規化は (画素値 / 255 - mean) / std を「画素値 * scale - offset」の1回の積和にまとめる
+_MEAN = np.array([0.485, 0.456, 0.406], dtype=np.float32)
+_STD = np.array([0.229, 0.224, 0.225], dtype=np.float32)
+_SCALE = (1.0 / (255.0 * _STD)).reshape(1, 1, 3)
+_OFFSET = (_MEAN / _STD).reshape(1, 1, 3)
+
+# torch は推論関数の中でのみ import する（model_loader を参照）
+
+
+class _BufferReader(io.RawIOBase):
+    """memoryview（共有メモリなど）をコピーせずに読むファイルオブジェクト（io.BytesIO は全体をコピーする）。"""
+
+    def __init__(self, view):
+        super().__init__()
+        self._view = view.cast('B')
+        self._position = 0
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def tell(self):
+        return self._position
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_CUR:
+            offset += self._position
+        elif whence == io.SEEK_END:
+            offset += len(self._view)
+        self._position = max(0, offset)
+        return self._position
+
+    def readinto(self, buffer):
+        data = self._view[self._position:self._position + len(buffer)]
+        buffer[:len(data)] = data
+        self._position += len(data)
+        return len(data)
+
+    def close(self):
+        self._view.release()
+        super().close()
+
+
+def decode_image(image_data):
+    """
+    画像（バイト列・memoryview またはファイルオブジェクト）をモデル入力サイズに縮小した RGB 画像として読み込む。
+    JPEG は draft モードで DCT 段階の 1/2〜1/8 縮小デコードを行い、
+    入力サイズの2倍程度を超える画素は展開しない。
+    """
+    if isinstance(image_data, memoryview):
+        with _BufferReader(image_data) as reader:
+            return decode_image(reader)
+    if isinstance(image_data, (bytes, bytearray)):
+        image_data = io.BytesIO(image_data)
+    image = Image.open(image_data)
+    if image.format == 'JPEG':
+        image.draft('RGB', INPUT_SIZE)
+    if image.mode != 'RGB':
+        image = image.convert('RGB')
+    return image.resize(INPUT_SIZE, Image.Resampling.BILINEAR)
+
+
+def image_to_array(image):
+    """224x224 の RGB 画像を正規化済みの (3, 224, 224) float32 配列に変換する。"""
+    array = np.asarray(image, dtype=np.float32) * _SCALE - _OFFSET
+    return array.transpose(2, 0, 1)
+
+
+def preprocess_images(images):
+    """
+    複数の画像データをまとめて前処理し、(N, 3, 224, 224) のテンソルを返す。
+
+    以前の transforms.Compose（フル解像度デコード → Resize → ToTensor → Normalize）
+    との差は JPEG の縮小デコードによるもののみ（PNG 等は一致）。
+    許容誤差: 正規化後の値で平均絶対誤差 0.03 以下（エッジ部の最大誤差は 1.0 未満）、
+    分類結果（top-1）は変わらないこと。
+    """
+    import torch
+
+    batch = np.stack([image_to_array(decode_image(data)) for data in images])
+    return torch.from_numpy(batch)
+
+
+def preprocess_image(image_bytes):
+    return preprocess_images([image_bytes])
+
+
+def build_result(probabilities, embedding=None):
+    """
+    1枚分の確率ベクトルから分類結果の辞書を作る。
+    embedding は分類層直前の特徴量で、類似写真検索用に float16 のバイト列として保持する。
+    """
+    import torch
+
+    category_idx = int(torch.argmax(probabilities).item())
+    return {
+        'label': CATEGORIES[category_idx],
+        'confidence': float(probabilities[category_idx].item()),
+        'probabilities': [round(float(p), 6) for p in probabilities.tolist()],
+        'model_version': model_loader.model_version(),
+        'embedding': similarity.encode_embedding(embedding.numpy()) if embedding is not None else None,
+    }
+
+
+def predict_batch(input_tensor):
+    """(N, 3, 224, 224) のテンソルをまとめて推論し、N件の分類結果を返す。"""
+    import torch
+
+    with torch.no_grad():
+        output, embeddings = forward(model_loader.get_model(), input_tensor)
+        probabilities = torch.nn.functional.softmax(output, dim=1)
+
+    if embeddings is None:
+        return [build_result(p) for p in probabilities]
+    return [build_result(p, e) for p, e in zip(probabilities, embeddings)]
+
+
+def result_to_json(result):
+    """分類結果を JSON 化できる形にする（埋め込みは base64 文字列）。"""
+    data = dict(result)
+    if data.get('embedding') is not None:
+        data['embedding'] = base64.b64encode(data['embedding']).decode('ascii')
+    return data
+
+
+def result_from_json(data):
+    result = dict(data)
+    if result.get('embedding') is not None:
+        result['embedding'] = base64.b64decode(result['embedding'])
+    return result
+
+
+def classify_image(image_bytes=None, path=None, timeout=None):
+    """
+    画像データ（バイト列・ファイルオブジェクト）またはファイルパスを分類し、ラベル・信頼度・全カテゴリの確率を返す。
+    推論サーバー（CLASSIFIER_SERVER_SOCKET）が設定されていればそちらに依頼し、
+    接続できない場合はこのプロセス内で推論する。
+    プロセス内推論は InferenceGovernor で同時実行数（マイクロバッチ推論では待ち行列）を制限する。
+    timeout 秒以内に推論を開始できなければ（推論サーバーでは応答がなければ）governor.InferenceSaturated を送出する。
+    """
+    if inference_server.socket_path():
+        try:
+            if path is not None:
+                return inference_server.classify_path(path, timeout=timeout)
+            if hasattr(image_bytes, 'read'):
+                image_bytes = image_bytes.read()
+            return inference_server.classify_bytes(image_bytes, timeout=timeout)
+        except inference_server.InferenceServerUnavailable:
+            pass
+
+    if getattr(settings, 'CLASSIFIER_BATCHING', False):
+        # 前処理は各リクエストのスレッドで行い、順伝播はバッチャーでまとめる
+        from .batching import get_batcher
+        input_tensor = _preprocess(image_bytes, path)
+        return governor.get_governor().run_batched(get_batcher(), input_tensor, timeout=timeout)
+
+    return governor.get_governor().run(_classify_locally, image_bytes, path, timeout=timeout)
+
+
+def _preprocess(image_bytes, path):
+    if image_bytes is None:
+        # ファイル全体を読み込まず、デコーダに必要な部分だけを読ませる
+        with open(path, 'rb') as f:
+            return preprocess_image(f)
+    return preprocess_image(image_bytes)
+
+
+def _classify_locally(image_bytes, path):
+    return predict_batch(_preprocess(image_bytes, path))[0]
+
+
+def result_from_post(post):
+    """
+    投稿に保存済みの分類結果を classify_image と同じ形式で返す。
+    現在のモデルで分類・埋め込み保存されていない場合は None。
+    """
+    version = model_loader.model_version()
+    if not post.is_classified or post.ai_model_version != version:
+        return None
+
+    embedding = getattr(post, 'embedding', None)
+    if embedding is None or embedding.model_version != version:
+        return None
+
+    return {
+        'label': post.ai_label,
+        'confidence': post.ai_confidence,
+        'probabilities': post.ai_probabilities,
+        'model_version': post.ai_model_version,
+        'embedding': bytes(embedding.vector),
+    }
+
+
+def apply_classification(post, result):
+    """分類結果を PhotoPost のフィールドに反映する（保存は呼び出し側で行う）。"""
+    post.ai_label = result['label']
+    post.ai_confidence = result['confidence']
+    post.ai_probabilities = result['probabilities']
+    post.ai_model_version = result['model_version']
+    post.ai_classified_at = timezone.now()
+
+
+def classify_post(post, save=True, timeout=None):
+    """保存済みの投稿写真を分類して結果を記録する。"""
+    try:
+        result = classify_image(path=post.photo.path, timeout=timeout)
+    except NotImplementedError:
+        # ローカルパスを持たないストレージの場合は、読み込みながらデコードさせる（全体をメモリに置かない）
+        with post.photo.open('rb') as f:
+            result = classify_image(f, timeout=timeout)
+
+    apply_classification(post, result)
+    if save:
+        post.save(update_fields=[
+            'ai_label', 'ai_confidence', 'ai_probabilities',
+            'ai_model_version', 'ai_classified_at',
+        ])
+        similarity.store_embedding(post, result.get('embedding'), result['model_version'])
+    return result
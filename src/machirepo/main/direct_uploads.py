@@ -0,0 +1,135 @@
+import json
+import logging
+import os
+import uuid
+
+from django.conf import settings
+from django.core import signing
+from django.core.files import File
+
+from . import ingest, staging
+from .chunked_uploads import UploadError, check_size
+from .media_storage import photo_storage
+from .object_storage import ObjectStorageError, S3Storage
+
+
+logger = logging.getLogger(__name__)
+
+# -----------------------------------------------------
+# オブジェクトストレージへの直接アップロード
+#   写真の保存先（STORAGES['photos']）が S3Storage の場合、ブラウザは署名付き URL で
+#   ストレージに直接 PUT し、Django には署名付きのトークン（オブジェクトのキー）だけを渡す。
+#   PHOTO_DIRECT_UPLOAD_PART_BYTES を超える写真はマルチパートで送り、パートごとに URL を発行する。
+#   受け取った写真はストレージから読みながら staging.stage_upload で正規化し、元のオブジェクトは削除する。
+#   バケットには PUT の CORS（ETag ヘッダーの公開を含む）を設定しておくこと。
+# -----------------------------------------------------
+
+TOKEN_SALT = 'main.direct_uploads'
+
+
+def storage():
+    """直接アップロードを受け付けるストレージ（使えない場合は None）。"""
+    target = photo_storage()
+    return target if isinstance(target, S3Storage) else None
+
+
+def is_available():
+    return storage() is not None
+
+
+def incoming_prefix():
+    return getattr(settings, 'PHOTO_DIRECT_UPLOAD_PREFIX', 'incoming').strip('/')
+
+
+def part_size():
+    return getattr(settings, 'PHOTO_DIRECT_UPLOAD_PART_BYTES', 8 * 1024 * 1024)
+
+
+def url_expires():
+    return getattr(settings, 'PHOTO_DIRECT_UPLOAD_URL_EXPIRES', 60 * 60)
+
+
+def initiate(user, filename, size):
+    """
+    アップロード先の署名付き URL を発行し、ブラウザに返す内容を辞書で返す。
+    1回の PUT で送る場合は url、マルチパートの場合は parts（パート番号・サイズ・URL）を含む。
+    """
+    target = storage()
+    if target is None:
+        raise UploadError("直接アップロードは利用できません。")
+    check_size(size)
+
+    filename = os.path.basename(filename)[:255] or 'photo'
+    key = f"{incoming_prefix()}/{uuid.uuid4().hex}{os.path.splitext(filename)[1].lower()[:10]}"
+    data = {'key': key, 'filename': filename, 'size': size, 'user': user.pk}
+
+    if size <= part_size():
+        upload = {'url': target.presigned_put_url(key, size, expires=url_expires())}
+    else:
+        data['upload_id'] = target.create_multipart_upload(key)
+        parts = []
+        for number, offset in enumerate(range(0, size, part_size()), start=1):
+            length = min(part_size(), size - offset)
+            url = target.presigned_part_url(key, data['upload_id'], number, length, expires=url_expires())
+            parts.append({'number': number, 'size': length, 'url': url})
+        upload = {'part_size': part_size(), 'parts': parts}
+
+    upload['token'] = signing.dumps(data, salt=TOKEN_SALT)
+    return upload
+
+
+def finalize(user, token, parts=None):
+    """
+    ブラウザが送り終えた写真を正規化してステージングし、StagedPhoto を返す。
+    parts はマルチパートの各パートの [{'number': パート番号, 'etag': ETag}]（JSON 文字列でもよい）。
+    受け取ったオブジェクトは成功・失敗にかかわらず削除する。
+    """
+    try:
+        data = signing.loads(token, salt=TOKEN_SALT, max_age=staging.ttl())
+    except signing.BadSignature:
+        raise UploadError("アップロードの情報が不正か、期限が切れています。もう一度アップロードしてください。") from None
+    target = storage()
+    if target is None or data['user'] != user.pk:
+        raise UploadError("アップロードの情報が不正か、期限が切れています。もう一度アップロードしてください。")
+
+    key = data['key']
+    upload_id = data.get('upload_id')
+    try:
+        if upload_id:
+            target.complete_multipart_upload(key, upload_id, _parse_parts(parts))
+        with target.open(key, 'rb') as f:
+            if f.size != data['size']:
+                raise UploadError("受信したデータが送信元と一致しません。もう一度アップロードしてください。")
+            return staging.stage_upload(File(f.file, name=data['filename']), user)
+    except ingest.RejectedImage as e:
+        raise UploadError(str(e)) from None
+    except FileNotFoundError:
+        raise UploadError("写真がストレージに見つかりません。もう一度アップロードしてください。") from None
+    except ObjectStorageError:
+        logger.warning("直接アップロードされた写真 %s を受け取れませんでした。", key, exc_info=True)
+        raise UploadError("写真を受け取れませんでした。もう一度アップロードしてください。") from None
+    finally:
+        discard(target, key, upload_id)
+
+
+def discard(target, key, upload_id=None):
+    """直接アップロードされたオブジェクト（完了していないマルチパートを含む）を削除する。"""
+    try:
+        if upload_id:
+            target.abort_multipart_upload(key, upload_id)
+        target.delete(key)
+    except ObjectStorageError:
+        # 残ったものは manage.py media_gc で削除する
+        logger.warning("直接アップロードされた写真 %s を削除できませんでした。", key, exc_info=True)
+
+
+def _parse_parts(parts):
+    if isinstance(parts, str):
+        try:
+            parts = json.loads(parts)
+        except ValueError:
+            parts = None
+    try:
+        return [(int(part['number']), str(part['etag'])) for part in parts]
+    except (KeyError, TypeError, ValueError):
+        raise UploadError("送信したパートの情報が不正です。") from None
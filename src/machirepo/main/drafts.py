@@ -0,0 +1,132 @@
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.db.models import F
+from django.utils import timezone
+
+from . import photo_hashing, staging
+from .models import PhotoPostDraft, StagedUpload
+
+
+# -----------------------------------------------------
+# 投稿の下書き（PhotoPostDraft）
+#   投稿フローの各ステップは下書きを読み書きし、セッションには何も保存しない。
+#   どのアプリケーションサーバー・端末からでも続きを再開でき、写真を送り直す必要もない。
+#   書き込みは UPDATE 1文で行い、version が変わっていれば DraftConflict を送出する。
+# -----------------------------------------------------
+
+# 写真を差し替えたときにまとめて置き換えるフィールド
+PHOTO_FIELDS = (
+    'photo_name', 'photo_sha256', 'photo_phash', 'photo_latitude', 'photo_longitude', 'photo_taken_at', 'ai_result',
+)
+
+
+class DraftConflict(Exception):
+    """読み込んだ後に、別の画面（端末）で下書きが更新された。"""
+
+
+def ttl():
+    return timedelta(hours=getattr(settings, 'PHOTO_POST_DRAFT_TTL_HOURS', 7 * 24))
+
+
+def get(user):
+    """利用者の有効な下書き（なければ None）。"""
+    return PhotoPostDraft.objects.select_related('tag').filter(user=user, expires_at__gt=timezone.now()).first()
+
+
+def parse_version(value):
+    """フォームから送られた version（下書きがない状態で開いた画面は 0）。不正な値は None（確認しない）。"""
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def save(user, fields, version=None):
+    """
+    下書きに fields を書き込み、更新後の下書きを返す。下書きがなければ作る。
+    version を指定した場合は、その版から更新されていないときだけ書き込む（0 は「下書きがない」）。
+    有効期限は書き込みのたびに延ばし、ステージング中の写真も同じ期限まで残す。
+    """
+    now = timezone.now()
+    values = dict(fields, updated_at=now, expires_at=now + ttl())
+
+    drafts = PhotoPostDraft.objects.filter(user=user, expires_at__gt=now)
+    if version:
+        drafts = drafts.filter(version=version)
+    updated = 0 if version == 0 else drafts.update(version=F('version') + 1, **values)
+
+    if not updated:
+        if version:
+            raise DraftConflict()
+        # 期限切れの下書きは置き換える（同時に作られた場合は競合として扱う）
+        PhotoPostDraft.objects.filter(user=user, expires_at__lte=now).delete()
+        try:
+            with transaction.atomic():
+                PhotoPostDraft.objects.create(user=user, version=1, created_at=now, **values)
+        except IntegrityError:
+            raise DraftConflict() from None
+
+    draft = get(user)
+    if draft is None:
+        raise DraftConflict()
+    if draft.photo_name:
+        StagedUpload.objects.filter(name=draft.photo_name).update(expires_at=draft.expires_at)
+    return draft
+
+
+def photo_fields(staged):
+    """ステージングした写真（staging.StagedPhoto）について下書きに記録する値。"""
+    taken_at = staged.metadata['taken_at']
+    if taken_at is not None and timezone.is_naive(taken_at):
+        # タイムゾーンの記録がなければ現在のタイムゾーンとみなす
+        taken_at = timezone.make_aware(taken_at)
+    return {
+        'photo_name': staged.name,
+        'photo_sha256': staged.sha256,
+        'photo_phash': photo_hashing.hash_fields(staged.sha256, staged.phash)['photo_phash'],
+        'photo_latitude': staged.metadata['latitude'],
+        'photo_longitude': staged.metadata['longitude'],
+        'photo_taken_at': taken_at,
+        'ai_result': None,
+    }
+
+
+def replace_photo(user, staged, version=None):
+    """下書きの写真を staged に差し替え、元のステージング中の写真を削除する。"""
+    previous = get(user)
+    draft = save(user, photo_fields(staged), version)
+    if previous is not None and previous.photo_name and previous.photo_name != staged.name:
+        staging.discard(previous.photo_name)
+    return draft
+
+
+def store_ai_result(draft, ai_result):
+    """
+    確認画面で得た分類結果を下書きに保持する（投稿確定時に再利用する）。
+    利用者の入力ではないため version は変えず、写真が差し替えられていれば何もしない。
+    """
+    PhotoPostDraft.objects.filter(pk=draft.pk, photo_name=draft.photo_name).update(ai_result=ai_result)
+    draft.ai_result = ai_result
+
+
+def claim(draft):
+    """
+    投稿を確定するため、読み込んだ版の下書き（draft）を削除する。呼び出し側のトランザクションの中で呼び、
+    投稿を保存できなければ下書きも元に戻す。読み込んだ後に更新・確定・破棄されていれば DraftConflict。
+    ステージング中の写真は削除しない（投稿に移した後に削除する）。
+    """
+    deleted, _ = PhotoPostDraft.objects.filter(pk=draft.pk, version=draft.version).delete()
+    if not deleted:
+        raise DraftConflict()
+
+
+def discard(user):
+    """下書きとステージング中の写真を削除する。"""
+    draft = PhotoPostDraft.objects.filter(user=user).first()
+    if draft is None:
+        return
+    if draft.photo_name:
+        staging.discard(draft.photo_name)
+    draft.delete()
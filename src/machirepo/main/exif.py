@@ -0,0 +1,196 @@
+import struct
+from datetime import datetime, timedelta, timezone
+
+
+# -----------------------------------------------------
+# JPEG の EXIF（APP1）読み取り
+#   画像はデコードせず、ファイル先頭のマーカーを順にたどって APP1 セグメントだけを読む。
+#   取り込み時の正規化でメタデータは除去されるため、位置情報・撮影日時はその前に取り出す。
+# -----------------------------------------------------
+
+_SOI = b'\xff\xd8'
+_APP1 = 0xE1
+_SOS = 0xDA
+_EOI = 0xD9
+
+# IFD のタグ
+_TAG_ORIENTATION = 0x0112
+_TAG_DATETIME = 0x0132
+_TAG_EXIF_IFD = 0x8769
+_TAG_GPS_IFD = 0x8825
+_TAG_DATETIME_ORIGINAL = 0x9003
+_TAG_OFFSET_TIME_ORIGINAL = 0x9011
+_TAG_GPS_LATITUDE_REF = 0x0001
+_TAG_GPS_LATITUDE = 0x0002
+_TAG_GPS_LONGITUDE_REF = 0x0003
+_TAG_GPS_LONGITUDE = 0x0004
+
+# TIFF の型番号 -> 1要素のバイト数
+_TYPE_SIZES = {1: 1, 2: 1, 3: 2, 4: 4, 5: 8, 7: 1, 9: 4, 10: 8}
+
+
+def read_metadata(file):
+    """
+    JPEG ファイルの EXIF から位置情報・撮影日時・向きを読み取る。
+    戻り値は {'latitude', 'longitude', 'taken_at', 'orientation'}（読み取れない項目は None）。
+    読み込むのはファイル先頭のセグメントだけで、ファイル位置は先頭に戻す。
+    """
+    metadata = {'latitude': None, 'longitude': None, 'taken_at': None, 'orientation': None}
+    try:
+        file.seek(0)
+        payload = _find_exif_segment(file)
+        if payload:
+            metadata.update(_parse_tiff(payload))
+    except (OSError, ValueError, struct.error):
+        pass
+    finally:
+        file.seek(0)
+    return metadata
+
+
+def _find_exif_segment(file):
+    if file.read(2) != _SOI:
+        return None
+
+    while True:
+        byte = file.read(1)
+        if not byte:
+            return None
+        if byte != b'\xff':
+            return None
+        marker = file.read(1)
+        while marker == b'\xff':
+            marker = file.read(1)
+        if not marker:
+            return None
+        marker = marker[0]
+        if marker in (_SOS, _EOI):
+            # 画像データに入ったら EXIF はもうない
+            return None
+        if 0xD0 <= marker <= 0xD7 or marker == 0x01:
+            continue
+
+        length = struct.unpack('>H', file.read(2))[0]
+        if length < 2:
+            return None
+        if marker == _APP1:
+            payload = file.read(length - 2)
+            if payload.startswith(b'Exif\x00\x00'):
+                return payload[6:]
+        else:
+            file.seek(length - 2, 1)
+
+
+class _Tiff:
+    def __init__(self, data):
+        if data[:2] == b'II':
+            self.order = '<'
+        elif data[:2] == b'MM':
+            self.order = '>'
+        else:
+            raise ValueError("TIFF ヘッダーではありません")
+        if self._unpack('H', data, 2) != 42:
+            raise ValueError("TIFF ヘッダーではありません")
+        self.data = data
+        self.first_ifd = self._unpack('I', data, 4)
+
+    def _unpack(self, fmt, data, offset):
+        return struct.unpack_from(self.order + fmt, data, offset)[0]
+
+    def read_ifd(self, offset):
+        """IFD の {タグ: 値} を返す（値は型に応じて int / str / (分子, 分母) のリスト）。"""
+        entries = {}
+        count = self._unpack('H', self.data, offset)
+        for i in range(count):
+            entry = offset + 2 + i * 12
+            tag, type_, n = struct.unpack_from(self.order + 'HHI', self.data, entry)
+            size = _TYPE_SIZES.get(type_)
+            if size is None:
+                continue
+            total = size * n
+            value_offset = entry + 8 if total <= 4 else self._unpack('I', self.data, entry + 8)
+            if value_offset + total > len(self.data):
+                continue
+            entries[tag] = self._value(type_, n, value_offset)
+        return entries
+
+    def _value(self, type_, n, offset):
+        if type_ == 2:
+            return self.data[offset:offset + n].split(b'\x00', 1)[0].decode('ascii', 'replace').strip()
+        if type_ in (1, 7):
+            return list(self.data[offset:offset + n])
+        if type_ == 3:
+            return list(struct.unpack_from(f'{self.order}{n}H', self.data, offset))
+        if type_ == 4:
+            return list(struct.unpack_from(f'{self.order}{n}I', self.data, offset))
+        if type_ == 9:
+            return list(struct.unpack_from(f'{self.order}{n}i', self.data, offset))
+        values = struct.unpack_from(f"{self.order}{n * 2}{'I' if type_ == 5 else 'i'}", self.data, offset)
+        return list(zip(values[::2], values[1::2]))
+
+
+def _first(value):
+    return value[0] if isinstance(value, list) and value else None
+
+
+def _parse_tiff(data):
+    tiff = _Tiff(data)
+    ifd0 = tiff.read_ifd(tiff.first_ifd)
+    result = {}
+
+    orientation = _first(ifd0.get(_TAG_ORIENTATION))
+    if orientation in range(1, 9):
+        result['orientation'] = orientation
+
+    exif_ifd = {}
+    if _first(ifd0.get(_TAG_EXIF_IFD)):
+        exif_ifd = tiff.read_ifd(_first(ifd0[_TAG_EXIF_IFD]))
+    taken_at = _parse_datetime(
+        exif_ifd.get(_TAG_DATETIME_ORIGINAL) or ifd0.get(_TAG_DATETIME),
+        exif_ifd.get(_TAG_OFFSET_TIME_ORIGINAL),
+    )
+    if taken_at is not None:
+        result['taken_at'] = taken_at
+
+    if _first(ifd0.get(_TAG_GPS_IFD)):
+        gps = tiff.read_ifd(_first(ifd0[_TAG_GPS_IFD]))
+        latitude = _parse_coordinate(gps.get(_TAG_GPS_LATITUDE), gps.get(_TAG_GPS_LATITUDE_REF), 'S', 90)
+        longitude = _parse_coordinate(gps.get(_TAG_GPS_LONGITUDE), gps.get(_TAG_GPS_LONGITUDE_REF), 'W', 180)
+        # 測位できていない端末は (0, 0) を書き込むことがあるため、その場合は使わない
+        if latitude is not None and longitude is not None and (abs(latitude) > 0.000001 or abs(longitude) > 0.000001):
+            result['latitude'], result['longitude'] = latitude, longitude
+
+    return result
+
+
+def _parse_coordinate(value, ref, negative_ref, limit):
+    """度・分・秒の有理数3つを10進の度にする。"""
+    if not isinstance(value, list) or len(value) != 3 or not isinstance(ref, str):
+        return None
+    degrees = 0.0
+    for (numerator, denominator), unit in zip(value, (1, 60, 3600)):
+        if denominator == 0:
+            return None
+        degrees += numerator / denominator / unit
+    if ref.upper() == negative_ref:
+        degrees = -degrees
+    return round(degrees, 7) if abs(degrees) <= limit else None
+
+
+def _parse_datetime(value, offset):
+    """EXIF の日時（'YYYY:MM:DD HH:MM:SS'）。オフセットがなければタイムゾーンなしの datetime。"""
+    if not isinstance(value, str):
+        return None
+    try:
+        taken_at = datetime.strptime(value[:19], '%Y:%m:%d %H:%M:%S')
+    except ValueError:
+        return None
+
+    if isinstance(offset, str) and len(offset) >= 6 and offset[0] in '+-':
+        try:
+            hours, minutes = int(offset[1:3]), int(offset[4:6])
+        except ValueError:
+            return taken_at
+        delta = timedelta(hours=hours, minutes=minutes)
+        taken_at = taken_at.replace(tzinfo=timezone(delta if offset[0] == '+' else -delta))
+    return taken_at
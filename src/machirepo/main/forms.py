@@ -1,10 +1,12 @@
 from django import forms
+from django.conf import settings
+from django.core.files.uploadedfile import UploadedFile
 from django.contrib.auth import get_user_model 
 from django.core.validators import MinLengthValidator
 from django.contrib.auth.forms import AuthenticationForm, UserCreationForm
 from django.core.exceptions import ValidationError
 from .models import PhotoPost, Tag 
-from . import models 
+from . import ingest, models 
 
 User = get_user_model() 
 Resident = get_user_model()
@@ -163,6 +165,13 @@ class UserUpdateForm(forms.ModelForm):
         if User.objects.filter(username=username).exclude(pk=self.instance.pk).exists():
             raise forms.ValidationError("このユーザー名は既に使用されています。")
         return username
+
+    def save(self, commit=True):
+        user = super().save(commit=False)
+        if commit:
+            # 投稿数（post_count）は投稿の保存と同時に増減するため、編集した項目だけを書き込む
+            user.save(update_fields=self._meta.fields)
+        return user
     
 
 
@@ -222,6 +231,19 @@ class PhotoPostForm(forms.ModelForm):
                     'class': 'form-select w-full px-3 py-2 border border-gray-300 rounded-lg focus:outline-none focus:ring-2 focus:ring-blue-500 transition duration-150'
                 })
 
+    def clean_photo(self):
+        photo = self.cleaned_data.get('photo')
+        if isinstance(photo, UploadedFile):
+            # 容量と画素数はデコードせずに確認する（正規化の前に大きすぎる写真を断る）
+            limit = settings.PHOTO_UPLOAD_MAX_BYTES
+            if photo.size > limit:
+                raise ValidationError(f"写真のファイルサイズが大きすぎます（最大{limit // (1024 * 1024)}MB）。")
+            try:
+                ingest.inspect(photo)
+            except ingest.RejectedImage as e:
+                raise ValidationError(str(e))
+        return photo
+
 
 
 
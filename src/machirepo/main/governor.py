@@ -0,0 +1,191 @@
+import logging
+import threading
+import time
+
+from django.conf import settings
+
+
+logger = logging.getLogger(__name__)
+
+
+class InferenceSaturated(Exception):
+    """推論の同時実行数・待ち行列が上限に達しており、今は分類できない状態。"""
+
+
+# -----------------------------------------------------
+# torch のスレッド数設定（プロセスごとに1回だけ）
+# -----------------------------------------------------
+
+_threads_configured = False
+_threads_lock = threading.Lock()
+
+
+def configure_torch_threads(num_threads=None, interop_threads=None):
+    """
+    torch の演算スレッド数を設定する。最初の呼び出しのみ有効。
+    マルチワーカー構成で各プロセスがコア数分のスレッドを使うと過剰サブスクライブになるため、
+    既定では CLASSIFIER_TORCH_THREADS / CLASSIFIER_TORCH_INTEROP_THREADS に抑える。
+    """
+    global _threads_configured
+    with _threads_lock:
+        if _threads_configured:
+            return
+        _threads_configured = True
+
+        import torch
+
+        num_threads = num_threads or getattr(settings, 'CLASSIFIER_TORCH_THREADS', None)
+        interop_threads = interop_threads or getattr(settings, 'CLASSIFIER_TORCH_INTEROP_THREADS', None)
+
+        if num_threads:
+            torch.set_num_threads(int(num_threads))
+        if interop_threads:
+            try:
+                torch.set_num_interop_threads(int(interop_threads))
+            except RuntimeError:
+                # 既に並列処理が始まっている場合は変更できない
+                logger.warning("torch の interop スレッド数を変更できませんでした。")
+
+        logger.info(
+            "torch スレッド数: intra-op=%d inter-op=%d",
+            torch.get_num_threads(), torch.get_num_interop_threads(),
+        )
+
+
+# -----------------------------------------------------
+# 同時実行数の制御
+# -----------------------------------------------------
+
+class InferenceGovernor:
+    """
+    プロセス内の推論の同時実行数をセマフォで制限する。
+    待ち行列が max_waiting を超えるか、待ち時間が timeout を超えた場合は
+    InferenceSaturated を送出して処理を打ち切る（呼び出し側は「分類待ち」として扱う）。
+    マイクロバッチ推論（run_batched）では、順伝播は batching のワーカー1つが行うため、
+    リクエストごとの同時実行数ではなくバッチャーに溜まっている件数を制限する。
+    """
+
+    def __init__(self, max_concurrent=2, max_waiting=8, timeout=5.0):
+        self.max_concurrent = max(1, int(max_concurrent))
+        self.max_waiting = max(0, int(max_waiting))
+        self.timeout = timeout
+
+        self._semaphore = threading.BoundedSemaphore(self.max_concurrent)
+        self._lock = threading.Lock()
+        self._waiting = 0
+        self._in_flight = 0
+        self._completed = 0
+        self._shed = 0
+        self._wait_count = 0
+        self._wait_total = 0.0
+        self._wait_max = 0.0
+
+    def run(self, fn, *args, timeout=None, **kwargs):
+        timeout = self.timeout if timeout is None else timeout
+
+        with self._lock:
+            if self._waiting >= self.max_waiting and self._in_flight >= self.max_concurrent:
+                self._shed += 1
+                raise InferenceSaturated(f"推論待ちが上限 ({self.max_waiting}) に達しています。")
+            self._waiting += 1
+
+        started = time.monotonic()
+        acquired = self._semaphore.acquire(timeout=timeout)
+        waited = time.monotonic() - started
+
+        with self._lock:
+            self._waiting -= 1
+            self._record_wait(waited)
+            if not acquired:
+                self._shed += 1
+            else:
+                self._in_flight += 1
+
+        if not acquired:
+            raise InferenceSaturated(f"{timeout:.1f}秒以内に推論を開始できませんでした。")
+
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            with self._lock:
+                self._in_flight -= 1
+                self._completed += 1
+            self._semaphore.release()
+
+    def run_batched(self, batcher, input_tensor, timeout=None):
+        """
+        前処理済みの input_tensor を batcher（batching.BatchingClassifier）で推論する。
+        1バッチ分と max_waiting を超えて溜まっている場合は待たずに、timeout 秒以内に
+        推論が始まらない場合は取り消して InferenceSaturated を送出する。
+        待ち時間（投入からバッチの推論が始まるまで）と待ち行列は run と同じく stats に記録する。
+        """
+        timeout = self.timeout if timeout is None else timeout
+
+        with self._lock:
+            if batcher.pending() >= batcher.max_batch_size + self.max_waiting:
+                self._shed += 1
+                raise InferenceSaturated(f"推論待ちが上限 ({self.max_waiting}) に達しています。")
+            self._waiting += 1
+
+        started = False
+        submitted = time.monotonic()
+
+        def on_start():
+            # batching のワーカースレッドで、推論の直前に呼ばれる
+            nonlocal started
+            with self._lock:
+                self._waiting -= 1
+                self._record_wait(time.monotonic() - submitted)
+                self._in_flight += 1
+            started = True
+
+        try:
+            return batcher.classify(input_tensor, timeout=timeout, on_start=on_start)
+        except TimeoutError:
+            raise InferenceSaturated(f"{timeout:.1f}秒以内に推論を開始できませんでした。") from None
+        finally:
+            with self._lock:
+                if started:
+                    self._in_flight -= 1
+                    self._completed += 1
+                else:
+                    # 取り消された（推論が始まらなかった）
+                    self._waiting -= 1
+                    self._record_wait(time.monotonic() - submitted)
+                    self._shed += 1
+
+    def _record_wait(self, waited):
+        """待ち時間を集計する（self._lock を取得した状態で呼ぶ）。"""
+        self._wait_count += 1
+        self._wait_total += waited
+        self._wait_max = max(self._wait_max, waited)
+
+    def stats(self):
+        with self._lock:
+            return {
+                'max_concurrent': self.max_concurrent,
+                'max_waiting': self.max_waiting,
+                'queue_depth': self._waiting,
+                'in_flight': self._in_flight,
+                'completed': self._completed,
+                'shed': self._shed,
+                'avg_wait_ms': self._wait_total / self._wait_count * 1000 if self._wait_count else 0.0,
+                'max_wait_ms': self._wait_max * 1000,
+            }
+
+
+_governor = None
+_governor_lock = threading.Lock()
+
+
+def get_governor():
+    global _governor
+    if _governor is None:
+        with _governor_lock:
+            if _governor is None:
+                _governor = InferenceGovernor(
+                    max_concurrent=getattr(settings, 'CLASSIFIER_MAX_CONCURRENT', 2),
+                    max_waiting=getattr(settings, 'CLASSIFIER_MAX_WAITING', 8),
+                    timeout=getattr(settings, 'CLASSIFIER_QUEUE_TIMEOUT', 5.0),
+                )
+    return _governor
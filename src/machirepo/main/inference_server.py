@@ -0,0 +1,198 @@
+import json
+import logging
+import os
+import socket
+import socketserver
+import threading
+import time
+from multiprocessing import resource_tracker, shared_memory
+
+from django.conf import settings
+
+from .governor import InferenceSaturated
+
+
+logger = logging.getLogger(__name__)
+
+# -----------------------------------------------------
+# プロトコル
+#   1行1件の JSON をやり取りする。画像データ本体はソケットに流さず、
+#   ・{"op": "classify", "path": "..."}            保存済みファイルをサーバー側で直接読む
+#                                                  （ステージングと投稿写真の保存先の中のファイルに限る）
+#   ・{"op": "classify", "shm": "...", "size": n}  共有メモリ上のバイト列をコピーせずにデコードする
+#   のどちらかで渡す。"timeout" を付けると、その秒数以内に推論を始められない場合は取り消す。
+#   応答は {"ok": true, "result": {...}} / {"ok": false, "error": "..."}
+#   （取り消した場合は {"ok": false, "saturated": true, ...}）。
+# -----------------------------------------------------
+
+
+class InferenceServerUnavailable(Exception):
+    """推論サーバーに接続できない（プロセス内推論にフォールバックすべき）状態。"""
+
+
+def allowed_roots():
+    """path で分類を依頼できるディレクトリ（ステージング中の写真と投稿写真の保存先）。"""
+    from .models import PhotoPost
+
+    roots = [settings.PHOTO_STAGING_ROOT]
+    location = getattr(PhotoPost._meta.get_field('photo').storage, 'location', None)
+    if location:
+        roots.append(location)
+    return [os.path.realpath(root) for root in roots]
+
+
+def _attach_shared_memory(name):
+    shm = shared_memory.SharedMemory(name=name)
+    # 作成したのはクライアント側なので、サーバー終了時に resource_tracker に破棄させない
+    try:
+        resource_tracker.unregister(shm._name, 'shared_memory')
+    except Exception:
+        pass
+    return shm
+
+
+class _RequestHandler(socketserver.StreamRequestHandler):
+
+    def handle(self):
+        for line in self.rfile:
+            try:
+                response = {'ok': True, 'result': self.server.dispatch(json.loads(line))}
+            except TimeoutError as e:
+                # クライアントの待ち時間内に推論を始められなかった
+                response = {'ok': False, 'saturated': True, 'error': str(e)}
+            except Exception as e:
+                logger.warning("推論サーバーでのリクエスト処理に失敗しました", exc_info=True)
+                response = {'ok': False, 'error': str(e)}
+            self.wfile.write(json.dumps(response, ensure_ascii=False).encode('utf-8') + b'\n')
+            self.wfile.flush()
+
+
+class InferenceServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    """1つのモデルを保持し、同一ホストの全 Web ワーカーからの分類要求を受け付けるサーバー。"""
+
+    daemon_threads = True
+
+    def __init__(self, socket_path, batcher, roots=None):
+        self.socket_path = socket_path
+        self.batcher = batcher
+        self.roots = allowed_roots() if roots is None else [os.path.realpath(root) for root in roots]
+        if os.path.exists(socket_path):
+            os.unlink(socket_path)
+        super().__init__(socket_path, _RequestHandler)
+        os.chmod(socket_path, 0o660)
+
+    def dispatch(self, request):
+        from . import classifier
+
+        op = request.get('op')
+        if op == 'ping':
+            return 'pong'
+        if op == 'stats':
+            return self.batcher.stats()
+        if op != 'classify':
+            raise ValueError(f"不明な操作です: {op}")
+
+        if 'path' in request:
+            with self._open_photo(request['path']) as f:
+                tensor = classifier.preprocess_image(f)
+        else:
+            shm = _attach_shared_memory(request['shm'])
+            try:
+                with shm.buf[:request['size']] as view:
+                    tensor = classifier.preprocess_image(view)
+            finally:
+                shm.close()
+
+        # クライアントが待つのをやめた後に推論しないよう、同じ期限で取り消す
+        return classifier.result_to_json(self.batcher.classify(tensor, timeout=request.get('timeout')))
+
+    def _open_photo(self, path):
+        """写真の保存先（self.roots）の中のファイルだけを開く（シンボリックリンクは解決してから判定する）。"""
+        real_path = os.path.realpath(path)
+        if not any(os.path.commonpath([real_path, root]) == root for root in self.roots):
+            raise PermissionError(f"写真の保存先以外のファイルは読み込めません: {path}")
+        return open(real_path, 'rb')
+
+    def server_close(self):
+        super().server_close()
+        if os.path.exists(self.socket_path):
+            os.unlink(self.socket_path)
+
+
+# -----------------------------------------------------
+# クライアント（Web ワーカー側）
+# -----------------------------------------------------
+
+_unavailable_until = 0.0
+_state_lock = threading.Lock()
+
+
+def socket_path():
+    return getattr(settings, 'CLASSIFIER_SERVER_SOCKET', None)
+
+
+def _call(request, timeout=None):
+    """
+    サーバーに request を送り、結果を返す。
+    timeout（呼び出し側の待ち時間の上限）を指定した場合、その時間内に応答がなければ
+    サーバーが混雑しているものとして governor.InferenceSaturated を送出する（プロセス内推論には切り替えない）。
+    """
+    global _unavailable_until
+
+    path = socket_path()
+    if not path or time.monotonic() < _unavailable_until:
+        raise InferenceServerUnavailable(path)
+
+    try:
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+            sock.settimeout(getattr(settings, 'CLASSIFIER_SERVER_TIMEOUT', 10))
+            sock.connect(path)
+            if timeout is not None:
+                request = dict(request, timeout=timeout)
+                sock.settimeout(timeout)
+            sock.sendall(json.dumps(request).encode('utf-8') + b'\n')
+            with sock.makefile('rb') as f:
+                line = f.readline()
+    except OSError as e:
+        if timeout is not None and isinstance(e, socket.timeout):
+            # サーバーは動いており、混雑しているだけ
+            raise InferenceSaturated(f"推論サーバーが {timeout:.1f}秒以内に応答しませんでした。") from None
+        # 停止中のサーバーに毎回接続を試みないよう、一定時間はプロセス内推論を使う
+        with _state_lock:
+            _unavailable_until = time.monotonic() + getattr(settings, 'CLASSIFIER_SERVER_RETRY_SECONDS', 30)
+        logger.warning("推論サーバー (%s) に接続できません: %s", path, e)
+        raise InferenceServerUnavailable(path) from e
+
+    if not line:
+        raise InferenceServerUnavailable(path)
+
+    response = json.loads(line)
+    if response.get('saturated'):
+        raise InferenceSaturated(response['error'])
+    if not response['ok']:
+        raise RuntimeError(f"推論サーバーでエラーが発生しました: {response['error']}")
+    return response['result']
+
+
+def classify_path(path, timeout=None):
+    from .classifier import result_from_json
+
+    return result_from_json(_call({'op': 'classify', 'path': os.path.abspath(path)}, timeout=timeout))
+
+
+def classify_bytes(image_bytes, timeout=None):
+    from .classifier import result_from_json
+
+    shm = shared_memory.SharedMemory(create=True, size=max(1, len(image_bytes)))
+    try:
+        shm.buf[:len(image_bytes)] = image_bytes
+        return result_from_json(
+            _call({'op': 'classify', 'shm': shm.name, 'size': len(image_bytes)}, timeout=timeout)
+        )
+    finally:
+        shm.close()
+        shm.unlink()
+
+
+def server_stats():
+    return _call({'op': 'stats'})
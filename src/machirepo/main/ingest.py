@@ -0,0 +1,255 @@
+import logging
+import os
+import warnings
+from collections import namedtuple
+
+from django.conf import settings
+from PIL import Image
+
+
+logger = logging.getLogger(__name__)
+
+# -----------------------------------------------------
+# 取り込み時の写真の正規化
+#   アップロードされた写真は向きを反映し、長辺 PHOTO_INGEST_MAX_LONG_EDGE 以下に縮小して
+#   PHOTO_INGEST_FORMAT で再エンコードする。EXIF などのメタデータは保存しない。
+#   以降の表示・縮小画像の生成・AI分類はすべて正規化後の写真を読む。
+# -----------------------------------------------------
+
+# 出力形式 -> (拡張子, 保存オプション)
+OUTPUT_FORMATS = {
+    'JPEG': ('jpg', {'optimize': True, 'progressive': True}),
+    'WEBP': ('webp', {'method': 4}),
+}
+
+# 保存サイズの上限を超えた場合に下げていく品質の下限と刻み
+_MIN_QUALITY = 50
+_QUALITY_STEP = 10
+
+# EXIF の Orientation -> 正しい向きにするための変換（PIL.ImageOps.exif_transpose と同じ対応）
+_TRANSPOSE = {
+    2: Image.Transpose.FLIP_LEFT_RIGHT,
+    3: Image.Transpose.ROTATE_180,
+    4: Image.Transpose.FLIP_TOP_BOTTOM,
+    5: Image.Transpose.TRANSPOSE,
+    6: Image.Transpose.ROTATE_270,
+    7: Image.Transpose.TRANSVERSE,
+    8: Image.Transpose.ROTATE_90,
+}
+
+# 正規化せずにメタデータだけ取り除いて保存する JPEG で残すセグメント
+#   APP0（JFIF）・APP2（ICC プロファイル）・APP14（Adobe: 色変換の指定）
+_KEEP_APP_SEGMENTS = {0xE0: b'JFIF\x00', 0xE2: b'ICC_PROFILE\x00', 0xEE: b'Adobe'}
+
+ImageHeader = namedtuple('ImageHeader', ['format', 'width', 'height', 'mode'])
+
+
+class RejectedImage(Exception):
+    """取り込めない写真。メッセージはそのまま利用者に表示する。"""
+
+
+def max_long_edge():
+    return getattr(settings, 'PHOTO_INGEST_MAX_LONG_EDGE', 2048)
+
+
+def max_pixels():
+    return getattr(settings, 'PHOTO_INGEST_MAX_PIXELS', 40_000_000)
+
+
+def max_stored_bytes():
+    return getattr(settings, 'PHOTO_STORED_MAX_BYTES', 5 * 1024 * 1024)
+
+
+def output_format():
+    return getattr(settings, 'PHOTO_INGEST_FORMAT', 'JPEG').upper()
+
+
+def output_extension():
+    return OUTPUT_FORMATS[output_format()][0]
+
+
+def inspect(file):
+    """
+    画像のヘッダーだけを読み、ImageHeader を返す（画素データはデコードしない）。
+    画素数が PHOTO_INGEST_MAX_PIXELS を超える写真（展開するとメモリを使い切る画像を含む）は RejectedImage。
+    """
+    try:
+        file.seek(0)
+        with warnings.catch_warnings():
+            # 画素数の上限はこの後で判定するため、PIL の警告は出さない
+            warnings.simplefilter('ignore', Image.DecompressionBombWarning)
+            with Image.open(file) as image:
+                header = ImageHeader(image.format, image.width, image.height, image.mode)
+    except Image.DecompressionBombError:
+        raise RejectedImage("写真の画素数が大きすぎます。") from None
+    except Exception:
+        raise RejectedImage("画像として読み込めませんでした。対応している形式（JPEG・PNG など）の写真を選択してください。") from None
+    finally:
+        file.seek(0)
+
+    if header.width * header.height > max_pixels():
+        raise RejectedImage(f"写真の画素数が大きすぎます（最大 {max_pixels() // 10_000:,} 万画素）。")
+    return header
+
+
+def _file_size(file):
+    size = getattr(file, 'size', None)
+    if size is None:
+        file.seek(0, os.SEEK_END)
+        size = file.tell()
+        file.seek(0)
+    return size
+
+
+def normalize(file, destination_root, orientation=None):
+    """
+    写真 file を正規化して「destination_root + 拡張子」に書き込み、書き込んだパスを返す。
+    orientation は EXIF の向き（exif.read_metadata で読み取った値）。
+    すでに条件を満たす JPEG は再エンコードせず、メタデータのセグメントだけを取り除く。
+    """
+    header = inspect(file)
+    extension = output_extension()
+    destination = f"{destination_root}.{extension}"
+
+    if (
+        output_format() == 'JPEG' and header.format == 'JPEG' and header.mode in ('RGB', 'L')
+        and max(header.width, header.height) <= max_long_edge()
+        and orientation in (None, 1) and _file_size(file) <= max_stored_bytes()
+    ):
+        try:
+            data = strip_jpeg_metadata(file.read())
+        except ValueError:
+            logger.info("JPEG のセグメントを解析できないため再エンコードします。", exc_info=True)
+        else:
+            with open(destination, 'wb') as f:
+                f.write(data)
+            return destination
+        finally:
+            file.seek(0)
+
+    try:
+        _reencode(file, header, destination)
+    except RejectedImage:
+        raise
+    except Exception:
+        logger.warning("写真を正規化できませんでした。", exc_info=True)
+        _remove(destination)
+        raise RejectedImage("写真を読み込めませんでした。ファイルが壊れていないか確認してください。") from None
+    finally:
+        file.seek(0)
+    return destination
+
+
+def _reencode(file, header, destination):
+    edge = max_long_edge()
+    with Image.open(file) as image:
+        transpose = _TRANSPOSE.get(image.getexif().get(0x0112))
+
+        scale = edge / max(header.width, header.height)
+        if scale < 1:
+            # JPEG は出力サイズ以上で最も小さい縮尺でデコードする（メモリは元の画素数に比例しない）
+            image.draft(None, (max(1, int(header.width * scale)), max(1, int(header.height * scale))))
+        image.seek(0)
+        image.load()
+
+        icc_profile = image.info.get('icc_profile')
+        if image.mode == 'P':
+            image = image.convert('RGBA' if 'transparency' in image.info else 'RGB')
+        elif image.mode not in ('RGB', 'RGBA', 'LA', 'L'):
+            image = image.convert('RGB')
+
+        if max(image.size) > edge:
+            image.thumbnail((edge, edge), Image.Resampling.LANCZOS)
+        if transpose is not None:
+            image = image.transpose(transpose)
+
+        if image.mode in ('RGBA', 'LA'):
+            # 透過部分は白で塗る
+            background = Image.new('RGB', image.size, (255, 255, 255))
+            background.paste(image.convert('RGBA'), mask=image.getchannel('A'))
+            image = background
+
+        pil_format = output_format()
+        _, options = OUTPUT_FORMATS[pil_format]
+        if icc_profile:
+            options = {**options, 'icc_profile': icc_profile}
+
+        quality = getattr(settings, 'PHOTO_INGEST_QUALITY', 85)
+        while True:
+            image.save(destination, pil_format, quality=quality, **options)
+            if os.path.getsize(destination) <= max_stored_bytes():
+                return
+            if quality <= _MIN_QUALITY:
+                break
+            quality = max(_MIN_QUALITY, quality - _QUALITY_STEP)
+
+    _remove(destination)
+    raise RejectedImage(f"写真を {max_stored_bytes() // (1024 * 1024)}MB 以下に圧縮できませんでした。")
+
+
+def _remove(path):
+    try:
+        os.unlink(path)
+    except FileNotFoundError:
+        pass
+
+
+def _keep_segment(marker, segment):
+    if marker == 0xFE:
+        return False
+    if 0xE0 <= marker <= 0xEF:
+        signature = _KEEP_APP_SEGMENTS.get(marker)
+        return signature is not None and segment[4:].startswith(signature)
+    return True
+
+
+def strip_jpeg_metadata(data):
+    """
+    JPEG のバイト列から EXIF・XMP・IPTC・コメントなどのセグメントを取り除く（画像データは変えない）。
+    EOI より後ろに付加されたデータ（マルチピクチャの副画像など）も取り除く。
+    """
+    if data[:2] != b'\xff\xd8':
+        raise ValueError("JPEG ではありません")
+
+    out = [data[:2]]
+    pos = 2
+    length = len(data)
+    while pos + 1 < length:
+        if data[pos] != 0xFF:
+            raise ValueError(f"不正なマーカー位置: {pos}")
+        marker = data[pos + 1]
+        if marker == 0xFF:
+            pos += 1
+            continue
+        if marker == 0xD9:
+            out.append(b'\xff\xd9')
+            return b''.join(out)
+        if 0xD0 <= marker <= 0xD7 or marker == 0x01:
+            out.append(data[pos:pos + 2])
+            pos += 2
+            continue
+
+        end = pos + 2 + int.from_bytes(data[pos + 2:pos + 4], 'big')
+        if end > length:
+            raise ValueError("セグメントが途中で終わっています")
+        segment = data[pos:end]
+        if _keep_segment(marker, segment):
+            out.append(segment)
+        pos = end
+
+        if marker == 0xDA:
+            # スキャンのデータは 0xFF の後に 0x00（詰め物）か RST が続く。それ以外は次のマーカー
+            scan_end = pos
+            while True:
+                scan_end = data.find(b'\xff', scan_end)
+                if scan_end < 0 or scan_end + 1 >= length:
+                    raise ValueError("スキャンのデータが途中で終わっています")
+                following = data[scan_end + 1]
+                if following == 0x00 or 0xD0 <= following <= 0xD7:
+                    scan_end += 2
+                    continue
+                break
+            out.append(data[pos:scan_end])
+            pos = scan_end
+
+    raise ValueError("EOI がありません")
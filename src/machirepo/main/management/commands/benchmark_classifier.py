@@ -0,0 +1,209 @@
+import io
+import json
+import os
+import platform
+import resource
+import subprocess
+import sys
+import time
+from datetime import datetime
+
+import numpy as np
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from PIL import Image
+
+from main import classifier, model_loader
+from main.model_backends import forward
+
+
+# 合成画像の解像度（メガピクセル, 4:3）と形式
+DEFAULT_MEGAPIXELS = [0.3, 1, 3, 12]
+DEFAULT_FORMATS = ['JPEG', 'PNG']
+DEFAULT_BATCH_SIZES = [1, 2, 4, 8, 16, 32, 64]
+
+
+def _percentile(values, q):
+    return float(np.percentile(np.asarray(values), q)) if values else 0.0
+
+
+def _peak_rss_mb():
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def synthetic_image(megapixels, fmt, seed=0):
+    """
+    写真に近い（なめらかなグラデーション + ノイズ）合成画像を生成して符号化する。
+    ピークメモリを押し上げないよう、1/4 解像度で作ってから拡大する。
+    """
+    width = int((megapixels * 1_000_000 * 4 / 3) ** 0.5)
+    height = int(width * 3 / 4)
+    small_w, small_h = max(1, width // 4), max(1, height // 4)
+    rng = np.random.default_rng(seed)
+
+    y = np.linspace(0, 1, small_h, dtype=np.float32)[:, None, None]
+    x = np.linspace(0, 1, small_w, dtype=np.float32)[None, :, None]
+    base = np.array([30, 40, 20], dtype=np.float32) + np.array([200, 0, 90], dtype=np.float32) * x \
+        + np.array([0, 180, 90], dtype=np.float32) * y
+    pixels = np.clip(base + rng.normal(0, 12, size=(small_h, small_w, 1)), 0, 255).astype(np.uint8)
+    image = Image.fromarray(pixels).resize((width, height), Image.Resampling.BICUBIC)
+
+    buf = io.BytesIO()
+    image.save(buf, fmt, **({'quality': 90} if fmt == 'JPEG' else {}))
+    return buf.getvalue(), (width, height)
+
+
+def _git_revision():
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'],
+            cwd=settings.BASE_DIR, capture_output=True, text=True, check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+class Command(BaseCommand):
+    help = (
+        "分類処理（モデル読み込み・前処理・推論）のベンチマークを実行し、結果を JSON に保存します。"
+        "--compare で以前の結果と比較できます。"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--output', default='classifier_benchmark.json', help='結果を保存する JSON ファイル。')
+        parser.add_argument('--compare', help='比較対象とする以前の結果 JSON。')
+        parser.add_argument('--iterations', type=int, default=20, help='画像サイズ・形式ごとの計測回数。')
+        parser.add_argument(
+            '--megapixels', default=','.join(str(m) for m in DEFAULT_MEGAPIXELS),
+            help='合成画像の解像度（メガピクセル, カンマ区切り）。',
+        )
+        parser.add_argument(
+            '--batch-sizes', default=','.join(str(b) for b in DEFAULT_BATCH_SIZES),
+            help='スループットを測るバッチサイズ（カンマ区切り）。',
+        )
+        parser.add_argument('--seconds', type=float, default=2.0, help='バッチサイズごとのスループット計測時間。')
+
+    def handle(self, *args, **options):
+        if 'torch' in sys.modules:
+            self.stderr.write("注意: torch は既に読み込まれているため、コールドスタート時間は import を含みません。")
+
+        megapixels = [float(m) for m in options['megapixels'].split(',') if m]
+        batch_sizes = [int(b) for b in options['batch_sizes'].split(',') if b]
+        iterations = max(1, options['iterations'])
+
+        report = {
+            'created_at': datetime.now().isoformat(timespec='seconds'),
+            'git_revision': _git_revision(),
+            'environment': {
+                'python': platform.python_version(),
+                'platform': platform.platform(),
+                'cpu_count': os.cpu_count(),
+                'model_version': model_loader.model_version(),
+                'backend': model_loader.backend_name(),
+            },
+        }
+
+        # 1. コールドスタート（torch の import + モデル構築）
+        started = time.perf_counter()
+        import torch
+        import_seconds = time.perf_counter() - started
+        started = time.perf_counter()
+        model = model_loader.get_model()
+        load_seconds = time.perf_counter() - started
+        report['environment'].update({'torch': torch.__version__, 'torch_threads': torch.get_num_threads()})
+        report['cold_start'] = {
+            'torch_import_ms': import_seconds * 1000,
+            'model_load_ms': load_seconds * 1000,
+            'rss_after_load_mb': _peak_rss_mb(),
+        }
+        self.stdout.write(f"コールドスタート: import {import_seconds:.2f}秒 + 読み込み {load_seconds:.2f}秒")
+
+        with torch.no_grad():
+            forward(model, torch.zeros(1, 3, 224, 224))
+
+            # 2. 1枚あたりのレイテンシ（デコード + 前処理 + 推論）
+            report['latency'] = []
+            for mp in megapixels:
+                for fmt in DEFAULT_FORMATS:
+                    data, size = synthetic_image(mp, fmt)
+                    preprocess_ms, total_ms = [], []
+                    for _ in range(iterations):
+                        t0 = time.perf_counter()
+                        tensor = classifier.preprocess_image(data)
+                        t1 = time.perf_counter()
+                        forward(model, tensor)
+                        t2 = time.perf_counter()
+                        preprocess_ms.append((t1 - t0) * 1000)
+                        total_ms.append((t2 - t0) * 1000)
+
+                    entry = {
+                        'megapixels': mp,
+                        'format': fmt,
+                        'size': list(size),
+                        'bytes': len(data),
+                        'preprocess_p50_ms': _percentile(preprocess_ms, 50),
+                        'p50_ms': _percentile(total_ms, 50),
+                        'p95_ms': _percentile(total_ms, 95),
+                        'p99_ms': _percentile(total_ms, 99),
+                    }
+                    report['latency'].append(entry)
+                    self.stdout.write(
+                        f"{mp:>5}MP {fmt:<4} 前処理 p50 {entry['preprocess_p50_ms']:7.1f}ms / "
+                        f"合計 p50 {entry['p50_ms']:7.1f}ms p95 {entry['p95_ms']:7.1f}ms p99 {entry['p99_ms']:7.1f}ms"
+                    )
+
+            # 3. バッチサイズごとのスループット（前処理済みテンソル）
+            report['throughput'] = []
+            for batch_size in batch_sizes:
+                batch = torch.randn(batch_size, 3, 224, 224)
+                forward(model, batch)
+                images = 0
+                started = time.perf_counter()
+                while time.perf_counter() - started < options['seconds']:
+                    forward(model, batch)
+                    images += batch_size
+                elapsed = time.perf_counter() - started
+                entry = {'batch_size': batch_size, 'images_per_sec': images / elapsed}
+                report['throughput'].append(entry)
+                self.stdout.write(f"batch {batch_size:>3}: {entry['images_per_sec']:8.1f} 枚/秒")
+
+        report['peak_rss_mb'] = _peak_rss_mb()
+        self.stdout.write(f"ピークRSS: {report['peak_rss_mb']:.0f} MB")
+
+        with open(options['output'], 'w', encoding='utf-8') as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        self.stdout.write(self.style.SUCCESS(f"結果を保存しました: {options['output']}"))
+
+        if options['compare']:
+            self._compare(report, options['compare'])
+
+    def _compare(self, current, previous_path):
+        try:
+            with open(previous_path, encoding='utf-8') as f:
+                previous = json.load(f)
+        except (OSError, ValueError) as e:
+            raise CommandError(f"比較対象を読み込めません: {e}")
+
+        self.stdout.write(f"\n比較: {previous.get('git_revision')} -> {current.get('git_revision')}（+ は悪化）")
+
+        def line(label, before, after, higher_is_better=False):
+            if not before:
+                return
+            change = (after - before) / before * (-1 if higher_is_better else 1)
+            self.stdout.write(f"  {label:<28} {before:10.1f} -> {after:10.1f}  {change:+.1%}")
+
+        line('model_load_ms', previous['cold_start']['model_load_ms'], current['cold_start']['model_load_ms'])
+
+        before_latency = {(e['megapixels'], e['format']): e for e in previous.get('latency', [])}
+        for entry in current['latency']:
+            before = before_latency.get((entry['megapixels'], entry['format']))
+            if before:
+                line(f"{entry['megapixels']}MP {entry['format']} p95_ms", before['p95_ms'], entry['p95_ms'])
+
+        before_throughput = {e['batch_size']: e for e in previous.get('throughput', [])}
+        for entry in current['throughput']:
+            before = before_throughput.get(entry['batch_size'])
+            if before:
+                line(f"batch {entry['batch_size']} 枚/秒", before['images_per_sec'], entry['images_per_sec'], True)
+
+        line('peak_rss_mb', previous['peak_rss_mb'], current['peak_rss_mb'])
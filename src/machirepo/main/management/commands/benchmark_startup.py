@@ -0,0 +1,62 @@
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+
+# 子プロセスで実行するスクリプト。最後の行に「RSS(KB) torchの読み込み有無」を出力する。
+PROBE_TEMPLATE = """
+import os, resource, sys
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', {settings_module!r})
+import django
+django.setup()
+from django.urls import resolve
+resolve('/')
+import main.views
+{extra}
+rss_kb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+print(rss_kb, 'torch' in sys.modules)
+"""
+
+SCENARIOS = [
+    ('lazy', 'Django 起動 + main.views import（遅延読み込み）', ''),
+    ('eager', '起動時にモデルを読み込んだ場合', 'from main import model_loader; model_loader.get_model()'),
+]
+
+
+class Command(BaseCommand):
+    help = "Django の起動時間とメモリ使用量を、モデルの遅延読み込み/即時読み込みで比較します。"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--runs', type=int, default=5, help='各シナリオの計測回数。')
+
+    def handle(self, *args, **options):
+        runs = max(1, options['runs'])
+        env = dict(os.environ, MACHIREPO_CLASSIFIER_EAGER_LOAD='0')
+
+        for key, description, extra in SCENARIOS:
+            script = PROBE_TEMPLATE.format(settings_module=os.environ['DJANGO_SETTINGS_MODULE'], extra=extra)
+            durations = []
+            rss_kb = 0
+            torch_loaded = False
+
+            for _ in range(runs):
+                started = time.perf_counter()
+                proc = subprocess.run(
+                    [sys.executable, '-c', script],
+                    cwd=settings.BASE_DIR, env=env, capture_output=True, text=True, check=True,
+                )
+                durations.append(time.perf_counter() - started)
+                rss, torch_flag = proc.stdout.strip().splitlines()[-1].split()
+                rss_kb = max(rss_kb, int(rss))
+                torch_loaded = torch_flag == 'True'
+
+            self.stdout.write(
+                f"[{key}] {description}\n"
+                f"  起動時間: 中央値 {statistics.median(durations):.2f}秒 / 最小 {min(durations):.2f}秒 ({runs}回)\n"
+                f"  最大RSS: {rss_kb / 1024:.0f} MB / torch 読み込み: {'あり' if torch_loaded else 'なし'}"
+            )
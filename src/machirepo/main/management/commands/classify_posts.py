@@ -0,0 +1,51 @@
+from django.core.management.base import BaseCommand
+
+from main import classifier, model_loader
+from main.models import PhotoPost
+
+
+class Command(BaseCommand):
+    help = "AI分類結果が保存されていない既存の投稿を分類し、結果を保存します。"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--all',
+            action='store_true',
+            help='分類済みの投稿も含め、すべての投稿を再分類します。',
+        )
+        parser.add_argument(
+            '--outdated',
+            action='store_true',
+            help='現在のモデル（CLASSIFIER_MODEL_PATH）以外で分類された投稿も再分類します。',
+        )
+        parser.add_argument(
+            '--limit',
+            type=int,
+            default=None,
+            help='処理する投稿数の上限。',
+        )
+
+    def handle(self, *args, **options):
+        posts = PhotoPost.objects.order_by('pk')
+        if options['outdated']:
+            posts = posts.exclude(ai_model_version=model_loader.model_version())
+        elif not options['all']:
+            posts = posts.filter(ai_label='')
+
+        if options['limit']:
+            posts = posts[:options['limit']]
+
+        done = 0
+        failed = 0
+        for post in posts.iterator(chunk_size=200):
+            try:
+                result = classifier.classify_post(post)
+            except Exception as e:
+                failed += 1
+                self.stderr.write(f"報告ID {post.pk}: 分類に失敗しました ({e})")
+                continue
+
+            done += 1
+            self.stdout.write(f"報告ID {post.pk}: {result['label']} ({result['confidence']:.1%})")
+
+        self.stdout.write(self.style.SUCCESS(f"分類完了: {done} 件 / 失敗: {failed} 件"))
@@ -0,0 +1,134 @@
+import argparse
+import json
+import resource
+import statistics
+import subprocess
+import sys
+import time
+from pathlib import Path
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from main import classifier
+from main.model_backends import BUILDERS, IMAGE_EXTENSIONS
+
+
+def _labeled_images(folder):
+    """フォルダ内の画像を列挙する。親フォルダ名がカテゴリ名なら正解ラベルとして扱う。"""
+    for path in sorted(folder.rglob('*')):
+        if path.suffix.lower() in IMAGE_EXTENSIONS:
+            label = path.parent.name if path.parent.name in classifier.CATEGORIES else None
+            yield path, label
+
+
+class Command(BaseCommand):
+    help = (
+        "推論バックエンド（fp32 eager / TorchScript / int8 量子化）を、ラベル付き写真フォルダで比較します。"
+        "フォルダは <folder>/<カテゴリ名>/*.jpg の構成を想定しています。"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('folder', help='比較に使う写真のフォルダ。')
+        parser.add_argument(
+            '--backends',
+            default=','.join(BUILDERS),
+            help=f"比較するバックエンド（カンマ区切り, 既定: {','.join(BUILDERS)}）。",
+        )
+        parser.add_argument('--warmup', type=int, default=3, help='計測前のウォームアップ回数。')
+        parser.add_argument('--worker', help=argparse.SUPPRESS)
+
+    def handle(self, *args, **options):
+        folder = Path(options['folder'])
+        if not folder.is_dir():
+            raise CommandError(f"フォルダが見つかりません: {folder}")
+
+        if options['worker']:
+            return self._run_worker(options['worker'], folder, options['warmup'])
+
+        backends = [b.strip() for b in options['backends'].split(',') if b.strip()]
+        unknown = set(backends) - set(BUILDERS)
+        if unknown:
+            raise CommandError(f"不明なバックエンド: {', '.join(sorted(unknown))}")
+        if 'eager' not in backends:
+            backends.insert(0, 'eager')
+
+        images = list(_labeled_images(folder))
+        if not images:
+            raise CommandError(f"画像が見つかりません: {folder}")
+        truth = {str(path): label for path, label in images}
+
+        reports = {}
+        for backend in backends:
+            self.stdout.write(f"{backend}: 計測中...")
+            reports[backend] = self._spawn_worker(backend, folder, options['warmup'])
+
+        baseline = reports['eager']['predictions']
+        self.stdout.write("")
+        self.stdout.write(
+            f"{'backend':<14}{'build(s)':>9}{'p50(ms)':>9}{'p95(ms)':>9}{'mean(ms)':>10}"
+            f"{'peakRSS(MB)':>12}{'fp32一致':>10}{'正解率':>8}"
+        )
+        for backend, report in reports.items():
+            predictions = report['predictions']
+            latencies = sorted(report['latencies_ms'])
+            agree = sum(predictions[k] == baseline[k] for k in baseline) / len(baseline)
+
+            labeled = [k for k, v in truth.items() if v]
+            accuracy = (
+                f"{sum(predictions[k] == truth[k] for k in labeled) / len(labeled):.1%}"
+                if labeled else '-'
+            )
+            p95 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))]
+            self.stdout.write(
+                f"{backend:<14}{report['build_seconds']:>9.2f}{statistics.median(latencies):>9.1f}{p95:>9.1f}"
+                f"{statistics.fmean(latencies):>10.1f}{report['peak_rss_mb']:>12.0f}{agree:>10.1%}{accuracy:>8}"
+            )
+
+            changed = [k for k in baseline if predictions[k] != baseline[k]]
+            for key in changed[:10]:
+                self.stdout.write(f"    判定変化: {key}: {baseline[key]} -> {predictions[key]}")
+
+    def _spawn_worker(self, backend, folder, warmup):
+        # バックエンドごとに別プロセスで計測し、ピークメモリが混ざらないようにする
+        proc = subprocess.run(
+            [sys.executable, str(Path(settings.BASE_DIR) / 'manage.py'), 'compare_classifier_backends', str(folder),
+             '--worker', backend, '--warmup', str(warmup)],
+            capture_output=True, text=True,
+        )
+        if proc.returncode != 0:
+            raise CommandError(f"{backend} の計測に失敗しました:\n{proc.stderr}")
+        return json.loads(proc.stdout.strip().splitlines()[-1])
+
+    def _run_worker(self, backend, folder, warmup):
+        import torch
+
+        from main import model_loader
+        from main.model_backends import forward
+
+        started = time.perf_counter()
+        model = model_loader.load_model(backend)
+        build_seconds = time.perf_counter() - started
+
+        tensors = [(str(path), classifier.preprocess_image(path.read_bytes())) for path, _ in _labeled_images(folder)]
+
+        with torch.no_grad():
+            for _ in range(warmup):
+                forward(model, tensors[0][1])
+
+            predictions = {}
+            latencies = []
+            for key, tensor in tensors:
+                t = time.perf_counter()
+                output, _ = forward(model, tensor)
+                latencies.append((time.perf_counter() - t) * 1000)
+                predictions[key] = classifier.CATEGORIES[int(torch.argmax(output, dim=1).item())]
+
+        peak_rss_mb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+        self.stdout.write(json.dumps({
+            'build_seconds': build_seconds,
+            'latencies_ms': latencies,
+            'peak_rss_mb': peak_rss_mb,
+            'predictions': predictions,
+        }, ensure_ascii=False))
+
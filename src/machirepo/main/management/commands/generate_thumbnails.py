@@ -0,0 +1,59 @@
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+from django.core.management.base import BaseCommand
+
+from main import thumbnails
+from main.media_storage import photo_storage
+from main.models import PhotoPost
+
+
+def _generate(name):
+    """ワーカープロセスで派生画像を生成する（失敗時はエラー内容を返す）。"""
+    try:
+        return name, thumbnails.generate_derivatives(name, photo_storage()), None
+    except Exception as e:
+        return name, None, str(e)
+
+
+class Command(BaseCommand):
+    help = "保存済みの投稿写真の縮小画像（WebP / JPEG）を複数プロセスで一括生成します。"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--all',
+            action='store_true',
+            help='生成済みの投稿も含め、すべての縮小画像を作り直します。',
+        )
+        parser.add_argument('--workers', type=int, default=os.cpu_count() or 1, help='生成に使うプロセス数。')
+
+    def handle(self, *args, **options):
+        posts = [
+            post for post in PhotoPost.objects.order_by('pk').only('pk', 'photo', 'photo_derivatives').iterator()
+            if post.photo and (options['all'] or not post.has_derivatives)
+        ]
+        names = sorted({post.photo.name for post in posts})
+        self.stdout.write(f"対象: {len(posts)} 件（写真 {len(names)} 枚）")
+        if not names:
+            return
+
+        results = {}
+        failed = 0
+        with ProcessPoolExecutor(max_workers=max(1, options['workers'])) as pool:
+            for done, (name, generated, error) in enumerate(pool.map(_generate, names, chunksize=8), 1):
+                if error is not None:
+                    failed += 1
+                    self.stderr.write(f"{name}: 縮小画像を生成できませんでした ({error})")
+                else:
+                    results[name] = generated
+                if done % 100 == 0:
+                    self.stdout.write(f"{done}/{len(names)}")
+
+        updated = []
+        for post in posts:
+            if post.photo.name in results:
+                post.photo_derivatives = {'source': post.photo.name, 'widths': results[post.photo.name]}
+                updated.append(post)
+        PhotoPost.objects.bulk_update(updated, ['photo_derivatives'], batch_size=500)
+
+        self.stdout.write(self.style.SUCCESS(f"生成完了: {len(updated)} 件 / 失敗: {failed} 枚"))
@@ -0,0 +1,46 @@
+from django.core.management.base import BaseCommand
+
+from main import photo_hashing
+from main.models import PhotoPost
+
+
+HASH_FIELDS = ['photo_sha256', 'photo_phash'] + [f'photo_phash_band{i}' for i in range(photo_hashing.PHASH_BANDS)]
+
+
+class Command(BaseCommand):
+    help = "保存済みの投稿写真の SHA-256 と知覚ハッシュを計算して保存します（重複検出用）。"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--all',
+            action='store_true',
+            help='計算済みの投稿も含め、すべての投稿を再計算します。',
+        )
+
+    def handle(self, *args, **options):
+        posts = PhotoPost.objects.order_by('pk').only('pk', 'photo', *HASH_FIELDS)
+        if not options['all']:
+            posts = posts.filter(photo_sha256='')
+
+        updated = []
+        done = failed = 0
+        for post in posts.iterator(chunk_size=200):
+            try:
+                with post.photo.open('rb') as f:
+                    fields = photo_hashing.hash_fields(*photo_hashing.compute_hashes(f))
+            except Exception as e:
+                failed += 1
+                self.stderr.write(f"報告ID {post.pk}: 写真を読み込めませんでした ({e})")
+                continue
+
+            for name, value in fields.items():
+                setattr(post, name, value)
+            updated.append(post)
+            done += 1
+
+            if len(updated) >= 200:
+                PhotoPost.objects.bulk_update(updated, HASH_FIELDS)
+                updated = []
+
+        PhotoPost.objects.bulk_update(updated, HASH_FIELDS)
+        self.stdout.write(self.style.SUCCESS(f"ハッシュ計算完了: {done} 件 / 失敗: {failed} 件"))
@@ -0,0 +1,329 @@
+import os
+import time
+import uuid
+from datetime import timedelta
+from pathlib import Path
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Exists, OuterRef
+from django.utils import timezone
+
+from main import chunked_uploads, direct_uploads, staging
+from main.media_gc import DERIVATIVE_PATTERN, derivative_names
+from main.media_storage import ContentAddressedMixin, photo_storage
+from main.models import ChunkedUpload, MediaBlob, PhotoPost, PhotoPostDraft, StagedUpload
+
+
+IMAGE_EXTENSIONS = {'.jpg', '.jpeg', '.png', '.webp', '.gif', '.bmp', '.heic'}
+
+
+def _valid_uuids(values):
+    valid = []
+    for value in values:
+        try:
+            valid.append(uuid.UUID(value))
+        except ValueError:
+            pass
+    return valid
+
+
+def _format_bytes(size):
+    for unit in ('B', 'KB', 'MB', 'GB'):
+        if size < 1024 or unit == 'GB':
+            return f"{size:.1f} {unit}" if unit != 'B' else f"{size} B"
+        size /= 1024
+
+
+class Command(BaseCommand):
+    help = (
+        "どの投稿からも参照されていない写真ファイルを削除します。"
+        "期限切れの投稿の下書き・ステージング写真・分割アップロード、MEDIA_ROOT 直下に残った旧形式の一時ファイル、"
+        "media/photos 以下の孤立した写真・縮小画像が対象です（孤立したファイルの走査はローカルの MEDIA_ROOT のみ）。"
+        "写真の保存先がオブジェクトストレージの場合は、期限切れの直接アップロードと参照数 0 の写真も削除します。"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true', help='削除せず、対象と回収できる容量だけを表示します。')
+        parser.add_argument('--batch-size', type=int, default=500, help='1回の DB 照合でまとめるファイル数（既定: 500）。')
+        parser.add_argument(
+            '--max-deletes-per-second', type=float, default=0,
+            help='1秒あたりの削除数の上限（既定: 0 = 制限なし）。',
+        )
+        parser.add_argument(
+            '--min-age-hours', type=float, default=1,
+            help='更新からこの時間が経っていないファイルは削除しません（投稿処理中の写真を守るため, 既定: 1）。',
+        )
+        parser.add_argument('--verbose-files', action='store_true', help='削除する（した）ファイルを1件ずつ表示します。')
+
+    def handle(self, *args, **options):
+        self.dry_run = options['dry_run']
+        self.batch_size = max(1, options['batch_size'])
+        self.min_interval = 1 / options['max_deletes_per_second'] if options['max_deletes_per_second'] > 0 else 0
+        self.verbose_files = options['verbose_files']
+        self.last_delete = 0.0
+        self.report = {}
+
+        now = time.time()
+        self.min_age = timedelta(hours=options['min_age_hours'])
+        self.min_age_cutoff = now - self.min_age.total_seconds()
+        self.staging_cutoff = now - staging.ttl().total_seconds()
+
+        self._collect_expired_drafts()
+        self._collect_expired_staged_uploads()
+        self._collect_staging_orphans()
+        self._collect_chunked_uploads()
+        self._collect_direct_uploads()
+        self._collect_legacy_temp_files()
+        self._collect_unreferenced_blobs()
+        self._collect_photo_orphans()
+
+        self.stdout.write("")
+        total_files = total_bytes = 0
+        for category, (count, size) in self.report.items():
+            total_files += count
+            total_bytes += size
+            self.stdout.write(f"{category:<24} {count:>8} 件 {_format_bytes(size):>12}")
+        label = "回収できる容量" if self.dry_run else "回収した容量"
+        self.stdout.write(self.style.SUCCESS(f"合計: {total_files} 件 / {label}: {_format_bytes(total_bytes)}"))
+
+    # -----------------------------------------------------
+    # 削除（レート制限付き）
+    # -----------------------------------------------------
+
+    def _delete(self, category, path, size=None, storage=None):
+        """path のファイルを削除する（storage を指定した場合は path をそのストレージの名前として削除する）。"""
+        if size is None:
+            try:
+                size = storage.size(path) if storage is not None else os.path.getsize(path)
+            except OSError:
+                return
+
+        if not self.dry_run:
+            if self.min_interval:
+                wait = self.last_delete + self.min_interval - time.monotonic()
+                if wait > 0:
+                    time.sleep(wait)
+                self.last_delete = time.monotonic()
+            try:
+                if storage is not None:
+                    storage.delete(path)
+                else:
+                    os.unlink(path)
+            except FileNotFoundError:
+                return
+            except Exception as e:
+                self.stderr.write(f"{path}: 削除できませんでした ({e})")
+                return
+
+        count, total = self.report.get(category, (0, 0))
+        self.report[category] = (count + 1, total + size)
+        if self.verbose_files:
+            self.stdout.write(f"  {category}: {path} ({_format_bytes(size)})")
+
+    def _remove_empty_dir(self, path):
+        if not self.dry_run:
+            try:
+                os.rmdir(path)
+            except OSError:
+                pass
+
+    # -----------------------------------------------------
+    # ステージング領域
+    # -----------------------------------------------------
+
+    def _collect_expired_drafts(self):
+        """期限切れの投稿の下書き。写真は下書きと同じ期限のステージング写真として次に削除される。"""
+        expired = PhotoPostDraft.objects.filter(expires_at__lt=timezone.now())
+        names = [name for name in expired.values_list('photo_name', flat=True) if name]
+        count = len(expired) if self.dry_run else expired.delete()[0]
+        if not self.dry_run and names:
+            StagedUpload.objects.filter(name__in=names, expires_at__gt=timezone.now()).update(expires_at=timezone.now())
+        if count:
+            self.report['期限切れの投稿の下書き'] = (count, 0)
+
+    def _collect_expired_staged_uploads(self):
+        expired = StagedUpload.objects.filter(expires_at__lt=timezone.now()).order_by('pk')
+        for upload in expired.iterator(chunk_size=self.batch_size):
+            staged_path = staging.path(upload.name)
+            self._delete('期限切れのステージング写真', staged_path)
+            if not self.dry_run:
+                upload.delete()
+                self._remove_empty_dir(os.path.dirname(staged_path))
+
+    def _collect_staging_orphans(self):
+        """StagedUpload の記録がないまま期限を過ぎたステージング写真（異常終了時の残骸など）。"""
+        root = Path(settings.PHOTO_STAGING_ROOT)
+        if not root.is_dir():
+            return
+
+        batch = []
+        with os.scandir(root) as entries:
+            for entry in entries:
+                if not entry.is_dir(follow_symlinks=False) or entry.name == chunked_uploads.CHUNK_DIRECTORY:
+                    continue
+                with os.scandir(entry.path) as files:
+                    for f in files:
+                        if f.is_file(follow_symlinks=False):
+                            batch.append((f"{entry.name}/{f.name}", f))
+                if len(batch) >= self.batch_size:
+                    self._delete_unknown_staged(batch)
+                    batch = []
+        self._delete_unknown_staged(batch)
+
+    def _delete_unknown_staged(self, batch):
+        if not batch:
+            return
+        known = set(StagedUpload.objects.filter(name__in=[name for name, _ in batch]).values_list('name', flat=True))
+        for name, entry in batch:
+            stat = entry.stat(follow_symlinks=False)
+            if name not in known and stat.st_mtime < self.staging_cutoff:
+                self._delete('記録のないステージング写真', entry.path, stat.st_size)
+                self._remove_empty_dir(os.path.dirname(entry.path))
+
+    def _collect_chunked_uploads(self):
+        """期限切れの分割アップロードと、記録のない分割アップロードの一時ファイル。"""
+        expired = ChunkedUpload.objects.filter(expires_at__lt=timezone.now()).order_by('pk')
+        for upload in expired.iterator(chunk_size=self.batch_size):
+            self._delete('期限切れの分割アップロード', chunked_uploads.part_path(upload))
+            if not self.dry_run:
+                upload.delete()
+
+        chunk_root = Path(settings.PHOTO_STAGING_ROOT) / chunked_uploads.CHUNK_DIRECTORY
+        if not chunk_root.is_dir():
+            return
+        with os.scandir(chunk_root) as entries:
+            files = [entry for entry in entries if entry.is_file(follow_symlinks=False)]
+        for start in range(0, len(files), self.batch_size):
+            batch = files[start:start + self.batch_size]
+            ids = {entry.name.split('.', 1)[0] for entry in batch}
+            known = {str(pk) for pk in ChunkedUpload.objects.filter(pk__in=_valid_uuids(ids)).values_list('pk', flat=True)}
+            for entry in batch:
+                stat = entry.stat(follow_symlinks=False)
+                if entry.name.split('.', 1)[0] not in known and stat.st_mtime < self.staging_cutoff:
+                    self._delete('記録のない分割アップロード', entry.path, stat.st_size)
+
+    def _collect_direct_uploads(self):
+        """オブジェクトストレージに直接アップロードされたまま、確定されなかった写真と未完了のマルチパート。"""
+        storage = direct_uploads.storage()
+        if storage is None:
+            return
+
+        cutoff = timezone.now() - staging.ttl()
+        prefix = f"{direct_uploads.incoming_prefix()}/"
+        for item in storage.list_objects(prefix):
+            if item.last_modified < cutoff:
+                self._delete('期限切れの直接アップロード', item.name, item.size, storage=storage)
+        for upload in storage.list_multipart_uploads(prefix):
+            if upload.initiated < cutoff:
+                if not self.dry_run:
+                    storage.abort_multipart_upload(upload.name, upload.upload_id)
+                count, total = self.report.get('未完了のマルチパート', (0, 0))
+                self.report['未完了のマルチパート'] = (count + 1, total)
+
+    # -----------------------------------------------------
+    # MEDIA_ROOT 直下の旧形式の一時ファイル
+    # -----------------------------------------------------
+
+    def _collect_legacy_temp_files(self):
+        """ステージング領域の導入前に、投稿フローが MEDIA_ROOT 直下に保存していた一時ファイル。"""
+        root = Path(settings.MEDIA_ROOT)
+        if not root.is_dir():
+            return
+
+        with os.scandir(root) as entries:
+            candidates = [
+                entry for entry in entries
+                if entry.is_file(follow_symlinks=False)
+                and os.path.splitext(entry.name)[1].lower() in IMAGE_EXTENSIONS
+            ]
+
+        for start in range(0, len(candidates), self.batch_size):
+            batch = candidates[start:start + self.batch_size]
+            referenced = set(
+                PhotoPost.objects.filter(photo__in=[entry.name for entry in batch]).values_list('photo', flat=True)
+            )
+            for entry in batch:
+                stat = entry.stat(follow_symlinks=False)
+                if entry.name not in referenced and stat.st_mtime < self.staging_cutoff:
+                    self._delete('旧形式の一時ファイル', entry.path, stat.st_size)
+
+    # -----------------------------------------------------
+    # media/photos 以下
+    # -----------------------------------------------------
+
+    def _collect_unreferenced_blobs(self):
+        """参照数が 0 になった写真ファイル（内容の名前で保存するストレージ）と、その縮小画像。"""
+        storage = photo_storage()
+        if not isinstance(storage, ContentAddressedMixin):
+            return
+
+        cutoff = timezone.now() - self.min_age
+        blobs = MediaBlob.objects.filter(refcount__lte=0, created_at__lt=cutoff).exclude(
+            Exists(PhotoPost.objects.filter(photo=OuterRef('name')))
+        ).order_by('name')
+        for blob in blobs.iterator(chunk_size=self.batch_size):
+            # 一覧を取ってから同じ内容が保存（register）された場合は削除しない。記録を消してから
+            # ファイルを消し終えるまでは、同じ内容の保存を待たせる
+            with transaction.atomic():
+                if not self.dry_run and not storage.claim_unreferenced(blob.name, cutoff):
+                    continue
+                for name in [blob.name] + derivative_names(blob.name):
+                    category = '参照数 0 の写真ファイル' if name == blob.name else '参照のない縮小画像'
+                    try:
+                        path = storage.path(name)
+                    except NotImplementedError:
+                        if storage.exists(name):
+                            self._delete(category, name, storage=storage)
+                        continue
+                    if os.path.exists(path):
+                        self._delete(category, path)
+
+    def _collect_photo_orphans(self):
+        """
+        photos 以下をディレクトリ単位で走査し、投稿から参照されていない写真と、
+        元の写真が参照されていない縮小画像を削除する。DB とは batch_size 件ずつ照合する。
+        """
+        media_root = Path(settings.MEDIA_ROOT)
+        photos_root = media_root / 'photos'
+        if not photos_root.is_dir():
+            return
+
+        for dirpath, _, filenames in os.walk(photos_root):
+            relative_dir = Path(dirpath).relative_to(media_root).as_posix()
+            originals, derivatives = [], []
+            for filename in filenames:
+                match = DERIVATIVE_PATTERN.match(filename)
+                if match:
+                    derivatives.append((filename, match.group('root')))
+                else:
+                    originals.append(filename)
+
+            referenced_roots = set()
+            for start in range(0, len(originals), self.batch_size):
+                batch = originals[start:start + self.batch_size]
+                names = {f"{relative_dir}/{filename}": filename for filename in batch}
+                kept = set(PhotoPost.objects.filter(photo__in=list(names)).values_list('photo', flat=True))
+                # MediaBlob に記録のある写真は _collect_unreferenced_blobs が記録の日時で判断する
+                # （同じ内容を再び保存しても、既存のファイルの更新日時は変わらない）
+                kept |= set(MediaBlob.objects.filter(name__in=list(names)).values_list('name', flat=True))
+                for name, filename in names.items():
+                    if name in kept:
+                        referenced_roots.add(os.path.splitext(filename)[0])
+                    else:
+                        self._delete_if_old('参照のない写真', os.path.join(dirpath, filename))
+
+            for filename, root in derivatives:
+                if root not in referenced_roots:
+                    self._delete_if_old('参照のない縮小画像', os.path.join(dirpath, filename))
+
+    def _delete_if_old(self, category, path):
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return False
+        if stat.st_mtime < self.min_age_cutoff:
+            self._delete(category, path, stat.st_size)
+            return True
+        return False
@@ -0,0 +1,138 @@
+import os
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db.models import Count, Exists, OuterRef
+
+from main import media_gc, photo_hashing, thumbnails
+from main.media_storage import ContentAddressedStorage, photo_storage
+from main.models import MediaBlob, PhotoPost
+
+
+class Command(BaseCommand):
+    help = (
+        "既存の投稿写真を内容のハッシュによる名前（photos/ab/cd/<sha256>.jpg）に移し、投稿の photo を書き換えます。"
+        "同じ内容の写真は1つのファイルにまとめ、最後に写真ファイルの参照数を数え直します。"
+        "写真はハードリンクで移すため、データはコピーしません。"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true', help='移行せず、移行する写真の数だけを表示します。')
+        parser.add_argument('--batch-size', type=int, default=500, help='1回に読み出す写真の名前の数（既定: 500）。')
+
+    def handle(self, *args, **options):
+        storage = photo_storage()
+        if not isinstance(storage, ContentAddressedStorage):
+            raise CommandError("settings.STORAGES['photos'] が ContentAddressedStorage ではありません。")
+
+        self.storage = storage
+        self.dry_run = options['dry_run']
+        batch_size = max(1, options['batch_size'])
+
+        migrated = merged = missing = 0
+        last = ''
+        while True:
+            # 名前の順に batch_size 件ずつ読み出す（書き換えた名前は移行済みとして読み飛ばす）
+            names = list(
+                PhotoPost.objects.filter(photo__gt=last).order_by('photo')
+                .values_list('photo', flat=True).distinct()[:batch_size]
+            )
+            if not names:
+                break
+            last = names[-1]
+
+            for name in names:
+                if storage.is_content_name(name):
+                    continue
+                if not storage.exists(name):
+                    missing += 1
+                    self.stderr.write(f"{name}: ファイルが見つかりません")
+                    continue
+
+                new_name, existed = self._migrate(name)
+                migrated += 1
+                merged += existed
+                if self.dry_run:
+                    self.stdout.write(f"{name} -> {new_name}")
+
+        if self.dry_run:
+            self.stdout.write(self.style.SUCCESS(
+                f"移行対象: {migrated} 件（同じ内容の写真: {merged} 件）/ ファイルなし: {missing} 件"
+            ))
+            return
+
+        blobs = self._recount(batch_size)
+        self.stdout.write(self.style.SUCCESS(
+            f"移行完了: {migrated} 件（同じ内容の写真にまとめた数: {merged} 件）/ ファイルなし: {missing} 件"
+            f" / 参照数を数え直した写真ファイル: {blobs} 件"
+        ))
+
+    def _migrate(self, name):
+        """写真 name を内容の名前に移し、(新しい名前, 同じ内容の写真が既にあったか) を返す。"""
+        storage = self.storage
+        new_name = storage.content_name(photo_hashing.file_sha256(storage.path(name)), os.path.splitext(name)[1])
+        existed = storage.exists(new_name)
+        if self.dry_run:
+            return new_name, existed
+
+        storage.link_file(storage.path(name), new_name)
+
+        # 縮小画像も新しい名前に移す（同じ内容の写真の縮小画像が既にあればそちらを使う）
+        posts = PhotoPost.objects.filter(photo=name)
+        derivatives = (
+            posts.filter(photo_derivatives__source=name).values_list('photo_derivatives', flat=True).first()
+        )
+        if derivatives:
+            complete = True
+            for width in derivatives['widths']:
+                for fmt in thumbnails.FORMATS:
+                    old_path = storage.path(thumbnails.derivative_name(name, width, fmt))
+                    new_path = storage.path(thumbnails.derivative_name(new_name, width, fmt))
+                    try:
+                        os.link(old_path, new_path)
+                    except FileExistsError:
+                        pass
+                    except FileNotFoundError:
+                        complete = False
+            derivatives = {'source': new_name, 'widths': derivatives['widths']} if complete else None
+
+        posts.update(photo=new_name, photo_derivatives=derivatives)
+        # 移行前の名前を参照する投稿はなくなったため、元のファイルと縮小画像を削除する（データはリンク先に残る）
+        media_gc.delete_photo_if_unreferenced(name, storage)
+        if not derivatives:
+            for pk in PhotoPost.objects.filter(photo=new_name, photo_derivatives__isnull=True).values_list('pk', flat=True):
+                thumbnails.schedule(pk)
+        return new_name, existed
+
+    def _recount(self, batch_size):
+        """写真ファイルの参照数を、実際に参照している投稿の数に合わせる。"""
+        storage = self.storage
+        counts = (
+            PhotoPost.objects.filter(photo__startswith=f"{storage.prefix}/")
+            .values('photo').annotate(references=Count('pk')).order_by('photo')
+        )
+
+        total = 0
+        batch = []
+        for row in counts.iterator(chunk_size=batch_size):
+            name = row['photo']
+            if not storage.is_content_name(name):
+                continue
+            size = storage.size(name) if storage.exists(name) else 0
+            batch.append(MediaBlob(name=name, size=size, refcount=row['references']))
+            if len(batch) >= batch_size:
+                total += self._save_counts(batch)
+                batch = []
+        total += self._save_counts(batch)
+
+        # どの投稿からも参照されていない写真ファイルは 0 にする（media_gc の削除対象になる）
+        MediaBlob.objects.filter(refcount__gt=0).exclude(
+            Exists(PhotoPost.objects.filter(photo=OuterRef('name')))
+        ).update(refcount=0)
+        return total
+
+    def _save_counts(self, batch):
+        if batch:
+            MediaBlob.objects.bulk_create(
+                batch, update_conflicts=True, unique_fields=['name'], update_fields=['size', 'refcount'],
+            )
+        return len(batch)
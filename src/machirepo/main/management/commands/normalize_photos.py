@@ -0,0 +1,104 @@
+import os
+import tempfile
+
+from django.core.files import File
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from main import exif, ingest, media_gc, media_storage, photo_hashing, thumbnails
+from main.management.commands.media_gc import _format_bytes
+from main.models import PhotoPost
+
+
+class Command(BaseCommand):
+    help = (
+        "保存済みの投稿写真をアップロード時と同じ条件で正規化します"
+        "（向きの反映・縮小・再エンコード・メタデータの除去）。"
+        "同じファイルを参照する投稿はまとめて新しいファイルに切り替え、縮小画像も作り直します。"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true', help='変換せず、対象の写真と現在の容量だけを表示します。')
+        parser.add_argument('--limit', type=int, default=0, help='処理する写真の数の上限（既定: 0 = すべて）。')
+
+    def handle(self, *args, **options):
+        storage = PhotoPost._meta.get_field('photo').storage
+        # 処理中に投稿の photo を書き換えるため、対象の名前は先に読み出しておく
+        names = list(PhotoPost.objects.exclude(photo='').order_by('photo').values_list('photo', flat=True).distinct())
+
+        done = skipped = failed = 0
+        before = after = 0
+        for name in names:
+            if options['limit'] and done >= options['limit']:
+                break
+            try:
+                result = self._normalize(storage, name, options['dry_run'])
+            except Exception as e:
+                failed += 1
+                self.stderr.write(f"{name}: 正規化できませんでした ({e})")
+                continue
+            if result is None:
+                skipped += 1
+                continue
+
+            done += 1
+            before += result[0]
+            after += result[1]
+            self.stdout.write(f"{name}: {_format_bytes(result[0])} -> {_format_bytes(result[1])}")
+
+        if options['dry_run']:
+            self.stdout.write(self.style.SUCCESS(
+                f"対象: {done} 件 ({_format_bytes(before)}) / 正規化済み: {skipped} 件 / 読み込めない写真: {failed} 件"
+            ))
+        else:
+            self.stdout.write(self.style.SUCCESS(
+                f"正規化完了: {done} 件 {_format_bytes(before)} -> {_format_bytes(after)}"
+                f" / 正規化済み: {skipped} 件 / 失敗: {failed} 件"
+            ))
+
+    def _normalize(self, storage, name, dry_run):
+        """写真 name を正規化して (変換前のバイト数, 変換後のバイト数) を返す。正規化済みなら None。"""
+        with storage.open(name, 'rb') as f:
+            header = ingest.inspect(f)
+            metadata = exif.read_metadata(f)
+            size = storage.size(name)
+            if not _needs_normalization(name, header, size, metadata):
+                return None
+            if dry_run:
+                return size, size
+
+            with tempfile.TemporaryDirectory() as tmp:
+                normalized = ingest.normalize(f, os.path.join(tmp, 'photo'), metadata['orientation'])
+                new_name = os.path.splitext(name)[0] + os.path.splitext(normalized)[1]
+                with open(normalized, 'rb') as out:
+                    fields = photo_hashing.hash_fields(*photo_hashing.compute_hashes(File(out)))
+                    out.seek(0)
+                    new_name = storage.save(new_name, File(out))
+
+        posts = PhotoPost.objects.filter(photo=name)
+        pks = list(posts.values_list('pk', flat=True))
+        # update() はシグナルを送らないため、参照数の更新・縮小画像の作成・元のファイルの削除はここで行う
+        posts.update(photo=new_name, photo_derivatives=None, **fields)
+        media_storage.retain(storage, new_name, len(pks))
+        media_storage.release(storage, name, len(pks))
+        if metadata['taken_at'] is not None:
+            taken_at = metadata['taken_at']
+            if taken_at.tzinfo is None:
+                taken_at = timezone.make_aware(taken_at)
+            PhotoPost.objects.filter(pk__in=pks, photo_taken_at__isnull=True).update(photo_taken_at=taken_at)
+
+        for pk in pks:
+            thumbnails.update_post_derivatives(pk)
+        media_gc.delete_photo_if_unreferenced(name, storage)
+        return size, storage.size(new_name)
+
+
+def _needs_normalization(name, header, size, metadata):
+    extension = os.path.splitext(name)[1].lower().lstrip('.')
+    return (
+        header.format != ingest.output_format()
+        or extension != ingest.output_extension()
+        or max(header.width, header.height) > ingest.max_long_edge()
+        or size > ingest.max_stored_bytes()
+        or any(value is not None for value in metadata.values())
+    )
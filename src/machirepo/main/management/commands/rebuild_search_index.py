@@ -0,0 +1,41 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from main import search
+from main.models import PhotoPost
+
+
+class Command(BaseCommand):
+    help = (
+        "報告の全文検索インデックス（main_photopost_fts）を、すべての投稿のタイトル・コメントから作り直します。"
+        "bulk_create・QuerySet.update() でタイトル・コメントを変えた後や、語の分け方・スコアの重みを変えた後に使います。"
+        "投稿の id 順に少しずつ書き直すため、実行中も検索できます。"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500, help='1回に書き直す投稿の数（既定: 500）。')
+
+    def handle(self, *args, **options):
+        if not search.available():
+            raise CommandError("全文検索インデックスは SQLite（FTS5）でのみ使えます。")
+        batch_size = max(1, options['batch_size'])
+        posts = PhotoPost.objects.order_by('pk').only('pk', 'title', 'comment')
+
+        started = time.monotonic()
+        indexed = 0
+        last = 0
+        while True:
+            batch = list(posts.filter(pk__gt=last)[:batch_size])
+            if not batch:
+                break
+            last = batch[-1].pk
+            search.index_posts(batch)
+            indexed += len(batch)
+
+        removed = search.remove_orphans()
+        search.optimize()
+        self.stdout.write(self.style.SUCCESS(
+            f"インデックスを作り直しました: {indexed} 件 / 削除済みの投稿の行: {removed} 件"
+            f"（{time.monotonic() - started:.1f} 秒）"
+        ))
@@ -0,0 +1,197 @@
+import json
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from pathlib import Path
+
+import numpy as np
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db.models import Q
+from django.utils import timezone
+
+from main import classifier, model_loader
+from main.governor import configure_torch_threads
+from main.media_storage import photo_storage
+from main.models import PhotoEmbedding, PhotoPost, Tag
+
+
+AI_FIELDS = ['ai_label', 'ai_confidence', 'ai_probabilities', 'ai_model_version', 'ai_classified_at']
+
+
+def _decode(name):
+    """ワーカープロセスで写真 name をストレージから読み込み、正規化済み配列を返す（失敗時は None）。"""
+    try:
+        with photo_storage().open(name, 'rb') as f:
+            return classifier.image_to_array(classifier.decode_image(f))
+    except Exception:
+        return None
+
+
+def _format_seconds(seconds):
+    seconds = int(seconds)
+    return f"{seconds // 3600:d}:{seconds % 3600 // 60:02d}:{seconds % 60:02d}"
+
+
+class Command(BaseCommand):
+    help = (
+        "保存済みの投稿写真を現在のモデルで一括再分類します。"
+        "主キー順にチャンク単位で処理し、中断後に再実行すると続きから再開します。"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--model', help='使用するチェックポイント（既定: CLASSIFIER_MODEL_PATH）。')
+        parser.add_argument('--since', help='この日付（YYYY-MM-DD）以降の投稿のみ対象にします。')
+        parser.add_argument('--tag', help='タグID またはタグ名で絞り込みます。')
+        parser.add_argument(
+            '--status',
+            choices=[key for key, _ in PhotoPost.STATUS_CHOICES],
+            help='対応状況で絞り込みます。',
+        )
+        parser.add_argument('--chunk-size', type=int, default=256, help='1回に読み込む投稿数（既定: 256）。')
+        parser.add_argument('--batch-size', type=int, default=32, help='1回の推論でまとめる枚数（既定: 32）。')
+        parser.add_argument('--workers', type=int, default=os.cpu_count() or 1, help='画像デコードのプロセス数。')
+        parser.add_argument('--threads', type=int, default=os.cpu_count() or 1, help='torch の演算スレッド数。')
+        parser.add_argument(
+            '--force',
+            action='store_true',
+            help='現在のモデルで分類済みの投稿も再分類します（既定では未分類・旧モデル・埋め込み未保存の投稿のみ）。',
+        )
+        parser.add_argument(
+            '--resume',
+            action='store_true',
+            help='前回中断したチェックポイント（--checkpoint）の続きから処理します。',
+        )
+        parser.add_argument(
+            '--checkpoint',
+            default=str(Path(settings.BASE_DIR) / '.reclassify_checkpoint.json'),
+            help='処理済みの最終主キーを記録するファイル。',
+        )
+
+    def handle(self, *args, **options):
+        if options['model']:
+            if not Path(options['model']).is_file():
+                raise CommandError(f"チェックポイントが見つかりません: {options['model']}")
+            settings.CLASSIFIER_MODEL_PATH = Path(options['model']).resolve()
+
+        version = model_loader.model_version()
+        posts = self._filtered_queryset(options, version)
+        checkpoint = Path(options['checkpoint'])
+
+        last_pk = 0
+        if options['resume'] and checkpoint.exists():
+            state = json.loads(checkpoint.read_text())
+            if state.get('model_version') == version:
+                last_pk = state['last_pk']
+                self.stdout.write(f"チェックポイントから再開します（主キー {last_pk} 以降）。")
+
+        total = posts.filter(pk__gt=last_pk).count()
+        self.stdout.write(f"対象: {total} 件 / モデル: {version} [{model_loader.backend_name()}]")
+        if not total:
+            return
+
+        configure_torch_threads(options['threads'])
+        model_loader.get_model()
+
+        processed = failed = 0
+        started = time.monotonic()
+        chunk_size = max(1, options['chunk_size'])
+
+        with ProcessPoolExecutor(max_workers=max(1, options['workers'])) as pool:
+            chunk = self._next_chunk(posts, last_pk, chunk_size)
+            pending = self._submit(pool, chunk)
+
+            while chunk:
+                # 次のチャンクのデコードを先に投入し、推論と並行させる
+                next_chunk = self._next_chunk(posts, chunk[-1].pk, chunk_size)
+                next_pending = self._submit(pool, next_chunk)
+
+                ok, ng = self._classify_chunk(chunk, pending, options['batch_size'])
+                processed += ok
+                failed += ng
+
+                checkpoint.write_text(json.dumps({'model_version': version, 'last_pk': chunk[-1].pk}))
+
+                elapsed = time.monotonic() - started
+                done = processed + failed
+                rate = done / elapsed if elapsed > 0 else 0.0
+                eta = (total - done) / rate if rate > 0 else 0.0
+                self.stdout.write(
+                    f"{done}/{total} ({done / total:.1%}) {rate:.1f} 枚/秒 "
+                    f"経過 {_format_seconds(elapsed)} 残り {_format_seconds(eta)}"
+                )
+
+                chunk, pending = next_chunk, next_pending
+
+        checkpoint.unlink(missing_ok=True)
+        self.stdout.write(self.style.SUCCESS(f"再分類完了: {processed} 件 / 失敗: {failed} 件"))
+
+    def _filtered_queryset(self, options, version):
+        posts = PhotoPost.objects.order_by('pk')
+
+        if not options['force']:
+            posts = posts.filter(
+                ~Q(ai_model_version=version) | Q(embedding__isnull=True) | ~Q(embedding__model_version=version)
+            )
+
+        if options['since']:
+            try:
+                since = datetime.strptime(options['since'], '%Y-%m-%d')
+            except ValueError:
+                raise CommandError('--since は YYYY-MM-DD 形式で指定してください。')
+            posts = posts.filter(posted_at__gte=timezone.make_aware(since))
+
+        if options['tag']:
+            tag_value = options['tag']
+            tag = Tag.objects.filter(pk=int(tag_value)).first() if tag_value.isdigit() else Tag.objects.filter(name=tag_value).first()
+            if tag is None:
+                raise CommandError(f"タグが見つかりません: {tag_value}")
+            posts = posts.filter(tag=tag)
+
+        if options['status']:
+            posts = posts.filter(status=options['status'])
+
+        return posts
+
+    def _next_chunk(self, posts, after_pk, chunk_size):
+        return list(posts.filter(pk__gt=after_pk).only('pk', 'photo')[:chunk_size])
+
+    def _submit(self, pool, chunk):
+        return [pool.submit(_decode, post.photo.name) for post in chunk]
+
+    def _classify_chunk(self, chunk, pending, batch_size):
+        import torch
+
+        decoded = []
+        failed = 0
+        for post, future in zip(chunk, pending):
+            array = future.result()
+            if array is None:
+                failed += 1
+                self.stderr.write(f"報告ID {post.pk}: 写真を読み込めませんでした ({post.photo.name})")
+                continue
+            decoded.append((post, array))
+
+        classified_at = timezone.now()
+        updated = []
+        embeddings = []
+        for start in range(0, len(decoded), max(1, batch_size)):
+            batch = decoded[start:start + batch_size]
+            results = classifier.predict_batch(torch.from_numpy(np.stack([array for _, array in batch])))
+            for (post, _), result in zip(batch, results):
+                classifier.apply_classification(post, result)
+                post.ai_classified_at = classified_at
+                updated.append(post)
+                if result.get('embedding'):
+                    embeddings.append(PhotoEmbedding(
+                        post=post, vector=result['embedding'],
+                        model_version=result['model_version'], updated_at=classified_at,
+                    ))
+
+        PhotoPost.objects.bulk_update(updated, AI_FIELDS, batch_size=500)
+        PhotoEmbedding.objects.bulk_create(
+            embeddings, batch_size=500, update_conflicts=True,
+            unique_fields=['post'], update_fields=['vector', 'model_version', 'updated_at'],
+        )
+        return len(updated), failed
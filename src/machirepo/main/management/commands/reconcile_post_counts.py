@@ -0,0 +1,50 @@
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+from django.db.models import Count, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+from main.models import PhotoPost
+
+
+class Command(BaseCommand):
+    help = (
+        "ユーザーごとの投稿数（post_count）を、実際の投稿の数に合わせて数え直します。"
+        "bulk_create など投稿数が更新されない操作の後や、定期的な点検に使います。"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true', help='更新せず、ずれているユーザーだけを表示します。')
+        parser.add_argument('--batch-size', type=int, default=1000, help='1回に照合するユーザーの数（既定: 1000）。')
+
+    def handle(self, *args, **options):
+        batch_size = max(1, options['batch_size'])
+        counts = (
+            PhotoPost.objects.filter(user=OuterRef('pk')).order_by()
+            .values('user').annotate(n=Count('pk')).values('n')
+        )
+        users = get_user_model().objects.order_by('pk')
+
+        checked = fixed = 0
+        last = 0
+        while True:
+            # ユーザーの id 順に batch_size 人ずつ、記録と実際の投稿数を比べる
+            rows = list(
+                users.filter(pk__gt=last).annotate(actual=Coalesce(Subquery(counts), 0))
+                .values_list('pk', 'username', 'post_count', 'actual')[:batch_size]
+            )
+            if not rows:
+                break
+            last = rows[-1][0]
+            checked += len(rows)
+
+            for pk, username, recorded, actual in rows:
+                if recorded == actual:
+                    continue
+                fixed += 1
+                self.stdout.write(f"{username}: {recorded} -> {actual}")
+                if not options['dry_run']:
+                    # 照合中に投稿された場合に備え、UPDATE の中で数え直す
+                    users.filter(pk=pk).update(post_count=Coalesce(Subquery(counts), 0))
+
+        label = "ずれているユーザー" if options['dry_run'] else "数え直したユーザー"
+        self.stdout.write(self.style.SUCCESS(f"照合: {checked} 人 / {label}: {fixed} 人"))
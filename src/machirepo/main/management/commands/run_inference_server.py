@@ -0,0 +1,67 @@
+import os
+import signal
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from main import model_loader
+from main.batching import BatchingClassifier
+from main.governor import configure_torch_threads
+from main.inference_server import InferenceServer
+
+
+class Command(BaseCommand):
+    help = (
+        "分類モデルを1つだけ読み込み、Unix ソケット経由で全 Web ワーカーからの分類要求を処理する"
+        "推論サーバーを起動します。"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--socket',
+            default=getattr(settings, 'CLASSIFIER_SERVER_SOCKET', None),
+            help='待ち受ける Unix ソケットのパス（既定: CLASSIFIER_SERVER_SOCKET）。',
+        )
+        parser.add_argument(
+            '--max-batch-size', type=int,
+            default=getattr(settings, 'CLASSIFIER_BATCH_MAX_SIZE', 8),
+            help='1回の推論でまとめる最大枚数。',
+        )
+        parser.add_argument(
+            '--max-wait-ms', type=float,
+            default=getattr(settings, 'CLASSIFIER_BATCH_MAX_WAIT_MS', 5),
+            help='バッチを溜める最大待ち時間（ミリ秒）。',
+        )
+        parser.add_argument('--threads', type=int, default=None, help='torch の演算スレッド数。')
+
+    def handle(self, *args, **options):
+        socket_path = options['socket']
+        if not socket_path:
+            raise CommandError('--socket または CLASSIFIER_SERVER_SOCKET を指定してください。')
+
+        # サーバーは推論専用プロセスなので、Web ワーカー向けの制限ではなく指定値（既定はコア数）を使う
+        configure_torch_threads(options['threads'] or os.cpu_count())
+        model_loader.get_model()
+        batcher = BatchingClassifier(
+            max_batch_size=options['max_batch_size'],
+            max_wait_ms=options['max_wait_ms'],
+        )
+        server = InferenceServer(socket_path, batcher)
+
+        def _shutdown(signum, frame):
+            raise KeyboardInterrupt
+
+        signal.signal(signal.SIGTERM, _shutdown)
+
+        self.stdout.write(self.style.SUCCESS(
+            f"推論サーバーを起動しました: {socket_path} "
+            f"(モデル: {model_loader.model_version()} [{model_loader.backend_name()}])"
+        ))
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.server_close()
+            batcher.shutdown()
+            self.stdout.write("推論サーバーを停止しました。")
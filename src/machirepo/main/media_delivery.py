@@ -0,0 +1,178 @@
+import mimetypes
+import os
+import re
+import stat
+from urllib.parse import quote
+
+from django.conf import settings
+from django.http import HttpResponse, HttpResponseRedirect, StreamingHttpResponse
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.http import http_date, parse_http_date_safe
+
+from .media_gc import DERIVATIVE_PATTERN
+from .media_storage import ContentAddressedMixin
+
+
+# -----------------------------------------------------
+# 投稿写真の配信
+#   ETag / Last-Modified は stat の結果だけで作り（ファイルは読まない）、条件付きリクエストには 304 を返す。
+#   MEDIA_ACCEL_BACKEND を設定すると、配信してよいかの確認だけを Django で行い、
+#   データの送信（Range を含む）は nginx（X-Accel-Redirect）・Apache（mod_xsendfile の X-Sendfile）に任せる。
+# -----------------------------------------------------
+
+_RANGE_PATTERN = re.compile(r'^bytes=(\d*)-(\d*)$')
+_STREAM_BLOCK_SIZE = 64 * 1024
+
+# 縮小画像の元の写真として考えられる拡張子
+_ORIGINAL_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.webp', '.gif', '.bmp', '.heic')
+
+
+def referenced_photo(name):
+    """
+    name が投稿の写真かその縮小画像なら、元の写真の名前を返す（配信してよいかの確認）。
+    投稿から参照されていないファイル（投稿途中の旧形式の一時ファイルなど）は None。
+    """
+    from .models import PhotoPost
+
+    candidates = [name]
+    match = DERIVATIVE_PATTERN.match(os.path.basename(name))
+    if match:
+        root = os.path.join(os.path.dirname(name), match.group('root'))
+        candidates = [f"{root}{ext}" for ext in _ORIGINAL_EXTENSIONS]
+    return PhotoPost.objects.filter(photo__in=candidates).values_list('photo', flat=True).first()
+
+
+def is_public_asset(name):
+    """name が MEDIA_PUBLIC_DIRECTORIES 以下のサイトの画像（バッジ・アイコンなど, 投稿とは関係なく配信する）か。"""
+    parts = name.split('/')
+    if len(parts) < 2 or any(part in ('', '.', '..') for part in parts):
+        return False
+    return parts[0] in getattr(settings, 'MEDIA_PUBLIC_DIRECTORIES', ['images'])
+
+
+def etag_for(st):
+    return f'"{st.st_mtime_ns:x}-{st.st_size:x}"'
+
+
+def is_immutable(storage, name):
+    """内容のハッシュで名前付けした写真は、同じ URL の内容が変わらない。"""
+    return isinstance(storage, ContentAddressedMixin) and storage.is_content_name(name)
+
+
+def serve(request, storage, name):
+    """storage のファイル name を配信するレスポンスを返す（ファイルがなければ None）。"""
+    try:
+        path = storage.path(name)
+    except NotImplementedError:
+        # オブジェクトストレージの写真はストレージの URL（署名付き URL など）から取得させる
+        return HttpResponseRedirect(storage.url(name))
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    if not stat.S_ISREG(st.st_mode):
+        return None
+
+    etag = etag_for(st)
+    last_modified = int(st.st_mtime)
+    conditional = get_conditional_response(request, etag=etag, last_modified=last_modified)
+    if conditional is not None:
+        _set_cache_headers(conditional, storage, name)
+        return conditional
+
+    content_type = mimetypes.guess_type(name)[0] or 'application/octet-stream'
+    backend = getattr(settings, 'MEDIA_ACCEL_BACKEND', None)
+    if backend:
+        response = HttpResponse(content_type=content_type)
+        if backend == 'nginx':
+            # Range・送信は nginx の internal ロケーションが処理する
+            response['X-Accel-Redirect'] = quote(settings.MEDIA_ACCEL_REDIRECT_PREFIX.rstrip('/') + '/' + name)
+        elif backend == 'apache':
+            response['X-Sendfile'] = path
+        else:
+            raise ValueError(f"不明な MEDIA_ACCEL_BACKEND です: {backend}")
+    else:
+        response = _file_response(request, path, st, etag, content_type)
+
+    response['ETag'] = etag
+    response['Last-Modified'] = http_date(last_modified)
+    _set_cache_headers(response, storage, name)
+    return response
+
+
+def _set_cache_headers(response, storage, name):
+    if is_immutable(storage, name):
+        patch_cache_control(response, public=True, max_age=365 * 24 * 60 * 60, immutable=True)
+    else:
+        patch_cache_control(response, public=True, max_age=getattr(settings, 'MEDIA_CACHE_MAX_AGE', 24 * 60 * 60))
+
+
+def _file_response(request, path, st, etag, content_type):
+    """Django 自身で送る場合のレスポンス（Range は単一範囲のみ対応し、複数範囲は全体を返す）。"""
+    size = st.st_size
+    byte_range = _requested_range(request, size, etag, int(st.st_mtime))
+
+    if byte_range == 'unsatisfiable':
+        response = HttpResponse(status=416)
+        response['Content-Range'] = f'bytes */{size}'
+        return response
+
+    start, end = byte_range or (0, size - 1)
+    length = end - start + 1 if size else 0
+    if request.method == 'HEAD':
+        response = HttpResponse(content_type=content_type)
+    else:
+        response = StreamingHttpResponse(_read_range(path, start, length), content_type=content_type)
+    response['Content-Length'] = str(length)
+    response['Accept-Ranges'] = 'bytes'
+    if byte_range:
+        response.status_code = 206
+        response['Content-Range'] = f'bytes {start}-{end}/{size}'
+    return response
+
+
+def _requested_range(request, size, etag, last_modified):
+    """Range ヘッダーの (開始, 終了) を返す。範囲指定がない・使えない場合は None。"""
+    header = request.META.get('HTTP_RANGE', '').strip()
+    if not header or request.method not in ('GET', 'HEAD'):
+        return None
+
+    if_range = request.META.get('HTTP_IF_RANGE', '').strip()
+    if if_range:
+        # 手元のファイルが変わっていれば全体を返す
+        if if_range.startswith('"') or if_range.startswith('W/'):
+            if if_range != etag:
+                return None
+        elif parse_http_date_safe(if_range) != last_modified:
+            return None
+
+    match = _RANGE_PATTERN.match(header.replace(' ', ''))
+    if not match or not any(match.groups()):
+        return None
+    first, last = match.groups()
+    if first:
+        start = int(first)
+        end = min(int(last), size - 1) if last else size - 1
+        if start >= size:
+            return 'unsatisfiable'
+        if end < start:
+            return None
+    else:
+        # bytes=-N は末尾の N バイト
+        suffix = int(last)
+        if suffix == 0:
+            return 'unsatisfiable'
+        start, end = max(0, size - suffix), size - 1
+    return start, end
+
+
+def _read_range(path, start, length):
+    with open(path, 'rb') as f:
+        f.seek(start)
+        remaining = length
+        while remaining > 0:
+            data = f.read(min(_STREAM_BLOCK_SIZE, remaining))
+            if not data:
+                break
+            remaining -= len(data)
+            yield data
@@ -0,0 +1,63 @@
+import logging
+import os
+import re
+from datetime import timedelta
+
+from django.db import transaction
+from django.utils import timezone
+
+from . import thumbnails
+from .media_storage import ContentAddressedMixin
+
+
+logger = logging.getLogger(__name__)
+
+# 内容の名前で保存するストレージで、保存（register）からこの時間が経っていない写真ファイルは、
+# 同じ内容の投稿を保存している途中の可能性があるため投稿の削除時には消さない（manage.py media_gc で削除する）
+UNREFERENCED_GRACE = timedelta(hours=1)
+
+# 縮小画像のファイル名（thumbnails.derivative_name の形式）
+DERIVATIVE_PATTERN = re.compile(r'^(?P<root>.+)\.w(?P<width>\d+)\.(?P<fmt>webp|jpg)$')
+
+
+def derivative_names(name):
+    """写真 name の縮小画像として存在しうるファイル名（現在の設定の幅・形式）。"""
+    return [thumbnails.derivative_name(name, width, fmt) for width in thumbnails.widths() for fmt in thumbnails.FORMATS]
+
+
+def delete_photo_if_unreferenced(name, storage):
+    """
+    写真とその縮小画像を削除し、削除したバイト数を返す。
+    同一内容の投稿が同じファイルを共有している場合があるため、参照が残っていれば削除しない
+    （内容の名前で保存するストレージでは参照数を、それ以外では投稿の photo を確認する）。
+    """
+    from .models import PhotoPost
+
+    if not name:
+        return 0
+    if isinstance(storage, ContentAddressedMixin) and storage.refcount(name) > 0:
+        return 0
+    references = PhotoPost.objects.filter(photo=name).count()
+    if references:
+        if isinstance(storage, ContentAddressedMixin):
+            # QuerySet.update() などで参照数がずれていた場合は、実際の参照数に合わせる
+            logger.warning("写真ファイル %s の参照数を %d に修正しました。", name, references)
+            storage.retain(name, references - storage.refcount(name))
+        return 0
+
+    reclaimed = 0
+    with transaction.atomic():
+        if isinstance(storage, ContentAddressedMixin) and not storage.claim_unreferenced(
+            name, timezone.now() - UNREFERENCED_GRACE,
+        ):
+            return 0
+        for target in [name] + derivative_names(name):
+            try:
+                if not storage.exists(target):
+                    continue
+                reclaimed += storage.size(target)
+                storage.delete(target)
+            except Exception:
+                logger.warning("写真ファイル %s を削除できませんでした。", target, exc_info=True)
+    logger.info("写真ファイル %s を削除しました (%d バイト)", name, reclaimed)
+    return reclaimed
@@ -0,0 +1,170 @@
+import hashlib
+import os
+import re
+import tempfile
+
+from django.core.files.storage import FileSystemStorage, storages
+from django.db.models import Exists, F, OuterRef
+from django.utils import timezone
+from django.utils.deconstruct import deconstructible
+
+
+def photo_storage():
+    """PhotoPost.photo のストレージ（settings.STORAGES の 'photos'）。"""
+    return storages['photos']
+
+
+class ContentAddressedMixin:
+    """
+    写真を内容の SHA-256 で名前付けするストレージの共通部分（名前の規則と参照数）。
+    名前は「prefix/ハッシュ先頭2文字/次の2文字/ハッシュ.拡張子」で、1ディレクトリのファイル数は
+    数百万件でも数十件程度に収まる。同じ内容のファイルは1つだけ保存し、
+    参照数（MediaBlob.refcount）が 0 になったものを削除の対象にする。
+    名前が内容から決まるため、URL が指す内容は変わらない（長期間キャッシュできる）。
+    """
+
+    NAME_PATTERN = re.compile(r'^(?P<prefix>.+)/[0-9a-f]{2}/[0-9a-f]{2}/(?P<sha256>[0-9a-f]{64})(?P<ext>\.[a-z0-9]+)?$')
+
+    def __init__(self, prefix='photos', **kwargs):
+        super().__init__(**kwargs)
+        self.prefix = prefix.strip('/')
+
+    def content_name(self, sha256, extension=''):
+        sha256 = sha256.lower()
+        return f"{self.prefix}/{sha256[:2]}/{sha256[2:4]}/{sha256}{extension.lower()}"
+
+    def is_content_name(self, name):
+        match = self.NAME_PATTERN.match(name or '')
+        return bool(match) and match.group('prefix') == self.prefix
+
+    def get_available_name(self, name, max_length=None):
+        # 保存時に内容から名前を決めるため、衝突の確認や別名の生成はしない
+        return name
+
+    def delete(self, name):
+        super().delete(name)
+        if self.is_content_name(name):
+            from .models import MediaBlob
+
+            MediaBlob.objects.filter(name=name).delete()
+
+    # -----------------------------------------------------
+    # 参照数
+    # -----------------------------------------------------
+
+    def register(self, name, size=None):
+        """
+        保存するファイルを参照数 0 で記録する。記録済みなら保存日時だけを今にする
+        （参照数 0 のまま残っていたファイルを再利用する場合も、投稿が保存されるまで削除の対象にしない）。
+        """
+        from .models import MediaBlob
+
+        if size is None:
+            size = self.size(name) if self.exists(name) else 0
+        # SELECT してから INSERT すると SQLite で他の書き込みと競合するため、1文で記録する
+        MediaBlob.objects.bulk_create(
+            [MediaBlob(name=name, size=size, created_at=timezone.now())],
+            update_conflicts=True, unique_fields=['name'], update_fields=['created_at'],
+        )
+
+    def claim_unreferenced(self, name, saved_before):
+        """
+        参照数が 0 で saved_before より前に保存された name の記録を削除し、削除できたら True を返す。
+        ファイルはこの後、同じトランザクションの中で削除する。記録の削除から確定までの間に
+        同じ内容を保存しようとした場合は register が待たされ、削除の後にファイルを置き直す。
+        """
+        from .models import MediaBlob, PhotoPost
+
+        deleted, _ = MediaBlob.objects.filter(name=name, refcount__lte=0, created_at__lt=saved_before).exclude(
+            Exists(PhotoPost.objects.filter(photo=OuterRef('name')))
+        ).delete()
+        return bool(deleted)
+
+    def retain(self, name, count=1):
+        """name を参照する投稿が count 件増えたことを記録する。"""
+        from .models import MediaBlob
+
+        if not self.is_content_name(name):
+            return
+        if not MediaBlob.objects.filter(name=name).update(refcount=F('refcount') + count):
+            self.register(name)
+            MediaBlob.objects.filter(name=name).update(refcount=F('refcount') + count)
+
+    def release(self, name, count=1):
+        """name を参照する投稿が count 件減ったことを記録する。"""
+        from .models import MediaBlob
+
+        if self.is_content_name(name):
+            MediaBlob.objects.filter(name=name).update(refcount=F('refcount') - count)
+
+    def refcount(self, name):
+        from .models import MediaBlob
+
+        return MediaBlob.objects.filter(name=name).values_list('refcount', flat=True).first() or 0
+
+
+@deconstructible
+class ContentAddressedStorage(ContentAddressedMixin, FileSystemStorage):
+    """ローカルのファイルシステムに保存する ContentAddressedMixin のストレージ。"""
+
+    def _save(self, name, content):
+        """内容を一時ファイルに書き込みながらハッシュを計算し、内容の名前に置く（既にあれば書き込まない）。"""
+        extension = os.path.splitext(name)[1]
+        os.makedirs(self.location, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=self.location, prefix='.incoming-')
+        try:
+            digest = hashlib.sha256()
+            with os.fdopen(fd, 'wb') as f:
+                if hasattr(content, 'seek'):
+                    content.seek(0)
+                for chunk in content.chunks():
+                    digest.update(chunk)
+                    f.write(chunk)
+            name = self.content_name(digest.hexdigest(), extension)
+            self.link_file(tmp_path, name)
+        finally:
+            try:
+                os.unlink(tmp_path)
+            except FileNotFoundError:
+                pass
+        return name
+
+    def link_file(self, path, name):
+        """
+        ローカルのファイル path を name としてハードリンクで取り込む（データはコピーしない）。
+        同じ名前のファイルは同じ内容のため、既にある場合は何もしない。
+        """
+        target = self.path(name)
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        # 削除中のファイルを再利用しないよう、リンクを作る前に記録する（claim_unreferenced を参照）
+        self.register(name, os.path.getsize(path))
+        try:
+            os.link(path, target)
+        except FileExistsError:
+            # 既存のファイルには触れない（更新日時は ETag・Last-Modified の元で、同じ URL の内容は変えない）。
+            # 削除されないことは register で更新した MediaBlob.created_at で保証する
+            return name
+        except OSError:
+            # 別のファイルシステムなどハードリンクできない場合は同じディレクトリへコピーしてから置き換える
+            tmp_target = f"{target}.tmp{os.getpid()}"
+            with open(path, 'rb') as src, open(tmp_target, 'wb') as dst:
+                for chunk in iter(lambda: src.read(64 * 1024), b''):
+                    dst.write(chunk)
+            os.replace(tmp_target, target)
+        if self.file_permissions_mode is not None:
+            os.chmod(target, self.file_permissions_mode)
+        # ハードリンクは元のファイルの更新日時のままのため、この呼び出しで作ったファイルは更新日時を今にする
+        os.utime(target)
+        return name
+
+
+def retain(storage, name, count=1):
+    """storage が内容の名前で保存するストレージなら name の参照数を増やす（それ以外のストレージでは何もしない）。"""
+    if isinstance(storage, ContentAddressedMixin):
+        storage.retain(name, count)
+
+
+def release(storage, name, count=1):
+    """storage が内容の名前で保存するストレージなら name の参照数を減らす。"""
+    if isinstance(storage, ContentAddressedMixin):
+        storage.release(name, count)
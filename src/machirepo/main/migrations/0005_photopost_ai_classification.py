@@ -0,0 +1,38 @@
+# Generated by Django 5.2.7 on 2026-10-17 03:27
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0004_remove_photopost_tags_photopost_tag'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='photopost',
+            name='ai_classified_at',
+            field=models.DateTimeField(blank=True, null=True, verbose_name='AI判定日時'),
+        ),
+        migrations.AddField(
+            model_name='photopost',
+            name='ai_confidence',
+            field=models.FloatField(blank=True, null=True, verbose_name='AI判定信頼度'),
+        ),
+        migrations.AddField(
+            model_name='photopost',
+            name='ai_label',
+            field=models.CharField(blank=True, max_length=20, verbose_name='AI判定カテゴリ'),
+        ),
+        migrations.AddField(
+            model_name='photopost',
+            name='ai_model_version',
+            field=models.CharField(blank=True, max_length=50, verbose_name='AIモデルバージョン'),
+        ),
+        migrations.AddField(
+            model_name='photopost',
+            name='ai_probabilities',
+            field=models.JSONField(blank=True, null=True, verbose_name='AI判定確率（全カテゴリ）'),
+        ),
+    ]
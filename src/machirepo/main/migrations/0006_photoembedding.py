@@ -0,0 +1,27 @@
+# Generated by Django 5.2.7 on 2026-10-17 03:40
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0005_photopost_ai_classification'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PhotoEmbedding',
+            fields=[
+                ('post', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='embedding', serialize=False, to='main.photopost', verbose_name='写真投稿')),
+                ('vector', models.BinaryField(verbose_name='埋め込みベクトル')),
+                ('model_version', models.CharField(max_length=50, verbose_name='AIモデルバージョン')),
+                ('updated_at', models.DateTimeField(auto_now=True, db_index=True, verbose_name='更新日時')),
+            ],
+            options={
+                'verbose_name': '写真埋め込み',
+                'verbose_name_plural': '写真埋め込み',
+            },
+        ),
+    ]
@@ -0,0 +1,43 @@
+# Generated by Django 5.2.7 on 2026-10-17 03:43
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0006_photoembedding'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='photopost',
+            name='photo_phash',
+            field=models.BigIntegerField(blank=True, null=True, verbose_name='写真の知覚ハッシュ'),
+        ),
+        migrations.AddField(
+            model_name='photopost',
+            name='photo_phash_band0',
+            field=models.IntegerField(blank=True, db_index=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='photopost',
+            name='photo_phash_band1',
+            field=models.IntegerField(blank=True, db_index=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='photopost',
+            name='photo_phash_band2',
+            field=models.IntegerField(blank=True, db_index=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='photopost',
+            name='photo_phash_band3',
+            field=models.IntegerField(blank=True, db_index=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='photopost',
+            name='photo_sha256',
+            field=models.CharField(blank=True, db_index=True, max_length=64, verbose_name='写真のSHA-256'),
+        ),
+    ]
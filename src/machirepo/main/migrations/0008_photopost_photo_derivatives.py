@@ -0,0 +1,18 @@
+# Generated by Django 5.2.7 on 2026-10-17 03:44
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0007_photopost_photo_hashes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='photopost',
+            name='photo_derivatives',
+            field=models.JSONField(blank=True, null=True, verbose_name='縮小画像'),
+        ),
+    ]
@@ -0,0 +1,37 @@
+# Generated by Django 5.2.7 on 2026-10-17 03:49
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0008_photopost_photo_derivatives'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='photopost',
+            name='photo',
+            field=models.ImageField(db_index=True, upload_to='photos/%Y/%m/%d/', verbose_name='写真'),
+        ),
+        migrations.CreateModel(
+            name='StagedUpload',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=255, unique=True, verbose_name='ファイル名')),
+                ('size', models.BigIntegerField(default=0, verbose_name='サイズ（バイト）')),
+                ('created_at', models.DateTimeField(default=django.utils.timezone.now, verbose_name='アップロード日時')),
+                ('expires_at', models.DateTimeField(db_index=True, verbose_name='有効期限')),
+                ('user', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, to=settings.AUTH_USER_MODEL, verbose_name='アップロードユーザー')),
+            ],
+            options={
+                'verbose_name': 'ステージング中の写真',
+                'verbose_name_plural': 'ステージング中の写真',
+            },
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.7 on 2026-10-17 03:55
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0009_stagedupload_photo_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='photopost',
+            name='photo_taken_at',
+            field=models.DateTimeField(blank=True, null=True, verbose_name='撮影日時'),
+        ),
+    ]
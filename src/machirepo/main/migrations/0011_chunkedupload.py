@@ -0,0 +1,35 @@
+# Generated by Django 5.2.7 on 2026-10-17 03:57
+
+import django.db.models.deletion
+import django.utils.timezone
+import uuid
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0010_photopost_photo_taken_at'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ChunkedUpload',
+            fields=[
+                ('id', models.UUIDField(default=uuid.uuid4, editable=False, primary_key=True, serialize=False)),
+                ('filename', models.CharField(max_length=255, verbose_name='元のファイル名')),
+                ('size', models.BigIntegerField(verbose_name='サイズ（バイト）')),
+                ('offset', models.BigIntegerField(default=0, verbose_name='受信済みのバイト数')),
+                ('sha256', models.CharField(blank=True, max_length=64, verbose_name='SHA-256')),
+                ('created_at', models.DateTimeField(default=django.utils.timezone.now, verbose_name='開始日時')),
+                ('expires_at', models.DateTimeField(db_index=True, verbose_name='有効期限')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='chunked_uploads', to=settings.AUTH_USER_MODEL, verbose_name='アップロードユーザー')),
+            ],
+            options={
+                'verbose_name': '分割アップロード',
+                'verbose_name_plural': '分割アップロード',
+            },
+        ),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 5.2.7 on 2026-10-17 04:00
+
+import django.utils.timezone
+import main.media_storage
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0011_chunkedupload'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MediaBlob',
+            fields=[
+                ('name', models.CharField(max_length=255, primary_key=True, serialize=False, verbose_name='ファイル名')),
+                ('size', models.BigIntegerField(default=0, verbose_name='サイズ（バイト）')),
+                ('refcount', models.IntegerField(db_index=True, default=0, verbose_name='参照数')),
+                ('created_at', models.DateTimeField(default=django.utils.timezone.now, verbose_name='保存日時')),
+            ],
+            options={
+                'verbose_name': '写真ファイル',
+                'verbose_name_plural': '写真ファイル',
+            },
+        ),
+        migrations.AlterField(
+            model_name='photopost',
+            name='photo',
+            field=models.ImageField(db_index=True, storage=main.media_storage.photo_storage, upload_to='photos/%Y/%m/%d/', verbose_name='写真'),
+        ),
+    ]
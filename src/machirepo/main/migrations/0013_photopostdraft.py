@@ -0,0 +1,45 @@
+# Generated by Django 5.2.7 on 2026-10-17 04:11
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0012_mediablob_photo_storage'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PhotoPostDraft',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('version', models.PositiveIntegerField(default=1, verbose_name='版')),
+                ('title', models.CharField(blank=True, max_length=100, verbose_name='タイトル')),
+                ('comment', models.TextField(blank=True, verbose_name='詳細コメント')),
+                ('latitude', models.DecimalField(blank=True, decimal_places=25, max_digits=30, null=True, verbose_name='緯度')),
+                ('longitude', models.DecimalField(blank=True, decimal_places=25, max_digits=30, null=True, verbose_name='経度')),
+                ('location_source', models.CharField(blank=True, max_length=10, verbose_name='位置情報の取得元')),
+                ('photo_name', models.CharField(blank=True, max_length=255, verbose_name='ステージング中の写真')),
+                ('photo_sha256', models.CharField(blank=True, max_length=64, verbose_name='写真のSHA-256')),
+                ('photo_phash', models.BigIntegerField(blank=True, null=True, verbose_name='写真の知覚ハッシュ')),
+                ('photo_latitude', models.FloatField(blank=True, null=True, verbose_name='撮影地点の緯度')),
+                ('photo_longitude', models.FloatField(blank=True, null=True, verbose_name='撮影地点の経度')),
+                ('photo_taken_at', models.DateTimeField(blank=True, null=True, verbose_name='撮影日時')),
+                ('ai_result', models.JSONField(blank=True, null=True, verbose_name='AI分類結果')),
+                ('created_at', models.DateTimeField(default=django.utils.timezone.now, verbose_name='作成日時')),
+                ('updated_at', models.DateTimeField(default=django.utils.timezone.now, verbose_name='更新日時')),
+                ('expires_at', models.DateTimeField(db_index=True, verbose_name='有効期限')),
+                ('tag', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='main.tag', verbose_name='メインカテゴリ')),
+                ('user', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='photo_post_draft', to=settings.AUTH_USER_MODEL, verbose_name='投稿ユーザー')),
+            ],
+            options={
+                'verbose_name': '投稿の下書き',
+                'verbose_name_plural': '投稿の下書き',
+            },
+        ),
+    ]
@@ -0,0 +1,19 @@
+# Generated by Django 5.2.7 on 2026-10-17 04:16
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0013_photopostdraft'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='photopost',
+            index=models.Index(fields=['posted_at', 'id'], name='photopost_posted_at_id_idx'),
+        ),
+    ]
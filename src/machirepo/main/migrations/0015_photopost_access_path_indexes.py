@@ -0,0 +1,35 @@
+# Generated by Django 5.2.7 on 2026-10-17 04:18
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0014_photopost_posted_at_id_idx'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='photopost',
+            index=models.Index(fields=['user', 'posted_at', 'id'], name='photopost_user_posted_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='photopost',
+            index=models.Index(fields=['status', 'posted_at', 'id'], name='photopost_status_posted_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='photopost',
+            index=models.Index(fields=['tag', 'posted_at', 'id'], name='photopost_tag_posted_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='photopost',
+            index=models.Index(fields=['priority', 'posted_at', 'id'], name='photopost_priority_posted_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='photopost',
+            index=models.Index(condition=models.Q(('status', 'new')), fields=['posted_at', 'id'], name='photopost_new_posted_idx'),
+        ),
+    ]
@@ -0,0 +1,83 @@
+# Generated by Django 5.2.7 on 2026-10-17 04:27
+
+import unicodedata
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+# 作成時点の main.search.tokenize の写し（移行はその後のコードの変更に影響されないようにする）。
+# 語の分け方を変えた場合は manage.py rebuild_search_index で作り直す
+_SKIPPED_POS = ('助詞', '助動詞', '補助記号', '記号', '空白')
+
+
+def _tokenizer():
+    import fugashi
+
+    tagger = fugashi.Tagger()
+
+    def tokenize(text):
+        text = unicodedata.normalize('NFKC', text or '').strip()
+        if not text:
+            return []
+        words = []
+        for word in tagger(text):
+            if word.feature.pos1 in _SKIPPED_POS:
+                continue
+            lemma = getattr(word.feature, 'lemma', None)
+            lemma = lemma.split('-', 1)[0] if lemma and not lemma.startswith('-') else None
+            words.append((lemma or word.surface).lower())
+        return words
+
+    return tokenize
+
+
+def create_search_table(apps, schema_editor):
+    # FTS5 を使えるのは SQLite のみ（他のデータベースでは main.search が部分一致で検索する）
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    tokenize = _tokenizer()
+
+    schema_editor.execute('CREATE VIRTUAL TABLE main_photopost_fts USING fts5(title, comment)')
+    schema_editor.execute("INSERT INTO main_photopost_fts (main_photopost_fts, rank) VALUES ('rank', 'bm25(3.0, 1.0)')")
+
+    PhotoPost = apps.get_model('main', 'PhotoPost')
+    posts = PhotoPost.objects.order_by('pk').values_list('pk', 'title', 'comment')
+    with schema_editor.connection.cursor() as cursor:
+        for pk, title, comment in posts.iterator(chunk_size=1000):
+            cursor.execute(
+                'INSERT INTO main_photopost_fts (rowid, title, comment) VALUES (%s, %s, %s)',
+                [pk, ' '.join(tokenize(title)), ' '.join(tokenize(comment))],
+            )
+
+
+def drop_search_table(apps, schema_editor):
+    if schema_editor.connection.vendor == 'sqlite':
+        schema_editor.execute('DROP TABLE IF EXISTS main_photopost_fts')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0015_photopost_access_path_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PhotoPostSearchIndex',
+            fields=[
+                ('post', models.OneToOneField(db_column='rowid', on_delete=django.db.models.deletion.DO_NOTHING, primary_key=True, related_name='search_index', serialize=False, to='main.photopost', verbose_name='写真投稿')),
+                ('title', models.TextField(verbose_name='タイトル（形態素）')),
+                ('comment', models.TextField(verbose_name='コメント（形態素）')),
+                ('match', models.TextField(db_column='main_photopost_fts', verbose_name='検索式')),
+                ('rank', models.FloatField(verbose_name='スコア')),
+            ],
+            options={
+                'verbose_name': '全文検索インデックス',
+                'verbose_name_plural': '全文検索インデックス',
+                'db_table': 'main_photopost_fts',
+                'managed': False,
+            },
+        ),
+        migrations.RunPython(create_search_table, drop_search_table),
+    ]
@@ -0,0 +1,186 @@
+import logging
+import threading
+from pathlib import Path
+
+from django.conf import settings
+
+
+logger = logging.getLogger(__name__)
+
+# CLASSIFIER_BACKEND で選択できる推論バックエンド。
+# どれも同じ .pth チェックポイント（fp32 の state_dict）から構築する。
+BACKEND_CHOICES = [
+    ('eager', 'fp32 eager（既定）'),
+    ('torchscript', 'TorchScript（trace + freeze）'),
+    ('int8_dynamic', 'int8 動的量子化（全結合層）'),
+    ('int8_static', 'int8 静的量子化（キャリブレーション付き）'),
+]
+
+IMAGE_EXTENSIONS = {'.jpg', '.jpeg', '.png', '.webp', '.bmp'}
+
+# 分類層の直前（global average pooling 後, 1280次元）の特徴量を埋め込みとして取り出す。
+# nn.Module のバックエンドでは classifier への入力をフックで捕捉し（スレッドごとに保持）、
+# TorchScript では (logits, embedding) を返すモジュールとしてトレースする。
+_captured = threading.local()
+
+
+def _capture_embedding(module, args):
+    _captured.embedding = args[0]
+
+
+def attach_embedding_hook(model):
+    model.classifier.register_forward_pre_hook(_capture_embedding)
+    return model
+
+
+def forward(model, input_tensor):
+    """モデルを実行し、(logits, 埋め込み) を返す。埋め込みを取得できない場合は None。"""
+    _captured.embedding = None
+    output = model(input_tensor)
+    if isinstance(output, tuple):
+        return output
+
+    embedding = _captured.embedding
+    _captured.embedding = None
+    if embedding is not None and embedding.is_quantized:
+        embedding = embedding.dequantize()
+    return output, embedding
+
+
+def _load_state_dict(path):
+    import torch
+    return torch.load(path, map_location='cpu')
+
+
+def build_eager(path):
+    import torch.nn as nn
+    from torchvision import models as torch_models
+
+    from .classifier import CATEGORIES
+
+    model = torch_models.mobilenet_v2(weights=None)
+    model.classifier[1] = nn.Linear(model.last_channel, len(CATEGORIES))
+    model.load_state_dict(_load_state_dict(path))
+    model.eval()
+    return model
+
+
+def _with_embedding(model):
+    """TorchScript 用に、(logits, embedding) を返すモジュールで包む。"""
+    import torch
+    import torch.nn as nn
+
+    class WithEmbedding(nn.Module):
+        def __init__(self, model):
+            super().__init__()
+            self.features = model.features
+            self.classifier = model.classifier
+
+        def forward(self, x):
+            x = self.features(x)
+            x = nn.functional.adaptive_avg_pool2d(x, (1, 1))
+            embedding = torch.flatten(x, 1)
+            return self.classifier(embedding), embedding
+
+    return WithEmbedding(model).eval()
+
+
+def build_torchscript(path):
+    import torch
+
+    model = _with_embedding(build_eager(path))
+    example = torch.zeros(1, 3, 224, 224)
+    with torch.no_grad():
+        traced = torch.jit.trace(model, example)
+        frozen = torch.jit.optimize_for_inference(torch.jit.freeze(traced))
+    return frozen
+
+
+def build_int8_dynamic(path):
+    import torch
+    import torch.nn as nn
+
+    return torch.ao.quantization.quantize_dynamic(build_eager(path), {nn.Linear}, dtype=torch.qint8)
+
+
+def _quantized_engine():
+    import torch
+
+    engines = torch.backends.quantized.supported_engines
+    for engine in ('x86', 'fbgemm', 'qnnpack'):
+        if engine in engines:
+            return engine
+    raise RuntimeError('int8 量子化に対応したエンジンがありません。')
+
+
+def calibration_tensors(limit=None):
+    """静的量子化のキャリブレーション用に、実際の投稿写真を前処理して返す。"""
+    import torch
+
+    from .classifier import preprocess_image
+
+    limit = limit or getattr(settings, 'CLASSIFIER_CALIBRATION_IMAGES', 32)
+    root = Path(getattr(settings, 'CLASSIFIER_CALIBRATION_DIR', Path(settings.MEDIA_ROOT) / 'photos'))
+
+    tensors = []
+    for path in sorted(root.rglob('*')) if root.is_dir() else []:
+        if path.suffix.lower() not in IMAGE_EXTENSIONS:
+            continue
+        try:
+            tensors.append(preprocess_image(path.read_bytes()))
+        except Exception:
+            logger.warning("キャリブレーション画像を読み込めませんでした: %s", path)
+            continue
+        if len(tensors) >= limit:
+            break
+
+    if not tensors:
+        logger.warning("キャリブレーション画像が見つかりません (%s)。乱数入力で代用します。", root)
+        return torch.randn(8, 3, 224, 224)
+    return torch.cat(tensors, dim=0)
+
+
+def build_int8_static(path):
+    import torch
+    import torch.nn as nn
+    from torchvision.models import quantization as quantized_models
+
+    from .classifier import CATEGORIES
+
+    engine = _quantized_engine()
+    torch.backends.quantized.engine = engine
+
+    model = quantized_models.mobilenet_v2(weights=None, quantize=False)
+    model.classifier[1] = nn.Linear(model.last_channel, len(CATEGORIES))
+    model.load_state_dict(_load_state_dict(path))
+    model.eval()
+    model.fuse_model(is_qat=False)
+    model.qconfig = torch.ao.quantization.get_default_qconfig(engine)
+    torch.ao.quantization.prepare(model, inplace=True)
+
+    with torch.no_grad():
+        for batch in torch.split(calibration_tensors(), 8):
+            model(batch)
+
+    torch.ao.quantization.convert(model, inplace=True)
+    return model
+
+
+BUILDERS = {
+    'eager': build_eager,
+    'torchscript': build_torchscript,
+    'int8_dynamic': build_int8_dynamic,
+    'int8_static': build_int8_static,
+}
+
+
+def build_model(backend, path):
+    try:
+        builder = BUILDERS[backend]
+    except KeyError:
+        raise ValueError(f"不明な CLASSIFIER_BACKEND です: {backend}（{', '.join(BUILDERS)} のいずれか）")
+
+    model = builder(path)
+    if backend != 'torchscript':
+        attach_embedding_hook(model)
+    return model
@@ -0,0 +1,87 @@
+import logging
+import threading
+import time
+from pathlib import Path
+
+from django.conf import settings
+
+
+logger = logging.getLogger(__name__)
+
+# torch / torchvision はモデルが初めて必要になった時点で import する。
+# manage.py migrate などの推論を行わないプロセスでは読み込まれない。
+
+_model = None
+_loaded_backend = None
+_lock = threading.Lock()
+
+
+def model_path():
+    return Path(settings.CLASSIFIER_MODEL_PATH)
+
+
+def model_version():
+    """チェックポイントのファイル名（例: machirepo_ai_v1）をモデルバージョンとして扱う。"""
+    return model_path().stem
+
+
+def backend_name():
+    """読み込み済みのモデルのバックエンド（eager で代替した場合は 'eager'）。未読み込みなら設定値。"""
+    return _loaded_backend or getattr(settings, 'CLASSIFIER_BACKEND', 'eager')
+
+
+def load_model(backend=None):
+    """CLASSIFIER_BACKEND（または引数）で指定されたバックエンドでモデルを構築する。"""
+    from .model_backends import build_model
+
+    return build_model(backend or backend_name(), model_path())
+
+
+def get_model():
+    """分類モデルを返す。初回呼び出し時にのみ読み込む（スレッドセーフ）。"""
+    global _model
+    if _model is None:
+        with _lock:
+            if _model is None:
+                from .governor import configure_torch_threads
+
+                configure_torch_threads()
+                started = time.perf_counter()
+                _model = _load_with_fallback()
+                logger.info(
+                    "分類モデルを読み込みました: %s [%s] (%.2f秒)",
+                    model_path(), backend_name(), time.perf_counter() - started,
+                )
+    return _model
+
+
+def _load_with_fallback():
+    """CLASSIFIER_BACKEND のモデルを構築する。eager 以外の構築に失敗した場合は eager で代替する。"""
+    global _loaded_backend
+    from .model_backends import BUILDERS
+
+    backend = getattr(settings, 'CLASSIFIER_BACKEND', 'eager')
+    try:
+        model = load_model(backend)
+    except Exception:
+        # 不明なバックエンド名は設定の誤りなので代替しない
+        if backend == 'eager' or backend not in BUILDERS:
+            raise
+        logger.error(
+            "CLASSIFIER_BACKEND=%s のモデルを構築できませんでした。eager で代替します。", backend, exc_info=True,
+        )
+        backend, model = 'eager', load_model('eager')
+    _loaded_backend = backend
+    return model
+
+
+def is_loaded():
+    return _model is not None
+
+
+def preload():
+    """CLASSIFIER_EAGER_LOAD が有効なプロセスで起動時にモデルを読み込む。"""
+    try:
+        get_model()
+    except Exception:
+        logger.error("分類モデルの事前読み込みに失敗しました。初回推論時に再試行します。", exc_info=True)
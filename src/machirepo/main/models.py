@@ -3,6 +3,8 @@ from django.utils import timezone
 import uuid 
 from django.conf import settings
 
+from .media_storage import photo_storage
+
 
 # 投稿のカテゴリー分けに使用するタグモデル
 class Tag(models.Model):
@@ -81,6 +83,8 @@ class PhotoPost(models.Model):
     
     photo = models.ImageField(
         upload_to='photos/%Y/%m/%d/', 
+        storage=photo_storage,
+        db_index=True,
         verbose_name="写真"
     )
     
@@ -112,14 +116,471 @@ class PhotoPost(models.Model):
     
     
     posted_at = models.DateTimeField(
-        default=timezone.now, 
+        default=timezone.now,
         verbose_name="投稿日時"
     )
-    
+
+    # -----------------------------------------------------
+    # AI分類結果（投稿確定時に一度だけ推論して保存する）
+    # -----------------------------------------------------
+
+    ai_label = models.CharField(
+        max_length=20,
+        blank=True,
+        verbose_name="AI判定カテゴリ"
+    )
+
+    ai_confidence = models.FloatField(
+        null=True,
+        blank=True,
+        verbose_name="AI判定信頼度"
+    )
+
+    ai_probabilities = models.JSONField(
+        null=True,
+        blank=True,
+        verbose_name="AI判定確率（全カテゴリ）"
+    )
+
+    ai_model_version = models.CharField(
+        max_length=50,
+        blank=True,
+        verbose_name="AIモデルバージョン"
+    )
+
+    ai_classified_at = models.DateTimeField(
+        null=True,
+        blank=True,
+        verbose_name="AI判定日時"
+    )
+
+    # -----------------------------------------------------
+    # 写真の重複検出用ハッシュ（アップロード時に計算する）
+    # -----------------------------------------------------
+
+    photo_sha256 = models.CharField(
+        max_length=64,
+        blank=True,
+        db_index=True,
+        verbose_name="写真のSHA-256"
+    )
+
+    photo_phash = models.BigIntegerField(
+        null=True,
+        blank=True,
+        verbose_name="写真の知覚ハッシュ"
+    )
+
+    # 知覚ハッシュを16ビットずつに分けた値（近似重複の索引検索用）
+    photo_phash_band0 = models.IntegerField(null=True, blank=True, db_index=True)
+    photo_phash_band1 = models.IntegerField(null=True, blank=True, db_index=True)
+    photo_phash_band2 = models.IntegerField(null=True, blank=True, db_index=True)
+    photo_phash_band3 = models.IntegerField(null=True, blank=True, db_index=True)
+
+    # 写真の EXIF から読み取った撮影日時（保存する写真からはメタデータを取り除くため、取り込み時に記録する）
+    photo_taken_at = models.DateTimeField(
+        null=True,
+        blank=True,
+        verbose_name="撮影日時"
+    )
+
+    # 一覧・詳細表示用の縮小画像（WebP / JPEG）。{'source': 元画像名, 'widths': [生成済みの幅, ...]}
+    photo_derivatives = models.JSONField(
+        null=True,
+        blank=True,
+        verbose_name="縮小画像"
+    )
+
+    @property
+    def has_derivatives(self):
+        return bool(self.photo_derivatives) and self.photo_derivatives.get('source') == self.photo.name
+
+    @property
+    def derivative_widths(self):
+        return self.photo_derivatives['widths'] if self.has_derivatives else []
+
+    def derivative_url(self, width, fmt='jpg'):
+        """
+        表示幅 width 以上で最小の縮小画像の URL を返す。
+        該当する縮小画像がない（未生成・元画像が小さい）場合は元画像の URL。
+        """
+        from .thumbnails import derivative_name
+
+        for generated in self.derivative_widths:
+            if generated >= width:
+                return self.photo.storage.url(derivative_name(self.photo.name, generated, fmt))
+        return self.photo.url
+
+    @property
+    def thumbnail_url(self):
+        return self.derivative_url(480)
+
+    @property
+    def is_classified(self):
+        return bool(self.ai_label)
+
+    @property
+    def ai_confidence_percent(self):
+        if self.ai_confidence is None:
+            return None
+        return round(self.ai_confidence * 100, 1)
+
     def __str__(self):
         return f"{self.title or 'タイトルなし'} by {self.user.username} ({self.posted_at.strftime('%Y-%m-%d')})"
     
     class Meta:
         verbose_name = "写真投稿"
         verbose_name_plural = "写真投稿"
-        ordering = ['-posted_at']
\ No newline at end of file
+        ordering = ['-posted_at']
+        # 一覧の絞り込み（報告者・ステータス・カテゴリ・優先度）ごとに、並び順 (posted_at, id) まで含めた索引を持つ。
+        # 絞り込んだ行を索引の順に読むため、一時的な並べ替え（temp B-tree）が発生しない。
+        # 索引を変えた場合は main/tests.py の実行計画のテストで全表走査・並べ替えがないことを確認する。
+        indexes = [
+            # 報告一覧のキーセットページング（main/pagination.py）の並び順
+            models.Index(fields=['posted_at', 'id'], name='photopost_posted_at_id_idx'),
+            models.Index(fields=['user', 'posted_at', 'id'], name='photopost_user_posted_idx'),
+            models.Index(fields=['status', 'posted_at', 'id'], name='photopost_status_posted_idx'),
+            models.Index(fields=['tag', 'posted_at', 'id'], name='photopost_tag_posted_idx'),
+            models.Index(fields=['priority', 'posted_at', 'id'], name='photopost_priority_posted_idx'),
+            # 未対応（新規）の報告は件数の表示・一覧で頻繁に読むため、部分索引で小さく保つ
+            models.Index(
+                fields=['posted_at', 'id'], condition=models.Q(status='new'), name='photopost_new_posted_idx',
+            ),
+        ]
+
+
+# 類似写真（重複報告）検出用の埋め込みベクトル
+class PhotoEmbedding(models.Model):
+    """AI分類時に得られる特徴ベクトル（L2正規化済み, float16）を投稿ごとに保持するモデル。"""
+    post = models.OneToOneField(
+        PhotoPost,
+        on_delete=models.CASCADE,
+        primary_key=True,
+        related_name='embedding',
+        verbose_name="写真投稿"
+    )
+
+    vector = models.BinaryField(
+        verbose_name="埋め込みベクトル"
+    )
+
+    model_version = models.CharField(
+        max_length=50,
+        verbose_name="AIモデルバージョン"
+    )
+
+    updated_at = models.DateTimeField(
+        auto_now=True,
+        db_index=True,
+        verbose_name="更新日時"
+    )
+
+    def __str__(self):
+        return f"{self.post_id} ({self.model_version})"
+
+    class Meta:
+        verbose_name = "写真埋め込み"
+        verbose_name_plural = "写真埋め込み"
+
+
+class PhotoPostSearchIndex(models.Model):
+    """
+    報告のタイトル・コメントの全文検索インデックス（SQLite FTS5 の仮想テーブル, main/search.py）。
+    テーブルはマイグレーションで作成し、行は main/signals.py で投稿と同期する（ORM からは検索にだけ使う）。
+    """
+    post = models.OneToOneField(
+        PhotoPost,
+        on_delete=models.DO_NOTHING,
+        primary_key=True,
+        db_column='rowid',
+        related_name='search_index',
+        verbose_name="写真投稿"
+    )
+
+    title = models.TextField(
+        verbose_name="タイトル（形態素）"
+    )
+
+    comment = models.TextField(
+        verbose_name="コメント（形態素）"
+    )
+
+    # FTS5 の隠し列: テーブル名の列への = は MATCH、rank は BM25 のスコア（小さいほど関連が高い）
+    match = models.TextField(
+        db_column='main_photopost_fts',
+        verbose_name="検索式"
+    )
+
+    rank = models.FloatField(
+        verbose_name="スコア"
+    )
+
+    class Meta:
+        managed = False
+        db_table = 'main_photopost_fts'
+        verbose_name = "全文検索インデックス"
+        verbose_name_plural = "全文検索インデックス"
+
+
+
+# 投稿途中（ステージング中）の写真
+class StagedUpload(models.Model):
+    """投稿フローでアップロードされ、まだ投稿に確定していない写真。期限切れのものは media_gc で削除する。"""
+    name = models.CharField(
+        max_length=255,
+        unique=True,
+        verbose_name="ファイル名"
+    )
+
+    user = models.ForeignKey(
+        settings.AUTH_USER_MODEL,
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True,
+        verbose_name="アップロードユーザー"
+    )
+
+    size = models.BigIntegerField(
+        default=0,
+        verbose_name="サイズ（バイト）"
+    )
+
+    created_at = models.DateTimeField(
+        default=timezone.now,
+        verbose_name="アップロード日時"
+    )
+
+    expires_at = models.DateTimeField(
+        db_index=True,
+        verbose_name="有効期限"
+    )
+
+    def __str__(self):
+        return self.name
+
+    class Meta:
+        verbose_name = "ステージング中の写真"
+        verbose_name_plural = "ステージング中の写真"
+
+
+class ChunkedUpload(models.Model):
+    """
+    分割・再開可能なアップロード（通信が途切れやすい端末向け）。
+    受信したチャンクはステージング領域の一時ファイルに追記し、完了後に通常の投稿フローへ渡す。
+    """
+    id = models.UUIDField(
+        primary_key=True,
+        default=uuid.uuid4,
+        editable=False
+    )
+
+    user = models.ForeignKey(
+        settings.AUTH_USER_MODEL,
+        on_delete=models.CASCADE,
+        related_name='chunked_uploads',
+        verbose_name="アップロードユーザー"
+    )
+
+    filename = models.CharField(
+        max_length=255,
+        verbose_name="元のファイル名"
+    )
+
+    size = models.BigIntegerField(
+        verbose_name="サイズ（バイト）"
+    )
+
+    offset = models.BigIntegerField(
+        default=0,
+        verbose_name="受信済みのバイト数"
+    )
+
+    # 送信側が申告した SHA-256（完了時に受信したデータと照合する）
+    sha256 = models.CharField(
+        max_length=64,
+        blank=True,
+        verbose_name="SHA-256"
+    )
+
+    created_at = models.DateTimeField(
+        default=timezone.now,
+        verbose_name="開始日時"
+    )
+
+    expires_at = models.DateTimeField(
+        db_index=True,
+        verbose_name="有効期限"
+    )
+
+    def __str__(self):
+        return f"{self.filename} ({self.offset}/{self.size})"
+
+    class Meta:
+        verbose_name = "分割アップロード"
+        verbose_name_plural = "分割アップロード"
+
+
+class PhotoPostDraft(models.Model):
+    """
+    投稿フロー（写真 → 位置 → 確認）の途中の内容。1人につき1件で、別の端末からも続きを再開できる。
+    更新のたびに version を1つ進め、読み込んだ時点の version と一致する場合のみ書き込む（楽観的排他制御）。
+    有効期限を過ぎた下書きは使わず、manage.py media_gc で削除する。
+    """
+    user = models.OneToOneField(
+        settings.AUTH_USER_MODEL,
+        on_delete=models.CASCADE,
+        related_name='photo_post_draft',
+        verbose_name="投稿ユーザー"
+    )
+
+    version = models.PositiveIntegerField(
+        default=1,
+        verbose_name="版"
+    )
+
+    title = models.CharField(
+        max_length=100,
+        blank=True,
+        verbose_name="タイトル"
+    )
+
+    comment = models.TextField(
+        blank=True,
+        verbose_name="詳細コメント"
+    )
+
+    tag = models.ForeignKey(
+        Tag,
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True,
+        related_name='+',
+        verbose_name="メインカテゴリ"
+    )
+
+    latitude = models.DecimalField(
+        max_digits=30,
+        decimal_places=25,
+        null=True,
+        blank=True,
+        verbose_name="緯度"
+    )
+
+    longitude = models.DecimalField(
+        max_digits=30,
+        decimal_places=25,
+        null=True,
+        blank=True,
+        verbose_name="経度"
+    )
+
+    # 'photo': 写真の EXIF に記録された撮影地点を使用
+    location_source = models.CharField(
+        max_length=10,
+        blank=True,
+        verbose_name="位置情報の取得元"
+    )
+
+    # -----------------------------------------------------
+    # ステージング中の写真（staging.stage_upload の結果）
+    # -----------------------------------------------------
+
+    photo_name = models.CharField(
+        max_length=255,
+        blank=True,
+        verbose_name="ステージング中の写真"
+    )
+
+    photo_sha256 = models.CharField(
+        max_length=64,
+        blank=True,
+        verbose_name="写真のSHA-256"
+    )
+
+    photo_phash = models.BigIntegerField(
+        null=True,
+        blank=True,
+        verbose_name="写真の知覚ハッシュ"
+    )
+
+    photo_latitude = models.FloatField(
+        null=True,
+        blank=True,
+        verbose_name="撮影地点の緯度"
+    )
+
+    photo_longitude = models.FloatField(
+        null=True,
+        blank=True,
+        verbose_name="撮影地点の経度"
+    )
+
+    photo_taken_at = models.DateTimeField(
+        null=True,
+        blank=True,
+        verbose_name="撮影日時"
+    )
+
+    # 確認画面で分類した結果（classifier.result_to_json の形式）。投稿確定時に再利用する
+    ai_result = models.JSONField(
+        null=True,
+        blank=True,
+        verbose_name="AI分類結果"
+    )
+
+    created_at = models.DateTimeField(
+        default=timezone.now,
+        verbose_name="作成日時"
+    )
+
+    updated_at = models.DateTimeField(
+        default=timezone.now,
+        verbose_name="更新日時"
+    )
+
+    expires_at = models.DateTimeField(
+        db_index=True,
+        verbose_name="有効期限"
+    )
+
+    def __str__(self):
+        return f"{self.user} の下書き (v{self.version})"
+
+    class Meta:
+        verbose_name = "投稿の下書き"
+        verbose_name_plural = "投稿の下書き"
+
+
+class MediaBlob(models.Model):
+    """
+    内容のハッシュで名前付けした写真ファイル（media_storage.ContentAddressedMixin のストレージ）と、それを参照する投稿の数。
+    同じ内容の写真は1つのファイルを共有し、参照数が 0 になったファイルを削除する。
+    """
+    name = models.CharField(
+        max_length=255,
+        primary_key=True,
+        verbose_name="ファイル名"
+    )
+
+    size = models.BigIntegerField(
+        default=0,
+        verbose_name="サイズ（バイト）"
+    )
+
+    refcount = models.IntegerField(
+        default=0,
+        db_index=True,
+        verbose_name="参照数"
+    )
+
+    created_at = models.DateTimeField(
+        default=timezone.now,
+        verbose_name="保存日時"
+    )
+
+    def __str__(self):
+        return f"{self.name} ({self.refcount})"
+
+    class Meta:
+        verbose_name = "写真ファイル"
+        verbose_name_plural = "写真ファイル"
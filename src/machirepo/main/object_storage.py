@@ -0,0 +1,480 @@
+import datetime
+import hashlib
+import hmac
+import io
+import mimetypes
+import os
+import tempfile
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+import xml.etree.ElementTree as ET
+from collections import namedtuple
+from email.utils import parsedate_to_datetime
+
+from django.conf import settings
+from django.core.files import File
+from django.core.files.storage import Storage
+from django.utils import timezone
+from django.utils.deconstruct import deconstructible
+
+from .media_storage import ContentAddressedMixin
+
+
+# -----------------------------------------------------
+# S3 互換のオブジェクトストレージ（AWS S3・MinIO など）
+#   リクエストの署名（AWS Signature Version 4）は標準ライブラリだけで計算する。
+#   読み込みは Range 付きの GET でストリーミングし、写真全体をメモリやローカルディスクに置かない。
+#   大きなファイルはマルチパートで保存し、ブラウザからの直接アップロード用に署名付き URL を発行する
+#   （main.direct_uploads を参照）。
+# -----------------------------------------------------
+
+ALGORITHM = 'AWS4-HMAC-SHA256'
+UNSIGNED_PAYLOAD = 'UNSIGNED-PAYLOAD'
+EMPTY_SHA256 = hashlib.sha256(b'').hexdigest()
+
+# マルチパートの各パートは最後を除いて 5MB 以上にする（S3 の制限）
+MIN_PART_SIZE = 5 * 1024 * 1024
+# 署名付き URL の有効期限の上限（7日）
+MAX_PRESIGN_EXPIRES = 7 * 24 * 60 * 60
+
+_READ_BUFFER_SIZE = 64 * 1024
+
+ObjectInfo = namedtuple('ObjectInfo', ['name', 'size', 'last_modified'])
+MultipartUpload = namedtuple('MultipartUpload', ['name', 'upload_id', 'initiated'])
+
+
+class ObjectStorageError(Exception):
+    """オブジェクトストレージがエラーを返した。"""
+
+    def __init__(self, status, code='', message=''):
+        super().__init__(f"{status} {code} {message}".strip())
+        self.status = status
+        self.code = code
+
+
+def _quote(value, safe='-_.~'):
+    return urllib.parse.quote(str(value), safe=safe)
+
+
+def _hmac(key, message):
+    return hmac.new(key, message.encode('utf-8'), hashlib.sha256).digest()
+
+
+def signing_key(secret_key, datestamp, region, service='s3'):
+    """日付・リージョン・サービスごとの署名鍵。"""
+    key = _hmac(f"AWS4{secret_key}".encode('utf-8'), datestamp)
+    for part in (region, service, 'aws4_request'):
+        key = _hmac(key, part)
+    return key
+
+
+def canonical_query(params):
+    return '&'.join(f"{k}={v}" for k, v in sorted((_quote(k), _quote(v)) for k, v in params.items()))
+
+
+def _utcnow():
+    return datetime.datetime.now(datetime.timezone.utc)
+
+
+class _ObjectReader(io.RawIOBase):
+    """
+    オブジェクトを先頭から1本の GET で読み進める。seek した場合は次の読み込みで
+    その位置からの Range 付き GET を開き直す（PIL のようにヘッダーを読み直す処理でも全体を取り直さない）。
+    """
+
+    def __init__(self, storage, name):
+        super().__init__()
+        self._storage = storage
+        self._name = name
+        self._response = storage._request('GET', name)
+        self._response_position = 0
+        self._position = 0
+        self.size = int(self._response.headers.get('Content-Length', 0))
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def tell(self):
+        return self._position
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_CUR:
+            offset += self._position
+        elif whence == io.SEEK_END:
+            offset += self.size
+        self._position = max(0, offset)
+        return self._position
+
+    def readinto(self, buffer):
+        if self._position >= self.size:
+            return 0
+        if self._response is None or self._response_position != self._position:
+            self._close_response()
+            self._response = self._storage._request(
+                'GET', self._name, headers={'Range': f"bytes={self._position}-"}, ok=(200, 206),
+            )
+            self._response_position = self._position
+        read = self._response.readinto(buffer)
+        self._position += read
+        self._response_position += read
+        return read
+
+    def _close_response(self):
+        if self._response is not None:
+            self._response.close()
+            self._response = None
+
+    def close(self):
+        self._close_response()
+        super().close()
+
+
+@deconstructible
+class S3Storage(Storage):
+    """
+    S3 互換のオブジェクトストレージ。endpoint_url にはローカルの MinIO なども指定できる
+    （addressing_style='path' で http://host/bucket/key の形式、'virtual' で http://bucket.host/key の形式）。
+    url() は public_url があればその下の URL、なければ署名付き URL を返す。
+    署名付き URL は url_expires の半分ごとに同じ URL になるため、ブラウザのキャッシュが効く。
+    """
+
+    def __init__(
+        self, endpoint_url, bucket, access_key, secret_key, region='us-east-1', addressing_style='path',
+        public_url=None, url_expires=24 * 60 * 60, multipart_threshold=16 * 1024 * 1024,
+        part_size=8 * 1024 * 1024, timeout=30,
+    ):
+        self.endpoint_url = endpoint_url.rstrip('/')
+        self.bucket = bucket
+        self.access_key = access_key
+        self.secret_key = secret_key
+        self.region = region
+        self.addressing_style = addressing_style
+        self.public_url = public_url.rstrip('/') if public_url else None
+        self.url_expires = min(int(url_expires), MAX_PRESIGN_EXPIRES)
+        self.part_size = max(int(part_size), MIN_PART_SIZE)
+        self.multipart_threshold = max(int(multipart_threshold), self.part_size)
+        self.timeout = timeout
+
+    # -----------------------------------------------------
+    # 署名・リクエスト
+    # -----------------------------------------------------
+
+    def _target(self, name=''):
+        """(scheme, host, 署名に使うパス) を返す。"""
+        endpoint = urllib.parse.urlsplit(self.endpoint_url)
+        key = _quote(name, safe='/-_.~')
+        if self.addressing_style == 'virtual':
+            return endpoint.scheme, f"{self.bucket}.{endpoint.netloc}", f"/{key}"
+        return endpoint.scheme, endpoint.netloc, f"/{_quote(self.bucket)}/{key}"
+
+    def _scope(self, amz_date):
+        return f"{amz_date[:8]}/{self.region}/s3/aws4_request"
+
+    def _signature(self, amz_date, canonical_request):
+        string_to_sign = '\n'.join([
+            ALGORITHM, amz_date, self._scope(amz_date), hashlib.sha256(canonical_request.encode('utf-8')).hexdigest(),
+        ])
+        key = signing_key(self.secret_key, amz_date[:8], self.region)
+        return hmac.new(key, string_to_sign.encode('utf-8'), hashlib.sha256).hexdigest()
+
+    def presigned_url(self, method, name, expires=3600, query=None, headers=None, now=None):
+        """
+        署名付き URL を返す。headers に指定したヘッダー（Content-Length など）は署名に含まれ、
+        利用者は同じ値で送る必要がある。
+        """
+        scheme, host, path = self._target(name)
+        amz_date = (now or _utcnow()).strftime('%Y%m%dT%H%M%SZ')
+        signed_headers = {'host': host}
+        signed_headers.update({k.lower(): str(v).strip() for k, v in (headers or {}).items()})
+        header_names = ';'.join(sorted(signed_headers))
+
+        params = dict(query or {})
+        params.update({
+            'X-Amz-Algorithm': ALGORITHM,
+            'X-Amz-Credential': f"{self.access_key}/{self._scope(amz_date)}",
+            'X-Amz-Date': amz_date,
+            'X-Amz-Expires': str(min(int(expires), MAX_PRESIGN_EXPIRES)),
+            'X-Amz-SignedHeaders': header_names,
+        })
+        canonical_request = '\n'.join([
+            method, path, canonical_query(params),
+            ''.join(f"{k}:{signed_headers[k]}\n" for k in sorted(signed_headers)),
+            header_names, UNSIGNED_PAYLOAD,
+        ])
+        signature = self._signature(amz_date, canonical_request)
+        return f"{scheme}://{host}{path}?{canonical_query(params)}&X-Amz-Signature={signature}"
+
+    def _request(self, method, name='', query=None, headers=None, body=None, ok=(200,)):
+        """署名したリクエストを送り、レスポンスを返す（呼び出し側で close する）。"""
+        scheme, host, path = self._target(name)
+        amz_date = _utcnow().strftime('%Y%m%dT%H%M%SZ')
+        payload_hash = hashlib.sha256(body).hexdigest() if body else EMPTY_SHA256
+
+        all_headers = {k.lower(): str(v).strip() for k, v in (headers or {}).items()}
+        all_headers.update({'host': host, 'x-amz-date': amz_date, 'x-amz-content-sha256': payload_hash})
+        header_names = ';'.join(sorted(all_headers))
+        query_string = canonical_query(query or {})
+        canonical_request = '\n'.join([
+            method, path, query_string,
+            ''.join(f"{k}:{all_headers[k]}\n" for k in sorted(all_headers)),
+            header_names, payload_hash,
+        ])
+        all_headers['authorization'] = (
+            f"{ALGORITHM} Credential={self.access_key}/{self._scope(amz_date)}, "
+            f"SignedHeaders={header_names}, Signature={self._signature(amz_date, canonical_request)}"
+        )
+
+        url = f"{scheme}://{host}{path}" + (f"?{query_string}" if query_string else '')
+        request = urllib.request.Request(url, data=body, headers=all_headers, method=method)
+        try:
+            response = urllib.request.urlopen(request, timeout=self.timeout)
+        except urllib.error.HTTPError as e:
+            if e.code == 404 and method in ('GET', 'HEAD'):
+                raise FileNotFoundError(name) from None
+            raise _storage_error(e) from None
+        if response.status not in ok:
+            response.close()
+            raise ObjectStorageError(response.status)
+        return response
+
+    def _call(self, method, name='', **kwargs):
+        with self._request(method, name, **kwargs) as response:
+            return response.headers, response.read()
+
+    def object_headers(self, name):
+        """保存するオブジェクトに付けるヘッダー（配信時にそのまま返される）。"""
+        return {'Content-Type': mimetypes.guess_type(name)[0] or 'application/octet-stream'}
+
+    # -----------------------------------------------------
+    # Storage API
+    # -----------------------------------------------------
+
+    def _open(self, name, mode='rb'):
+        if 'w' in mode or 'a' in mode or '+' in mode:
+            raise ValueError("S3Storage のファイルは読み込み専用です。")
+        reader = _ObjectReader(self, name)
+        file = File(io.BufferedReader(reader, buffer_size=_READ_BUFFER_SIZE), name=name)
+        file.size = reader.size
+        return file
+
+    def _save(self, name, content):
+        if hasattr(content, 'seek'):
+            content.seek(0)
+        head = _read_up_to(content, self.multipart_threshold + 1)
+        if len(head) <= self.multipart_threshold:
+            self.put(name, head)
+        else:
+            self._save_multipart(name, head, content)
+        return name
+
+    def put(self, name, data):
+        """data を name にそのまま保存する（既存のオブジェクトは上書きする）。"""
+        self._call('PUT', name, headers=self.object_headers(name), body=bytes(data))
+
+    def _save_multipart(self, name, head, content):
+        upload_id = self.create_multipart_upload(name)
+        try:
+            parts = []
+            for number, data in enumerate(_iter_parts(head, content, self.part_size), start=1):
+                headers, _ = self._call(
+                    'PUT', name, query={'partNumber': number, 'uploadId': upload_id}, body=data,
+                )
+                parts.append((number, headers['ETag']))
+            self.complete_multipart_upload(name, upload_id, parts)
+        except BaseException:
+            self.abort_multipart_upload(name, upload_id)
+            raise
+
+    def delete(self, name):
+        try:
+            self._call('DELETE', name, ok=(200, 204))
+        except ObjectStorageError as e:
+            if e.status != 404:
+                raise
+
+    def _head(self, name):
+        with self._request('HEAD', name) as response:
+            return response.headers
+
+    def exists(self, name):
+        try:
+            self._head(name)
+        except FileNotFoundError:
+            return False
+        return True
+
+    def size(self, name):
+        return int(self._head(name)['Content-Length'])
+
+    def get_modified_time(self, name):
+        modified = parsedate_to_datetime(self._head(name)['Last-Modified'])
+        return modified if settings.USE_TZ else timezone.make_naive(modified)
+
+    def url(self, name):
+        if self.public_url:
+            return f"{self.public_url}/{_quote(name, safe='/-_.~')}"
+        # 同じ時間帯には同じ URL を返す（有効期間は最短でも url_expires の半分）
+        window = max(1, self.url_expires // 2)
+        signed_at = int(time.time()) // window * window
+        return self.presigned_url(
+            'GET', name, expires=self.url_expires,
+            now=datetime.datetime.fromtimestamp(signed_at, datetime.timezone.utc),
+        )
+
+    def listdir(self, path):
+        prefix = f"{path.strip('/')}/" if path.strip('/') else ''
+        directories, files = [], []
+        for root in self._list_pages({'list-type': '2', 'prefix': prefix, 'delimiter': '/'}):
+            directories += [p.findtext('{*}Prefix')[len(prefix):].rstrip('/') for p in root.findall('{*}CommonPrefixes')]
+            files += [c.findtext('{*}Key')[len(prefix):] for c in root.findall('{*}Contents')]
+        return directories, files
+
+    # -----------------------------------------------------
+    # 一覧（media_gc 用）
+    # -----------------------------------------------------
+
+    def _list_pages(self, query, markers=None):
+        """一覧の各ページ（XML）を返す。markers は {次のページの指定に使うパラメータ: レスポンスの要素名}。"""
+        query = dict(query)
+        markers = markers or {'continuation-token': 'NextContinuationToken'}
+        while True:
+            _, body = self._call('GET', '', query=query)
+            root = ET.fromstring(body)
+            yield root
+            if root.findtext('{*}IsTruncated') != 'true':
+                return
+            for param, element in markers.items():
+                query[param] = root.findtext(f'{{*}}{element}') or ''
+
+    def list_objects(self, prefix):
+        """prefix で始まるオブジェクトの ObjectInfo を順に返す。"""
+        for root in self._list_pages({'list-type': '2', 'prefix': prefix}):
+            for item in root.findall('{*}Contents'):
+                yield ObjectInfo(
+                    item.findtext('{*}Key'), int(item.findtext('{*}Size') or 0),
+                    datetime.datetime.fromisoformat(item.findtext('{*}LastModified').replace('Z', '+00:00')),
+                )
+
+    def list_multipart_uploads(self, prefix):
+        """prefix で始まる完了していないマルチパートアップロードを順に返す。"""
+        pages = self._list_pages(
+            {'uploads': '', 'prefix': prefix},
+            markers={'key-marker': 'NextKeyMarker', 'upload-id-marker': 'NextUploadIdMarker'},
+        )
+        for root in pages:
+            for item in root.findall('{*}Upload'):
+                yield MultipartUpload(
+                    item.findtext('{*}Key'), item.findtext('{*}UploadId'),
+                    datetime.datetime.fromisoformat(item.findtext('{*}Initiated').replace('Z', '+00:00')),
+                )
+
+    # -----------------------------------------------------
+    # 直接アップロード（署名付き URL・マルチパート）
+    # -----------------------------------------------------
+
+    def presigned_put_url(self, name, size, expires=3600):
+        """name に size バイトのデータを PUT する署名付き URL（異なるサイズのデータは拒否される）。"""
+        return self.presigned_url('PUT', name, expires=expires, headers={'Content-Length': size})
+
+    def create_multipart_upload(self, name):
+        _, body = self._call('POST', name, query={'uploads': ''}, headers=self.object_headers(name))
+        return ET.fromstring(body).findtext('{*}UploadId')
+
+    def presigned_part_url(self, name, upload_id, number, size, expires=3600):
+        return self.presigned_url(
+            'PUT', name, expires=expires,
+            query={'partNumber': number, 'uploadId': upload_id}, headers={'Content-Length': size},
+        )
+
+    def complete_multipart_upload(self, name, upload_id, parts):
+        """parts は (パート番号, ETag) のリスト。"""
+        root = ET.Element('CompleteMultipartUpload')
+        for number, etag in sorted(parts):
+            part = ET.SubElement(root, 'Part')
+            ET.SubElement(part, 'PartNumber').text = str(number)
+            ET.SubElement(part, 'ETag').text = etag
+        _, body = self._call('POST', name, query={'uploadId': upload_id}, body=ET.tostring(root))
+        # 完了の失敗は 200 のレスポンス本文で返ることがある
+        result = ET.fromstring(body)
+        if result.tag == 'Error':
+            raise ObjectStorageError(200, result.findtext('Code') or '', result.findtext('Message') or '')
+
+    def abort_multipart_upload(self, name, upload_id):
+        try:
+            self._call('DELETE', name, query={'uploadId': upload_id}, ok=(200, 204))
+        except ObjectStorageError as e:
+            if e.status != 404:
+                raise
+
+
+@deconstructible
+class ContentAddressedS3Storage(ContentAddressedMixin, S3Storage):
+    """S3 互換のオブジェクトストレージに保存する ContentAddressedMixin のストレージ。"""
+
+    def object_headers(self, name):
+        headers = super().object_headers(name)
+        if self.is_content_name(name):
+            # 名前が内容から決まるため、ストレージや CDN から直接配信する場合も長期間キャッシュさせる
+            headers['Cache-Control'] = 'public, max-age=31536000, immutable'
+        return headers
+
+    def _save(self, name, content):
+        """内容を一時ファイルに書き込みながらハッシュを計算し、内容の名前で保存する（既にあれば送らない）。"""
+        extension = os.path.splitext(name)[1]
+        with tempfile.TemporaryFile() as tmp:
+            digest = hashlib.sha256()
+            if hasattr(content, 'seek'):
+                content.seek(0)
+            for chunk in content.chunks():
+                digest.update(chunk)
+                tmp.write(chunk)
+            name = self.content_name(digest.hexdigest(), extension)
+            self.register(name, tmp.tell())
+            if not self.exists(name):
+                tmp.seek(0)
+                super()._save(name, File(tmp))
+        return name
+
+    def link_file(self, path, name):
+        """ローカルのファイル path を name として保存する（同じ内容のオブジェクトが既にあれば送らない）。"""
+        self.register(name, os.path.getsize(path))
+        if not self.exists(name):
+            with open(path, 'rb') as f:
+                S3Storage._save(self, name, File(f))
+        return name
+
+
+def _storage_error(error):
+    body = error.read()
+    try:
+        root = ET.fromstring(body)
+        return ObjectStorageError(error.code, root.findtext('Code') or '', root.findtext('Message') or '')
+    except ET.ParseError:
+        return ObjectStorageError(error.code)
+
+
+def _read_up_to(content, size):
+    data = bytearray()
+    while len(data) < size:
+        chunk = content.read(size - len(data))
+        if not chunk:
+            break
+        data += chunk
+    return bytes(data)
+
+
+def _iter_parts(head, content, part_size):
+    """先に読んだ head に続けて content を読み、part_size ごとのデータを返す（最後のパートは短い）。"""
+    buffer = head
+    while True:
+        if len(buffer) < part_size:
+            buffer += _read_up_to(content, part_size - len(buffer))
+        if not buffer:
+            return
+        yield buffer[:part_size]
+        buffer = buffer[part_size:]
@@ -0,0 +1,91 @@
+import base64
+from collections import namedtuple
+from datetime import datetime
+
+from django.conf import settings
+
+
+# -----------------------------------------------------
+# 報告一覧のキーセット（カーソル）ページング
+#   並び順は (posted_at, id) の降順。前後のページは「直前のページの端の行より古い／新しい行」を
+#   インデックスの範囲で読み出すため、OFFSET のように読み飛ばす行を数えず、何ページ目でも同じ速さで表示できる。
+#   カーソルはページの端の行の (posted_at, id) を URL に載せられる形にしたもの。
+#   条件は「posted_at が範囲内」（索引の範囲）と「同じ時刻の行の id で除外」に分け、OR で索引が分かれないようにする。
+# -----------------------------------------------------
+
+Page = namedtuple('Page', ['items', 'next_cursor', 'prev_cursor'])
+
+
+def page_size(value=None):
+    """1ページの件数（?size= で指定された値は POST_LIST_MAX_PAGE_SIZE までに制限する）。"""
+    default = getattr(settings, 'POST_LIST_PAGE_SIZE', 30)
+    try:
+        size = int(value) if value else default
+    except (TypeError, ValueError):
+        size = default
+    return max(1, min(size, getattr(settings, 'POST_LIST_MAX_PAGE_SIZE', 100)))
+
+
+def encode_cursor(post):
+    raw = f"{post.posted_at.isoformat()}|{post.pk}".encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+
+def decode_cursor(value):
+    """カーソルを (posted_at, id) に戻す。不正な値は None（先頭のページを表示する）。"""
+    if not value:
+        return None
+    try:
+        raw = base64.urlsafe_b64decode(value + '=' * (-len(value) % 4)).decode()
+        posted_at, pk = raw.rsplit('|', 1)
+        return datetime.fromisoformat(posted_at), int(pk)
+    except (ValueError, UnicodeDecodeError):
+        return None
+
+
+def paginate(queryset, after=None, before=None, size=None):
+    """
+    queryset（絞り込み済みの PhotoPost）の1ページを返す。
+    after を指定するとそのカーソルより古い行、before を指定すると新しい行のページになる。
+    前後のページがなければ、そちらのカーソルは None。
+    """
+    size = size or page_size()
+    cursor = after
+    after = decode_cursor(after)
+    before = decode_cursor(before) if after is None else None
+
+    if before is not None:
+        posted_at, pk = before
+        rows = list(
+            queryset.filter(posted_at__gte=posted_at).exclude(posted_at=posted_at, pk__lte=pk)
+            .order_by('posted_at', 'pk')[:size + 1]
+        )
+        has_more = len(rows) > size
+        items = rows[:size][::-1]
+        # 新しい側へ戻った場合、古い側には必ず元のページがある
+        has_newer, has_older = has_more, True
+    else:
+        if after is not None:
+            posted_at, pk = after
+            queryset = queryset.filter(posted_at__lte=posted_at).exclude(posted_at=posted_at, pk__gte=pk)
+        rows = list(queryset.order_by('-posted_at', '-pk')[:size + 1])
+        items = rows[:size]
+        has_newer, has_older = after is not None, len(rows) > size
+
+    if not items:
+        # 末尾より後ろを指定された場合（行が削除された場合など）は、新しい側へ戻れるようにする
+        return Page([], None, cursor if after is not None else None)
+    return Page(
+        items,
+        encode_cursor(items[-1]) if has_older else None,
+        encode_cursor(items[0]) if has_newer else None,
+    )
+
+
+def page_query(request, **cursor):
+    """現在の絞り込み条件を保ったまま、カーソルだけを差し替えたクエリ文字列。"""
+    query = request.GET.copy()
+    for key in ('after', 'before'):
+        query.pop(key, None)
+    query.update({k: v for k, v in cursor.items() if v})
+    return query.urlencode()
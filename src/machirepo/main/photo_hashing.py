@@ -0,0 +1,143 @@
+import hashlib
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.db.models import Q
+from PIL import Image
+
+
+# 64ビットの知覚ハッシュ（dHash）を 16ビットずつ4つの帯に分けて DB に索引付けする。
+# ハミング距離が3以下なら少なくとも1つの帯が完全一致するため、帯の一致で候補を絞ってから距離を計算する。
+PHASH_BANDS = 4
+_BAND_BITS = 64 // PHASH_BANDS
+_BAND_MASK = (1 << _BAND_BITS) - 1
+# 帯の一致で取りこぼしのない最大のハミング距離（帯の数を変えるには PhotoPost の列と移行が必要）
+MAX_NEAR_DUPLICATE_DISTANCE = PHASH_BANDS - 1
+
+# dHash の縮小サイズ（横 9 x 縦 8 の隣接画素の大小で 64 ビット）
+_DHASH_SIZE = (9, 8)
+
+
+def near_duplicate_distance(value=None):
+    """
+    ほぼ同一とみなすハミング距離（value を省略すると PHOTO_NEAR_DUPLICATE_DISTANCE）。
+    MAX_NEAR_DUPLICATE_DISTANCE を超える値は帯の索引で見つからない組が出るため ImproperlyConfigured。
+    """
+    if value is None:
+        value = getattr(settings, 'PHOTO_NEAR_DUPLICATE_DISTANCE', MAX_NEAR_DUPLICATE_DISTANCE)
+    if not 0 <= value <= MAX_NEAR_DUPLICATE_DISTANCE:
+        raise ImproperlyConfigured(
+            f"PHOTO_NEAR_DUPLICATE_DISTANCE は 0〜{MAX_NEAR_DUPLICATE_DISTANCE} にしてください"
+            f"（知覚ハッシュの索引は {PHASH_BANDS} 帯のため、それより遠い写真は検出できません）: {value}"
+        )
+    return value
+
+
+def _to_signed(value):
+    """64ビット符号なし整数を DB（符号付き BIGINT）に保存できる値にする。"""
+    return value - (1 << 64) if value >= (1 << 63) else value
+
+
+def _to_unsigned(value):
+    return value + (1 << 64) if value < 0 else value
+
+
+def dhash(image):
+    """画像の dHash（64ビット）を返す。"""
+    image.draft('L', (_DHASH_SIZE[0] * 8, _DHASH_SIZE[1] * 8))
+    pixels = image.convert('L').resize(_DHASH_SIZE, Image.Resampling.BOX).tobytes()
+
+    value = 0
+    width = _DHASH_SIZE[0]
+    for y in range(_DHASH_SIZE[1]):
+        row = pixels[y * width:(y + 1) * width]
+        for x in range(width - 1):
+            value = (value << 1) | (row[x] > row[x + 1])
+    return value
+
+
+def file_sha256(path):
+    """ファイルの SHA-256（16進）をチャンク単位で読みながら計算する。"""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(64 * 1024), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def compute_hashes(uploaded_file):
+    """
+    アップロードされたファイルの SHA-256（16進）と dHash を返す。
+    SHA-256 はチャンク単位で読みながら計算し、dHash は JPEG の縮小デコードで求めるため
+    大きな写真でも全体をメモリに展開しない。画像として読めない場合の dHash は None。
+    """
+    digest = hashlib.sha256()
+    for chunk in uploaded_file.chunks():
+        digest.update(chunk)
+
+    uploaded_file.seek(0)
+    try:
+        perceptual = perceptual_hash(uploaded_file)
+    finally:
+        uploaded_file.seek(0)
+
+    return digest.hexdigest(), perceptual
+
+
+def perceptual_hash(file):
+    """画像ファイルの dHash を返す（画像として読めない場合は None）。"""
+    try:
+        with Image.open(file) as image:
+            return dhash(image)
+    except Exception:
+        return None
+
+
+def hamming_distance(a, b):
+    return bin(_to_unsigned(a) ^ _to_unsigned(b)).count('1')
+
+
+def hash_fields(sha256, perceptual):
+    """PhotoPost に保存するハッシュ関連フィールドの値を返す。"""
+    fields = {'photo_sha256': sha256 or '', 'photo_phash': None}
+    for i in range(PHASH_BANDS):
+        fields[f'photo_phash_band{i}'] = None
+
+    if perceptual is not None:
+        perceptual = _to_unsigned(perceptual)
+        fields['photo_phash'] = _to_signed(perceptual)
+        for i in range(PHASH_BANDS):
+            fields[f'photo_phash_band{i}'] = (perceptual >> (i * _BAND_BITS)) & _BAND_MASK
+    return fields
+
+
+def find_duplicates(sha256, perceptual, exclude=None, max_distance=None):
+    """
+    同一内容（SHA-256 一致）の投稿と、知覚ハッシュが近い投稿を返す。
+    戻り値は {'exact': [PhotoPost, ...], 'near': [(PhotoPost, ハミング距離), ...]}。
+    """
+    from .models import PhotoPost
+
+    max_distance = near_duplicate_distance(max_distance)
+    limit = getattr(settings, 'DUPLICATE_TOP_K', 5)
+    posts = PhotoPost.objects.select_related('tag')
+    if exclude is not None:
+        posts = posts.exclude(pk=exclude)
+
+    exact = list(posts.filter(photo_sha256=sha256).order_by('pk')[:limit]) if sha256 else []
+
+    near = []
+    if perceptual is not None:
+        bands = hash_fields(sha256, perceptual)
+        condition = Q()
+        for i in range(PHASH_BANDS):
+            condition |= Q(**{f'photo_phash_band{i}': bands[f'photo_phash_band{i}']})
+
+        exact_ids = {post.pk for post in exact}
+        for post in posts.filter(condition).exclude(pk__in=exact_ids):
+            distance = hamming_distance(post.photo_phash, perceptual)
+            if distance <= max_distance:
+                near.append((post, distance))
+        near.sort(key=lambda item: item[1])
+
+    return {'exact': exact, 'near': near[:limit]}
@@ -0,0 +1,177 @@
+import logging
+import os
+import re
+import sys
+from collections import Counter, defaultdict
+from contextlib import ExitStack
+
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connections
+from django.template.base import Node
+
+
+logger = logging.getLogger(__name__)
+
+# -----------------------------------------------------
+# 画面ごとの SQL の本数の上限と、N+1 の検出
+#   BUDGETS は URL 名ごとの1リクエストあたりの SQL の上限（セッション・ログインユーザーの読み込みを含む）。
+#   上限はその画面で最も SQL の多い処理（投稿の確定などの POST・類似報告の検索を含む）に合わせる。
+#   コミット後の処理（写真ファイルの削除、PHOTO_THUMBNAIL_ASYNC が False の場合の縮小画像の生成）も数える。
+#   main/tests.py で main/urls.py のすべての URL を開き、主な POST（投稿の確定・位置の指定・下書きの競合・
+#   写真のアップロード・報告の削除）も送って上限を超えないことを確かめる。
+#   開発時（QUERY_INSPECTOR）は QueryInspectorMiddleware が各リクエストの SQL を記録し、
+#   同じ形の SQL が QUERY_INSPECTOR_REPEAT_THRESHOLD 回以上実行された場合と上限を超えた場合に、
+#   SQL を発行したテンプレートの行（テンプレート外ならアプリケーションのコードの行）と合わせてログに出す。
+#   テストの実行中（QUERY_INSPECTOR_RAISE）はログに出す代わりに QueryBudgetExceeded を送出し、テストを失敗させる。
+# -----------------------------------------------------
+
+BUDGETS = {
+    'index': 2,
+    'home_redirect': 2,
+    'signup': 0,
+    'login': 0,
+    'logout': 4,
+    'user_home': 3,
+    'my_page': 2,
+    'post_history': 3,
+    'post_list': 4,
+    'post_list_fragment': 1,
+    'post_detail': 3,
+    'user_terms': 2,
+    'user_about': 2,
+    'user_stamp': 2,
+    'user_profile_edit': 2,
+    'user_password_change': 2,
+    'user_edit_complete': 2,
+    'photo_post_create': 13,
+    'photo_post_location': 6,
+    'photo_post_confirm': 22,
+    'photo_post_staged_photo': 3,
+    'photo_post_draft_discard': 5,
+    'photo_upload_initiate': 3,
+    'photo_upload_direct_finalize': 11,
+    'photo_upload_chunk': 5,
+    'photo_upload_finalize': 11,
+    'photo_post_done': 2,
+    'admin_home': 4,
+    'admin_user_list': 3,
+    'admin_user_delete_confirm': 2,
+    'admin_user_delete_complete': 2,
+    'admin_post_list': 4,
+    'admin_post_list_fragment': 3,
+    'admin_post_detail': 5,
+    'admin_post_status_edit': 3,
+    'admin_status_edit_done': 3,
+    'admin_post_delete': 13,
+    'admin_post_delete_complete': 2,
+    'admin_classifier_metrics': 2,
+    'admin_tag_list': 3,
+    'admin_tag_create': 2,
+    'admin_tag_edit': 3,
+    'ademin_tag_delete': 3,
+    'admin_tag_create_complete': 2,
+    'admin_tag_edit_complete': 2,
+    'admin_tag_delete_complete': 2,
+}
+
+# IN 句の要素数が違うだけの SQL は同じ形とみなす
+_IN_LIST = re.compile(r'\(%s(?:, %s)*\)')
+
+# トランザクションの制御（atomic ごとに発行される）は繰り返しとして数えない
+_TRANSACTION_CONTROL = ('BEGIN', 'SAVEPOINT', 'RELEASE', 'ROLLBACK', 'COMMIT')
+
+_THIS_FILE = os.path.abspath(__file__)
+
+
+class QueryBudgetExceeded(AssertionError):
+    """SQL の本数が上限を超えた、または N+1 の疑いのある SQL が実行された（QUERY_INSPECTOR_RAISE の場合）。"""
+
+
+def budget_for(url_name):
+    return BUDGETS.get(url_name)
+
+
+def query_shape(sql):
+    return _IN_LIST.sub('(...)', sql)
+
+
+def query_source():
+    """実行中の SQL を発行したテンプレートの行（なければアプリケーションのコードの行）。"""
+    base_dir = str(settings.BASE_DIR)
+    source = None
+    frame = sys._getframe(1)
+    while frame is not None:
+        node = frame.f_locals.get('self')
+        # isinstance は遅延評価のオブジェクト（request.user など）を評価して SQL を発行するため type で判定する
+        if issubclass(type(node), Node) and getattr(node, 'token', None) is not None and node.origin is not None:
+            return f"{node.origin.template_name or node.origin.name}:{node.token.lineno}"
+        filename = os.path.abspath(frame.f_code.co_filename)
+        if source is None and filename != _THIS_FILE and filename.startswith(base_dir) and 'site-packages' not in filename:
+            source = f"{os.path.relpath(filename, base_dir)}:{frame.f_lineno}"
+        frame = frame.f_back
+    return source or '(不明)'
+
+
+class QueryRecorder:
+    """connection.execute_wrapper に渡し、実行された SQL とその発行元を記録する。"""
+
+    def __init__(self, record_source=True):
+        self.record_source = record_source
+        self.queries = []
+
+    def __call__(self, execute, sql, params, many, context):
+        self.queries.append((sql, query_source() if self.record_source else None))
+        return execute(sql, params, many, context)
+
+    def __len__(self):
+        return len(self.queries)
+
+    def repeated(self, threshold):
+        """threshold 回以上実行された形の SQL を {形: Counter(発行元)} で返す。"""
+        sources = defaultdict(Counter)
+        for sql, source in self.queries:
+            if sql.lstrip().upper().startswith(_TRANSACTION_CONTROL):
+                continue
+            sources[query_shape(sql)][source] += 1
+        return {shape: counts for shape, counts in sources.items() if sum(counts.values()) >= threshold}
+
+
+class QueryInspectorMiddleware:
+    """開発時に、N+1 の疑いのある SQL と、BUDGETS の上限を超えたリクエストをログに出す。"""
+
+    def __init__(self, get_response):
+        if not getattr(settings, 'QUERY_INSPECTOR', False):
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        self.threshold = getattr(settings, 'QUERY_INSPECTOR_REPEAT_THRESHOLD', 3)
+
+    def __call__(self, request):
+        recorder = QueryRecorder()
+        with ExitStack() as stack:
+            for connection in connections.all():
+                stack.enter_context(connection.execute_wrapper(recorder))
+            response = self.get_response(request)
+
+        problems = []
+        for shape, sources in recorder.repeated(self.threshold).items():
+            problems.append((
+                "N+1 の疑い: %s で同じ形の SQL が %d 回実行されました（%s）\n%s",
+                request.path, sum(sources.values()),
+                ', '.join(f"{source} ×{count}" for source, count in sources.most_common()), shape,
+            ))
+
+        url_name = request.resolver_match.url_name if request.resolver_match else None
+        budget = budget_for(url_name)
+        if budget is not None and len(recorder) > budget:
+            problems.append((
+                "SQL の本数が上限を超えました: %s（%s %s）%d 本 / 上限 %d 本\n%s",
+                request.path, request.method, url_name, len(recorder), budget,
+                '\n'.join(f"  {source}: {sql}" for sql, source in recorder.queries),
+            ))
+
+        if problems and getattr(settings, 'QUERY_INSPECTOR_RAISE', False):
+            raise QueryBudgetExceeded('\n'.join(message % tuple(args) for message, *args in problems))
+        for message, *args in problems:
+            logger.warning(message, *args)
+        return response
@@ -0,0 +1,182 @@
+import base64
+import threading
+import unicodedata
+
+from django.db import connections, transaction
+from django.db.models import F, Q
+
+from . import pagination
+from .models import PhotoPost, PhotoPostSearchIndex
+
+
+# -----------------------------------------------------
+# 報告（タイトル・コメント）の全文検索
+#   SQLite FTS5 の仮想テーブル main_photopost_fts（PhotoPostSearchIndex）に、fugashi（MeCab + unidic-lite）で
+#   形態素に分け、原形（「空いて」→「空く」）に揃えた語を空白区切りで保存する。検索語も同じ規則で語に分け、
+#   すべての語を含む報告を BM25 のスコア順（タイトルの一致を重くする）に返す。
+#   インデックスは投稿の保存・削除と同じトランザクションで更新する（main/signals.py）。
+#   bulk_create・QuerySet.update() はシグナルを送らないため、manage.py rebuild_search_index で作り直す。
+#   語の分け方（_SKIPPED_POS など）を変えた場合も作り直す。
+# -----------------------------------------------------
+
+TABLE = PhotoPostSearchIndex._meta.db_table
+
+# BM25 の列ごとの重み（タイトル, コメント）。変えた場合は rebuild_search_index で反映する
+RANK_FUNCTION = 'bm25(3.0, 1.0)'
+
+# 検索に使わない品詞（助詞・助動詞・記号）
+_SKIPPED_POS = ('助詞', '助動詞', '補助記号', '記号', '空白')
+
+_tagger = None
+_tagger_lock = threading.Lock()
+
+
+def available(using='default'):
+    return connections[using].vendor == 'sqlite'
+
+
+def _get_tagger():
+    # 起動時間に影響しないよう、最初に語に分けるときに辞書を読み込む
+    global _tagger
+    if _tagger is None:
+        with _tagger_lock:
+            if _tagger is None:
+                import fugashi
+                _tagger = fugashi.Tagger()
+    return _tagger
+
+
+def tokenize(text):
+    """text を検索に使う語（原形・小文字, 全角英数字は半角）のリストにする。"""
+    text = unicodedata.normalize('NFKC', text or '').strip()
+    if not text:
+        return []
+    words = []
+    for word in _get_tagger()(text):
+        if word.feature.pos1 in _SKIPPED_POS:
+            continue
+        lemma = getattr(word.feature, 'lemma', None)
+        # 外来語の原形は「ドア-door」の形のため、語源の部分を除く
+        lemma = lemma.split('-', 1)[0] if lemma and not lemma.startswith('-') else None
+        words.append((lemma or word.surface).lower())
+    return words
+
+
+def match_expression(text):
+    """検索語を FTS5 の検索式（すべての語を含む）にする。検索に使える語がなければ None。"""
+    words = tokenize(text)
+    if not words:
+        return None
+    return ' '.join('"{}"'.format(word.replace('"', '""')) for word in words)
+
+
+# -----------------------------------------------------
+# インデックスの更新
+# -----------------------------------------------------
+
+def index_posts(posts, using='default'):
+    """posts（title・comment を持つ PhotoPost）のインデックスを書き直す。"""
+    if not available(using):
+        return
+    rows = [(post.pk, ' '.join(tokenize(post.title)), ' '.join(tokenize(post.comment))) for post in posts]
+    if not rows:
+        return
+    with transaction.atomic(using=using), connections[using].cursor() as cursor:
+        cursor.executemany(f'DELETE FROM {TABLE} WHERE rowid = %s', [(pk,) for pk, _, _ in rows])
+        cursor.executemany(f'INSERT INTO {TABLE} (rowid, title, comment) VALUES (%s, %s, %s)', rows)
+
+
+def remove_posts(post_ids, using='default'):
+    post_ids = list(post_ids)
+    if not post_ids or not available(using):
+        return
+    with connections[using].cursor() as cursor:
+        cursor.executemany(f'DELETE FROM {TABLE} WHERE rowid = %s', [(pk,) for pk in post_ids])
+
+
+def remove_orphans(using='default'):
+    """投稿が削除済みの行を消し、消した行数を返す。"""
+    with connections[using].cursor() as cursor:
+        cursor.execute(
+            f'DELETE FROM {TABLE} WHERE rowid NOT IN (SELECT id FROM {PhotoPost._meta.db_table})'
+        )
+        return cursor.rowcount
+
+
+def optimize(using='default'):
+    """スコアの設定を反映し、インデックスの断片をまとめる。"""
+    with connections[using].cursor() as cursor:
+        cursor.execute(f"INSERT INTO {TABLE} ({TABLE}, rank) VALUES ('rank', %s)", [RANK_FUNCTION])
+        cursor.execute(f"INSERT INTO {TABLE} ({TABLE}) VALUES ('optimize')")
+
+
+# -----------------------------------------------------
+# 検索
+# -----------------------------------------------------
+
+def search(queryset, text):
+    """
+    queryset（絞り込み済みの PhotoPost）を検索語 text で絞り込み、(queryset, スコア順か) を返す。
+    スコア順の場合は各行に search_rank（BM25, 小さいほど関連が高い）を付ける。
+    FTS5 を使えないデータベースでは部分一致で絞り込み、並び順は変えない。
+    """
+    if not available(queryset.db):
+        return queryset.filter(Q(title__icontains=text) | Q(comment__icontains=text)), False
+    expression = match_expression(text)
+    queryset = queryset.annotate(search_rank=F('search_index__rank'))
+    if expression is None:
+        # 助詞・記号だけの検索語は何にも一致しない
+        return queryset.none(), True
+    return queryset.filter(search_index__match=expression), True
+
+
+def encode_cursor(post):
+    raw = f"{post.search_rank!r}|{post.pk}".encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+
+def decode_cursor(value):
+    if not value:
+        return None
+    try:
+        raw = base64.urlsafe_b64decode(value + '=' * (-len(value) % 4)).decode()
+        rank, pk = raw.rsplit('|', 1)
+        return float(rank), int(pk)
+    except (ValueError, UnicodeDecodeError):
+        return None
+
+
+def paginate(queryset, after=None, before=None, size=None):
+    """
+    search() したスコア順の queryset の1ページ（pagination.Page）を返す。
+    pagination.paginate と同じく (スコア, id) をカーソルにしたキーセットページングで、同じ検索語なら結果の順は変わらない。
+    """
+    size = size or pagination.page_size()
+    cursor = after
+    after = decode_cursor(after)
+    before = decode_cursor(before) if after is None else None
+
+    if before is not None:
+        rank, pk = before
+        rows = list(
+            queryset.filter(search_rank__lte=rank).exclude(search_rank=rank, pk__gte=pk)
+            .order_by('-search_rank', '-pk')[:size + 1]
+        )
+        has_more = len(rows) > size
+        items = rows[:size][::-1]
+        has_better, has_worse = has_more, True
+    else:
+        if after is not None:
+            rank, pk = after
+            queryset = queryset.filter(search_rank__gte=rank).exclude(search_rank=rank, pk__lte=pk)
+        rows = list(queryset.order_by('search_rank', 'pk')[:size + 1])
+        items = rows[:size]
+        has_better, has_worse = after is not None, len(rows) > size
+
+    if not items:
+        return pagination.Page([], None, cursor if after is not None else None)
+    return pagination.Page(
+        items,
+        encode_cursor(items[-1]) if has_worse else None,
+        encode_cursor(items[0]) if has_better else None,
+    )
@@ -0,0 +1,178 @@
+from django.contrib.auth import get_user_model
+from django.db import transaction
+from django.db.models import F
+from django.db.models.signals import post_delete, post_init, post_save
+from django.dispatch import receiver
+from django.utils import timezone
+
+from . import media_gc, search, similarity, thumbnails
+from . import media_storage
+from .models import PhotoEmbedding, PhotoPost
+
+
+# -----------------------------------------------------
+# 類似写真インデックスの差分更新
+#   インデックスを読み込み済みのプロセスでのみ反映する（未読み込みなら初回の sync で取り込まれる）
+#   他のプロセスのインデックスは PhotoEmbedding.updated_at の差分同期で取り込むため、
+#   投稿のタグ・位置情報が変わった場合は埋め込みの updated_at を更新する。
+# -----------------------------------------------------
+
+_INDEX_ATTRIBUTES = ('tag', 'latitude', 'longitude')
+
+@receiver(post_save, sender=PhotoEmbedding)
+def add_embedding_to_index(sender, instance, **kwargs):
+    index = similarity.loaded_index()
+    if index is None or instance.model_version != index.model_version:
+        return
+    post = instance.post
+    index.upsert(
+        post.pk, similarity.decode_embedding(instance.vector), post.tag_id, post.latitude, post.longitude,
+    )
+
+
+@receiver(post_init, sender=PhotoPost)
+def remember_loaded_index_attributes(sender, instance, **kwargs):
+    instance._loaded_index_attributes = tuple(
+        instance.__dict__.get(instance._meta.get_field(name).attname) for name in _INDEX_ATTRIBUTES
+    )
+
+
+@receiver(post_save, sender=PhotoPost)
+def update_post_in_index(sender, instance, created, update_fields=None, **kwargs):
+    if update_fields is not None and not set(_INDEX_ATTRIBUTES) & set(update_fields):
+        return
+    attributes = (instance.tag_id, instance.latitude, instance.longitude)
+    changed = not created and attributes != getattr(instance, '_loaded_index_attributes', None)
+    instance._loaded_index_attributes = attributes
+    if not changed:
+        return
+
+    PhotoEmbedding.objects.filter(post_id=instance.pk).update(updated_at=timezone.now())
+    index = similarity.loaded_index()
+    if index is not None:
+        index.update_attributes(instance.pk, instance.tag_id, instance.latitude, instance.longitude)
+
+
+@receiver(post_delete, sender=PhotoPost)
+def remove_post_from_index(sender, instance, **kwargs):
+    index = similarity.loaded_index()
+    if index is not None:
+        index.remove(instance.pk)
+
+
+# -----------------------------------------------------
+# 縮小画像の生成（保存のコミット後にバックグラウンドで実行する）
+# -----------------------------------------------------
+
+@receiver(post_save, sender=PhotoPost)
+def schedule_photo_derivatives(sender, instance, update_fields=None, **kwargs):
+    if update_fields is not None and 'photo' not in update_fields:
+        return
+    if instance.photo and not instance.has_derivatives:
+        transaction.on_commit(lambda: thumbnails.schedule(instance.pk))
+
+
+# -----------------------------------------------------
+# 写真ファイルの参照数と削除
+#   ユーザー削除による連鎖削除・QuerySet.delete() でも投稿ごとに post_delete が送られる。
+#   写真の差し替え・投稿の削除で参照されなくなったファイルは、トランザクションが
+#   取り消された場合にファイルだけ消えないよう、コミット後に削除する。
+# -----------------------------------------------------
+
+@receiver(post_init, sender=PhotoPost)
+def remember_loaded_photo(sender, instance, **kwargs):
+    # 遅延読み込み（only/defer）の場合に DB を読みに行かないよう、__dict__ から直接取り出す
+    value = instance.__dict__.get('photo')
+    instance._loaded_photo_name = getattr(value, 'name', value) or None
+
+
+@receiver(post_save, sender=PhotoPost)
+def update_photo_references(sender, instance, created, update_fields=None, **kwargs):
+    if update_fields is not None and 'photo' not in update_fields:
+        return
+    old_name = None if created else getattr(instance, '_loaded_photo_name', None)
+    new_name = instance.photo.name or None
+    if old_name == new_name:
+        return
+
+    storage = instance.photo.storage
+    instance._loaded_photo_name = new_name
+    if new_name:
+        media_storage.retain(storage, new_name)
+    if old_name:
+        media_storage.release(storage, old_name)
+        transaction.on_commit(lambda: media_gc.delete_photo_if_unreferenced(old_name, storage))
+
+
+@receiver(post_delete, sender=PhotoPost)
+def delete_post_photo_files(sender, instance, **kwargs):
+    name = instance.photo.name
+    if not name:
+        return
+    storage = instance.photo.storage
+    media_storage.release(storage, name)
+    transaction.on_commit(lambda: media_gc.delete_photo_if_unreferenced(name, storage))
+
+
+# -----------------------------------------------------
+# ユーザーごとの投稿数（CustomUser.post_count）
+#   投稿の保存・削除と同じトランザクションで UPDATE 1文で増減する（取り消されれば投稿数も戻る）。
+#   連鎖削除・QuerySet.delete() は投稿ごとに post_delete が送られるため、ここで反映される。
+#   bulk_create・QuerySet.update(user=...) はシグナルを送らないため、manage.py reconcile_post_counts で数え直す。
+# -----------------------------------------------------
+
+def _add_post_count(user_id, delta):
+    if user_id is None:
+        return
+    users = get_user_model().objects.filter(pk=user_id)
+    if delta < 0:
+        users = users.filter(post_count__gte=-delta)
+    users.update(post_count=F('post_count') + delta)
+
+
+@receiver(post_init, sender=PhotoPost)
+def remember_loaded_user(sender, instance, **kwargs):
+    instance._loaded_user_id = instance.__dict__.get('user_id')
+
+
+@receiver(post_save, sender=PhotoPost)
+def update_post_counts(sender, instance, created, update_fields=None, **kwargs):
+    if created:
+        _add_post_count(instance.user_id, 1)
+    elif update_fields is None or 'user' in update_fields:
+        # 投稿の報告者が付け替えられた場合
+        old_user_id = getattr(instance, '_loaded_user_id', None)
+        if old_user_id is not None and old_user_id != instance.user_id:
+            _add_post_count(old_user_id, -1)
+            _add_post_count(instance.user_id, 1)
+    instance._loaded_user_id = instance.user_id
+
+
+@receiver(post_delete, sender=PhotoPost)
+def decrement_post_count(sender, instance, **kwargs):
+    _add_post_count(instance.user_id, -1)
+
+
+# -----------------------------------------------------
+# 全文検索インデックス（main/search.py）
+#   タイトル・コメントが変わった場合だけ、投稿の保存と同じトランザクションで書き直す。
+# -----------------------------------------------------
+
+@receiver(post_init, sender=PhotoPost)
+def remember_loaded_text(sender, instance, **kwargs):
+    instance._loaded_search_text = (instance.__dict__.get('title'), instance.__dict__.get('comment'))
+
+
+@receiver(post_save, sender=PhotoPost)
+def update_search_index(sender, instance, created, update_fields=None, using='default', **kwargs):
+    if update_fields is not None and not {'title', 'comment'} & set(update_fields):
+        return
+    text = (instance.title, instance.comment)
+    if created or text != getattr(instance, '_loaded_search_text', None):
+        search.index_posts([instance], using=using)
+    instance._loaded_search_text = text
+
+
+@receiver(post_delete, sender=PhotoPost)
+def remove_post_from_search_index(sender, instance, using='default', **kwargs):
+    search.remove_posts([instance.pk], using=using)
@@ -0,0 +1,266 @@
+import logging
+import math
+import threading
+
+import numpy as np
+from django.conf import settings
+from django.utils import timezone
+
+
+logger = logging.getLogger(__name__)
+
+# MobileNetV2 の分類層直前の特徴量の次元数
+EMBEDDING_DIM = 1280
+
+# 絞り込み後の候補を取り出して類似度を計算する行数（一時メモリを抑えるため分割する）
+_SCORE_BLOCK_ROWS = 4096
+
+_KM_PER_DEGREE = 111.0
+
+
+def encode_embedding(vector):
+    """特徴ベクトルを L2 正規化し、float16 のバイト列にする（内積 = コサイン類似度になる）。"""
+    vector = np.asarray(vector, dtype=np.float32).reshape(-1)
+    norm = float(np.linalg.norm(vector))
+    if norm > 0:
+        vector = vector / norm
+    return vector.astype(np.float16).tobytes()
+
+
+def decode_embedding(data):
+    return np.frombuffer(bytes(data), dtype=np.float16)
+
+
+def _coordinate(value):
+    """緯度・経度を float にする。未設定（None・空文字・0.0）の場合は None。"""
+    try:
+        value = float(value)
+    except (TypeError, ValueError):
+        return None
+    return value if abs(value) > 0.000001 else None
+
+
+class EmbeddingIndex:
+    """
+    投稿の埋め込みをメモリ上の numpy 配列に保持し、コサイン類似度で上位k件を探すインデックス。
+    配列は容量を倍々に確保して追記し、削除は末尾の行との入れ替えで行うため、
+    投稿の追加・削除のたびに全体を作り直す必要はない。
+    DB には float16 で保存するが、検索のたびに変換しないようメモリ上は float32 で持つ。
+    """
+
+    def __init__(self, dim=EMBEDDING_DIM, capacity=1024):
+        self.dim = dim
+        self._lock = threading.RLock()
+        self._size = 0
+        self._ids = np.zeros(capacity, dtype=np.int64)
+        self._vectors = np.zeros((capacity, dim), dtype=np.float32)
+        self._tags = np.full(capacity, -1, dtype=np.int64)
+        self._coords = np.full((capacity, 2), np.nan, dtype=np.float32)
+        self._rows = {}
+        self._synced_at = None
+        self.model_version = None
+
+    def __len__(self):
+        return self._size
+
+    def _grow(self):
+        capacity = len(self._ids) * 2
+        self._ids = np.resize(self._ids, capacity)
+        self._vectors = np.resize(self._vectors, (capacity, self.dim))
+        self._tags = np.resize(self._tags, capacity)
+        self._coords = np.resize(self._coords, (capacity, 2))
+
+    def upsert(self, post_id, vector, tag_id=None, latitude=None, longitude=None):
+        vector = np.asarray(vector, dtype=np.float32).reshape(-1)
+        if vector.shape[0] != self.dim:
+            logger.warning("埋め込みの次元数が一致しません (報告ID %s: %d)", post_id, vector.shape[0])
+            return
+
+        with self._lock:
+            row = self._rows.get(post_id)
+            if row is None:
+                if self._size == len(self._ids):
+                    self._grow()
+                row = self._size
+                self._size += 1
+                self._rows[post_id] = row
+                self._ids[row] = post_id
+
+            self._vectors[row] = vector
+            self._tags[row] = tag_id if tag_id is not None else -1
+            latitude, longitude = _coordinate(latitude), _coordinate(longitude)
+            self._coords[row] = (
+                (latitude, longitude) if latitude is not None and longitude is not None else (np.nan, np.nan)
+            )
+
+    def update_attributes(self, post_id, tag_id=None, latitude=None, longitude=None):
+        """投稿のタグ・位置情報の変更を反映する（埋め込みは変えない）。"""
+        with self._lock:
+            row = self._rows.get(post_id)
+            if row is not None:
+                self.upsert(post_id, self._vectors[row], tag_id, latitude, longitude)
+
+    def remove(self, post_id):
+        with self._lock:
+            row = self._rows.pop(post_id, None)
+            if row is None:
+                return
+
+            last = self._size - 1
+            if row != last:
+                moved_id = int(self._ids[last])
+                self._ids[row] = self._ids[last]
+                self._vectors[row] = self._vectors[last]
+                self._tags[row] = self._tags[last]
+                self._coords[row] = self._coords[last]
+                self._rows[moved_id] = row
+            self._size = last
+
+    def sync(self):
+        """前回の同期以降に保存された埋め込みを DB から取り込む（初回は全件）。"""
+        from . import model_loader
+        from .models import PhotoEmbedding
+
+        version = model_loader.model_version()
+        with self._lock:
+            if self.model_version != version:
+                # モデルが変わると特徴空間も変わるため、旧モデルの埋め込みとは比較しない
+                self._size = 0
+                self._rows.clear()
+                self._synced_at = None
+                self.model_version = version
+
+            rows = PhotoEmbedding.objects.filter(model_version=version)
+            if self._synced_at is not None:
+                # 同一時刻に保存された行を取りこぼさないよう境界を含める（upsert は冪等）
+                rows = rows.filter(updated_at__gte=self._synced_at)
+
+            for post_id, vector, tag_id, latitude, longitude, updated_at in rows.values_list(
+                'post_id', 'vector', 'post__tag_id', 'post__latitude', 'post__longitude', 'updated_at',
+            ).iterator(chunk_size=2000):
+                self.upsert(post_id, decode_embedding(vector), tag_id, latitude, longitude)
+                if self._synced_at is None or updated_at > self._synced_at:
+                    self._synced_at = updated_at
+
+    def search(self, vector, k=5, tag_id=None, near=None, radius_km=None, exclude=None):
+        """
+        類似度の高い順に [(報告ID, 類似度), ...] を返す。
+        tag_id・near=(緯度, 経度)・radius_km を指定すると、該当する投稿だけを候補にする。
+        """
+        query = np.asarray(vector, dtype=np.float32).reshape(-1)
+
+        with self._lock:
+            size = self._size
+            mask = np.ones(size, dtype=bool)
+            if tag_id is not None:
+                mask &= self._tags[:size] == tag_id
+            if near is not None and radius_km:
+                # 緯度経度の矩形で大まかに絞り込む（位置情報のない投稿は除外される）
+                latitude, longitude = near
+                d_lat = radius_km / _KM_PER_DEGREE
+                d_lng = radius_km / (_KM_PER_DEGREE * max(math.cos(math.radians(latitude)), 0.01))
+                coords = self._coords[:size]
+                mask &= (np.abs(coords[:, 0] - latitude) <= d_lat) & (np.abs(coords[:, 1] - longitude) <= d_lng)
+            if exclude is not None and exclude in self._rows:
+                mask[self._rows[exclude]] = False
+
+            candidates = np.flatnonzero(mask)
+            if not len(candidates):
+                return []
+
+            if len(candidates) == size:
+                scores = self._vectors[:size] @ query
+            else:
+                scores = np.empty(len(candidates), dtype=np.float32)
+                for start in range(0, len(candidates), _SCORE_BLOCK_ROWS):
+                    block = candidates[start:start + _SCORE_BLOCK_ROWS]
+                    scores[start:start + len(block)] = self._vectors[block] @ query
+            ids = self._ids[candidates]
+
+        k = min(k, len(scores))
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        return [(int(ids[i]), float(scores[i])) for i in top]
+
+
+_index = None
+_index_lock = threading.Lock()
+
+
+def get_index():
+    """プロセス内で共有するインデックスを返す（初回呼び出し時に DB から読み込む）。"""
+    global _index
+    if _index is None:
+        with _index_lock:
+            if _index is None:
+                index = EmbeddingIndex()
+                index.sync()
+                logger.info("類似写真インデックスを読み込みました (%d 件)", len(index))
+                _index = index
+    return _index
+
+
+def loaded_index():
+    """読み込み済みのインデックス（未読み込みなら None）。シグナルからの差分更新用。"""
+    return _index
+
+
+def store_embedding(post, embedding, model_version):
+    """
+    分類結果の埋め込みを保存し、読み込み済みのインデックスに反映する。
+    SELECT してから INSERT する update_or_create は SQLite で他の書き込みと競合すると
+    即座に「database is locked」になるため、1文の upsert で保存する。
+    """
+    from .models import PhotoEmbedding
+
+    if not embedding:
+        return None
+    row = PhotoEmbedding(post=post, vector=embedding, model_version=model_version, updated_at=timezone.now())
+    PhotoEmbedding.objects.bulk_create(
+        [row], update_conflicts=True,
+        unique_fields=['post'], update_fields=['vector', 'model_version', 'updated_at'],
+    )
+
+    index = loaded_index()
+    if index is not None and index.model_version == model_version:
+        index.upsert(post.pk, decode_embedding(embedding), post.tag_id, post.latitude, post.longitude)
+    return row
+
+
+def find_similar(embedding, tag_id=None, latitude=None, longitude=None, exclude=None, k=None, threshold=None):
+    """
+    埋め込みに類似した既存の投稿を [(PhotoPost, 類似度), ...] で返す。
+    位置情報がある場合は DUPLICATE_SEARCH_RADIUS_KM 以内の投稿に絞り込む。
+    """
+    from .models import PhotoPost
+
+    if not embedding:
+        return []
+
+    k = k or getattr(settings, 'DUPLICATE_TOP_K', 5)
+    threshold = getattr(settings, 'DUPLICATE_SIMILARITY_THRESHOLD', 0.9) if threshold is None else threshold
+
+    index = get_index()
+    index.sync()
+
+    latitude, longitude = _coordinate(latitude), _coordinate(longitude)
+    near = (latitude, longitude) if latitude is not None and longitude is not None else None
+    hits = [
+        (post_id, score) for post_id, score in index.search(
+            decode_embedding(embedding), k=k, tag_id=tag_id, near=near,
+            radius_km=getattr(settings, 'DUPLICATE_SEARCH_RADIUS_KM', 0.5), exclude=exclude,
+        )
+        if score >= threshold
+    ]
+    if not hits:
+        return []
+
+    posts = PhotoPost.objects.select_related('tag').in_bulk([post_id for post_id, _ in hits])
+    results = []
+    for post_id, score in hits:
+        if post_id not in posts:
+            # 他のプロセスで削除された投稿
+            index.remove(post_id)
+            continue
+        results.append((posts[post_id], score))
+    return results
@@ -0,0 +1,171 @@
+import contextlib
+import errno
+import os
+import shutil
+import uuid
+from collections import namedtuple
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.exceptions import SuspiciousFileOperation
+from django.core.files import File
+from django.core.files.storage import FileSystemStorage
+from django.utils import timezone
+
+from . import exif, ingest, photo_hashing
+from .media_storage import ContentAddressedMixin
+from .models import StagedUpload
+
+
+# -----------------------------------------------------
+# 投稿途中の写真のステージング領域
+#   投稿フローの1ステップ目でアップロードされた写真は MEDIA_ROOT ではなく
+#   PHOTO_STAGING_ROOT に置き、投稿確定時に ImageField の保存先へ移す。
+# -----------------------------------------------------
+
+StagedPhoto = namedtuple('StagedPhoto', ['name', 'sha256', 'phash', 'metadata'])
+
+
+def staging_storage():
+    return FileSystemStorage(location=settings.PHOTO_STAGING_ROOT)
+
+
+def path(name):
+    return staging_storage().path(name)
+
+
+def exists(name):
+    return bool(name) and staging_storage().exists(name)
+
+
+def ttl():
+    return timedelta(hours=getattr(settings, 'PHOTO_STAGING_TTL_HOURS', 24))
+
+
+def stage_upload(uploaded_file, user=None):
+    """
+    アップロードされた写真を正規化（ingest.normalize）してステージング領域に書き込み、
+    StagedPhoto(名前, SHA-256, dHash, メタデータ) を返す。ハッシュは正規化後の写真から計算する。
+    メタデータは正規化で取り除かれる前に EXIF から読み取った位置情報・撮影日時・向き。
+    名前は「ランダムなディレクトリ/元のファイル名（拡張子は出力形式）」で、確定時のファイル名に使う。
+    取り込めない写真は ingest.RejectedImage。
+    投稿されずに放置された写真は StagedUpload の有効期限を過ぎると media_gc で削除される。
+    """
+    storage = staging_storage()
+    metadata = exif.read_metadata(uploaded_file)
+
+    directory = uuid.uuid4().hex
+    try:
+        stem = storage.get_valid_name(os.path.splitext(os.path.basename(uploaded_file.name))[0])
+    except SuspiciousFileOperation:
+        stem = 'photo'
+    os.makedirs(storage.path(directory), exist_ok=True)
+    try:
+        staged_path = ingest.normalize(uploaded_file, storage.path(f"{directory}/{stem}"), metadata['orientation'])
+    except BaseException:
+        with contextlib.suppress(OSError):
+            os.rmdir(storage.path(directory))
+        raise
+    name = f"{directory}/{os.path.basename(staged_path)}"
+
+    sha256 = photo_hashing.file_sha256(staged_path)
+    with open(staged_path, 'rb') as f:
+        perceptual = photo_hashing.perceptual_hash(f)
+
+    now = timezone.now()
+    StagedUpload.objects.create(
+        name=name,
+        user=user if user is not None and user.is_authenticated else None,
+        size=os.path.getsize(staged_path),
+        created_at=now,
+        expires_at=now + ttl(),
+    )
+    return StagedPhoto(name, sha256, perceptual, metadata)
+
+
+def discard(name):
+    """ステージング中の写真（とそのディレクトリ）を削除する。"""
+    if not name:
+        return
+    StagedUpload.objects.filter(name=name).delete()
+    staged_path = path(name)
+    try:
+        os.unlink(staged_path)
+    except FileNotFoundError:
+        pass
+    try:
+        os.rmdir(os.path.dirname(staged_path))
+    except OSError:
+        pass
+
+
+def _link(src, dst):
+    """
+    src を dst にハードリンクする（既存のファイルは上書きしない）。
+    別のファイルシステムの場合のみ、dst と同じディレクトリへストリーミングでコピーしてからリンクする。
+    """
+    try:
+        os.link(src, dst)
+        return
+    except OSError as e:
+        if e.errno not in (errno.EXDEV, errno.EPERM, errno.ENOTSUP):
+            raise
+
+    tmp_path = f"{dst}.tmp{os.getpid()}"
+    try:
+        shutil.copyfile(src, tmp_path)
+        os.link(tmp_path, dst)
+    finally:
+        with contextlib.suppress(FileNotFoundError):
+            os.unlink(tmp_path)
+
+
+def promote(name, field_file, sha256=None):
+    """
+    ステージング中の写真を ImageField（field_file）の保存先に移し、field_file.name を設定する。
+    同じファイルシステム上ならリンクの付け替えだけで、写真のデータは読み書きしない。
+    sha256 はステージング中の写真の SHA-256（stage_upload の戻り値。省略時は計算する）。
+    """
+    staged_path = path(name)
+    filename = os.path.basename(name)
+    storage = field_file.storage
+
+    if isinstance(storage, ContentAddressedMixin):
+        # 内容の名前が決まっているため、同じ写真が保存済みならリンクも作らない
+        content_name = storage.content_name(sha256 or photo_hashing.file_sha256(staged_path), os.path.splitext(filename)[1])
+        field_file.name = storage.link_file(staged_path, content_name)
+        field_file._committed = True
+        discard(name)
+        return
+
+    try:
+        storage.path(field_file.field.generate_filename(field_file.instance, filename))
+    except NotImplementedError:
+        # ローカルパスを持たないストレージにはチャンク単位で転送する
+        with open(staged_path, 'rb') as f:
+            field_file.save(filename, File(f), save=False)
+        discard(name)
+        return
+
+    for _ in range(5):
+        target = storage.get_available_name(field_file.field.generate_filename(field_file.instance, filename))
+        target_path = storage.path(target)
+        os.makedirs(os.path.dirname(target_path), exist_ok=True)
+        try:
+            _link(staged_path, target_path)
+            break
+        except FileExistsError:
+            # get_available_name の後に同名のファイルが作られた場合は名前を取り直す
+            continue
+    else:
+        raise FileExistsError(target_path)
+
+    if storage.file_permissions_mode is not None:
+        os.chmod(target_path, storage.file_permissions_mode)
+    # ハードリンクはアップロード時の更新日時を引き継ぐため、投稿が保存されるまでに
+    # media_gc が古い孤立ファイルとみなして削除しないよう、更新日時を今にする
+    os.utime(target_path)
+
+    field_file.name = target
+    field_file._committed = True
+    discard(name)
@@ -0,0 +1,38 @@
+from django import template
+from django.utils.html import format_html, format_html_join
+
+
+register = template.Library()
+
+
+@register.simple_tag
+def photo_picture(post, width, alt='', css_class='', style=''):
+    """
+    投稿写真を表示幅 width に合った縮小画像（WebP 優先, JPEG）の <picture> 要素で出力する。
+    縮小画像が未生成の場合や、元画像が width より小さい場合は元画像をそのまま表示する。
+    """
+    if not post.photo:
+        return ''
+
+    widths = post.derivative_widths
+    covering = [w for w in widths if w >= width]
+    if not covering:
+        return format_html(
+            '<img src="{}" alt="{}" class="{}" style="{}" loading="lazy">',
+            post.photo.url, alt, css_class, style,
+        )
+
+    widths = [w for w in widths if w <= covering[0]]
+    sizes = f"(max-width: {width}px) 100vw, {width}px"
+
+    def srcset(fmt):
+        return format_html_join(', ', '{} {}w', ((post.derivative_url(w, fmt), w) for w in widths))
+
+    return format_html(
+        '<picture>'
+        '<source type="image/webp" srcset="{}" sizes="{}">'
+        '<img src="{}" srcset="{}" sizes="{}" alt="{}" class="{}" style="{}" loading="lazy">'
+        '</picture>',
+        srcset('webp'), sizes,
+        post.derivative_url(width, 'jpg'), srcset('jpg'), sizes, alt, css_class, style,
+    )
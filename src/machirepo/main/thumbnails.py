@@ -0,0 +1,148 @@
+import io
+import logging
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from PIL import Image, ImageOps
+
+
+logger = logging.getLogger(__name__)
+
+# 派生画像の形式（拡張子 -> PIL の形式名, 保存オプション）
+FORMATS = {
+    'webp': ('WEBP', {'quality': 80, 'method': 4}),
+    'jpg': ('JPEG', {'quality': 82, 'optimize': True, 'progressive': True}),
+}
+
+
+def widths():
+    return sorted(getattr(settings, 'PHOTO_THUMBNAIL_WIDTHS', [160, 480, 1024]))
+
+
+def derivative_name(name, width, fmt):
+    """元画像と同じディレクトリに置く派生画像の名前（例: photos/2025/01/01/a.w480.webp）。"""
+    root, _ = os.path.splitext(name)
+    return f"{root}.w{width}.{fmt}"
+
+
+def _write(storage, name, data):
+    try:
+        path = storage.path(name)
+    except NotImplementedError:
+        # ローカルパスを持たないストレージは同名で上書き保存する
+        if hasattr(storage, 'put'):
+            # オブジェクトストレージは1回の PUT で置き換わる（内容の名前への付け替えもしない）
+            storage.put(name, data)
+            return
+        if storage.exists(name):
+            storage.delete(name)
+        storage.save(name, ContentFile(data))
+        return
+
+    # 表示中の派生画像が途中まで書かれた状態で配信されないよう、一時ファイルから置き換える
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f"{path}.tmp{os.getpid()}"
+    with open(tmp_path, 'wb') as f:
+        f.write(data)
+    os.replace(tmp_path, path)
+
+
+def generate_derivatives(name, storage=None):
+    """
+    元画像から各幅の WebP / JPEG を生成し、生成した幅のリストを返す。
+    元画像より大きい幅は作らない（テンプレートでは元画像を使う）。
+    """
+    storage = storage or default_storage
+    target_widths = widths()
+
+    with storage.open(name, 'rb') as f:
+        image = Image.open(f)
+        # JPEG は最大幅に近い縮小率でデコードし、元解像度の展開を避ける
+        image.draft('RGB', (target_widths[-1], target_widths[-1]))
+        image.load()
+        image = ImageOps.exif_transpose(image)
+        if image.mode != 'RGB':
+            image = image.convert('RGB')
+
+    generated = []
+    source = image
+    for width in sorted(target_widths, reverse=True):
+        if width >= image.width:
+            continue
+        height = max(1, round(image.height * width / image.width))
+        # 大きい幅から順に作り、次の幅はひとつ前の結果から縮小する
+        source = source.resize((width, height), Image.Resampling.LANCZOS, reducing_gap=2.0)
+        for fmt, (pil_format, options) in FORMATS.items():
+            buf = io.BytesIO()
+            source.save(buf, pil_format, **options)
+            _write(storage, derivative_name(name, width, fmt), buf.getvalue())
+        generated.append(width)
+
+    return sorted(generated)
+
+
+def update_post_derivatives(post_pk):
+    """投稿の派生画像を生成し、生成結果を投稿に記録する。"""
+    from .models import PhotoPost
+
+    post = PhotoPost.objects.filter(pk=post_pk).only('pk', 'photo', 'photo_derivatives').first()
+    if post is None or not post.photo or post.has_derivatives:
+        return
+
+    name = post.photo.name
+    # 同じ写真ファイルを参照する投稿で生成済みなら、その結果を使う
+    derivatives = (
+        PhotoPost.objects.filter(photo=name, photo_derivatives__source=name)
+        .exclude(pk=post_pk).values_list('photo_derivatives', flat=True).first()
+    )
+    if derivatives is None:
+        derivatives = {'source': name, 'widths': generate_derivatives(name, post.photo.storage)}
+
+    # 生成中に写真が差し替えられていた場合は記録しない
+    PhotoPost.objects.filter(pk=post_pk, photo=name).update(photo_derivatives=derivatives)
+
+
+# -----------------------------------------------------
+# バックグラウンド生成
+#   リクエスト処理を待たせないよう、プロセス内の専用スレッドで順に生成する
+# -----------------------------------------------------
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def _get_executor():
+    global _executor
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                _executor = ThreadPoolExecutor(
+                    max_workers=getattr(settings, 'PHOTO_THUMBNAIL_WORKERS', 1),
+                    thread_name_prefix='thumbnails',
+                )
+    return _executor
+
+
+def _run(post_pk):
+    try:
+        update_post_derivatives(post_pk)
+    except Exception:
+        logger.warning("報告ID %s の派生画像を生成できませんでした。", post_pk, exc_info=True)
+    finally:
+        from django.db import connection
+        connection.close()
+
+
+def schedule(post_pk):
+    """派生画像の生成を予約する。PHOTO_THUMBNAIL_ASYNC が False の場合はその場で生成する。"""
+    if not getattr(settings, 'PHOTO_THUMBNAIL_ASYNC', True):
+        try:
+            update_post_derivatives(post_pk)
+        except Exception:
+            logger.warning("報告ID %s の派生画像を生成できませんでした。", post_pk, exc_info=True)
+        return
+    _get_executor().submit(_run, post_pk)
@@ -19,6 +19,7 @@ urlpatterns = [
     path('mypage/', views.my_page, name='my_page'),
     path('mypage/history/', views.post_history, name='post_history'),
     path('posts/', views.post_list, name='post_list'),
+    path('posts/fragment/', views.post_list_fragment, name='post_list_fragment'),
     path('posts/<int:post_id>/', views.post_detail, name='post_detail'),
     # path('maps/', views.user_map, name='user_map'),
     
@@ -43,6 +44,12 @@ urlpatterns = [
     path('post/create/', views.photo_post_create, name='photo_post_create'),
     path('post/location/', views.photo_post_manual_location, name='photo_post_location'),
     path('post/confirm/', views.photo_post_confirm, name='photo_post_confirm'),
+    path('post/photo/', views.photo_post_staged_photo, name='photo_post_staged_photo'),
+    path('post/draft/discard/', views.photo_post_draft_discard, name='photo_post_draft_discard'),
+    path('post/upload/', views.photo_upload_initiate, name='photo_upload_initiate'),
+    path('post/upload/direct/finalize/', views.photo_upload_direct_finalize, name='photo_upload_direct_finalize'),
+    path('post/upload/<uuid:upload_id>/', views.photo_upload_chunk, name='photo_upload_chunk'),
+    path('post/upload/<uuid:upload_id>/finalize/', views.photo_upload_finalize, name='photo_upload_finalize'),
     path('post/done/', views.photo_post_done, name='photo_post_done'),
 
     # --------------------------------------------------
@@ -53,11 +60,13 @@ urlpatterns = [
     path('manage/users/<int:user_id>/delete/', views.admin_user_delete_confirm, name='admin_user_delete_confirm'),
     path('manage/users/delete/complete/', views.admin_user_delete_complete, name='admin_user_delete_complete'),
     path('manage/posts/', views.admin_post_list, name='admin_post_list'),
+    path('manage/posts/fragment/', views.admin_post_list_fragment, name='admin_post_list_fragment'),
     path('manage/posts/<int:post_id>/detail/', views.admin_post_detail, name='admin_post_detail'), 
     path('manage/posts/<int:post_id>/status/edit/', views.manage_post_status_edit, name='admin_post_status_edit'),
     path('manage/posts/<int:post_id>/status/complete/', views.manage_status_edit_done, name='admin_status_edit_done'), 
     path('manage/posts/<int:post_id>/delete/', views.admin_post_delete, name='admin_post_delete'),
     path('manage/posts/delete/complete/', views.admin_post_delete_complete, name='admin_post_delete_complete'),
+    path('manage/metrics/classifier/', views.admin_classifier_metrics, name='admin_classifier_metrics'),
 
     # --------------------------------------------------
     # 3. 管理者向けタグ管理画面 (新規追加)
@@ -1,4 +1,5 @@
 import logging
+import mimetypes
 import os 
 import decimal
 from email.utils import formataddr
@@ -11,25 +12,28 @@ from django.urls import reverse, reverse_lazy
 from django.utils.decorators import method_decorator
 from django.utils import timezone
 from django.core.exceptions import ValidationError 
-from django.core.files.base import ContentFile
+from django.db import transaction
 from .forms import ManualLocationForm
-from django.core.files.storage import FileSystemStorage 
 from . import models 
 from .models import PhotoPost, Tag
 from .forms import TagForm, StatusUpdateForm, ResidentCreationForm, PhotoPostForm, ManualLocationForm, UserUpdateForm
 from django.views.generic.edit import UpdateView 
 from django.core.mail import send_mail
-import torch 
-import torch.nn as nn 
-from torchvision import transforms, models as torch_models 
 from django.shortcuts import render 
-from PIL import Image 
-import io 
 from .models import PhotoPost 
+from . import (
+    chunked_uploads, classifier, direct_uploads, drafts, inference_server, ingest, media_delivery, pagination, photo_hashing,
+    search, similarity, staging,
+)
+from .media_storage import photo_storage
+from django.core.files.storage import default_storage
+from .governor import InferenceSaturated, get_governor
+from django.conf import settings
+from django.http import FileResponse, Http404, JsonResponse
+from django.views.decorators.http import require_http_methods, require_POST
 
 
 logger = logging.getLogger(__name__)
-fs = FileSystemStorage()
 
 # 権限チェック
 def is_staff_user(user):
@@ -37,28 +41,6 @@ def is_staff_user(user):
 
 
 
-
-
-def load_model():
-    model = torch_models.mobilenet_v2(weights=None)
-    model.classifier[1] = nn.Linear(model.last_channel, 4) 
-    model.load_state_dict(torch.load('main/machirepo_ai_v1.pth', map_location='cpu'))
-    model.eval()
-    return model
-predict_model = load_model()
-
-def preprocess_image(image_bytes):
-    transform = transforms.Compose([
-        transforms.Resize((224, 224)),
-        transforms.ToTensor(),
-        transforms.Normalize(
-            mean=[0.485, 0.456, 0.406], 
-            std=[0.229, 0.224, 0.225]
-        ),
-    ])
-    image = Image.open(io.BytesIO(image_bytes)).convert('RGB')
-    return transform(image).unsqueeze(0)
-
 # 1. 共通/認証関連ビュー
 
 def index(request):
@@ -159,44 +141,21 @@ def user_about(request):
 
 @login_required
 def user_stamp(request):
-    post_count = 0
-    card = 0
-    
-    posts = PhotoPost.objects.filter(user=request.user).order_by('-posted_at') 
-    for i in posts:
-        post_count += 11
-    card = post_count / 10
-    if post_count > 10:
-        post_count -= (int(card)*10)
-
+    # スタンプカードは記録済みの投稿数から求める（投稿は読み込まない）
+    user = request.user
     context = {
-                'stamp': range(post_count),
-                'notstamp':range(10-post_count),
-                'card':int(card),
+                'stamp': range(user.stamps),
+                'notstamp': range(user.STAMPS_PER_CARD - user.stamps),
+                'card': user.stamp_cards,
                 }
 
-    print(post_count)
     return render(request, 'main/user/user_stamp.html', context)
 
 @login_required
 def my_page(request):
-    posts = models.PhotoPost.objects.filter(user=request.user).order_by('-posted_at')
-    
-    post_count = 0
-    card = 0
-    
-    for i in posts:
-        post_count += 1
-    
-    card = int(post_count / 10)
-    
-    if post_count > 10:
-        post_count -= (card*10)
-    
     context = {
                 'user': request.user,
-                'posts': posts,
-                'card':int(card),
+                'card': request.user.stamp_cards,
                 }
     
     return render(request, 'main/user/user_mypage.html', context)
@@ -216,11 +175,11 @@ def post_history(request):
     return render(request, 'main/user/user_post_history.html', context)
 
 
-def post_list(request):
+def _post_list_queryset(request):
     status_filter = request.GET.get('status')
     tag_filter = request.GET.get('tag')
 
-    posts = models.PhotoPost.objects.select_related('user', 'tag').order_by('-posted_at')
+    posts = models.PhotoPost.objects.select_related('user', 'tag')
 
     valid_statuses = [key for key, _ in models.PhotoPost.STATUS_CHOICES]
     if status_filter in valid_statuses:
@@ -233,18 +192,50 @@ def post_list(request):
         except ValueError:
             logger.warning(f"無効なタグID: {tag_filter}")
 
-    context = {
-        'posts': posts,
-        'status_filter': status_filter,
-        'tag_filter': tag_filter,
+    return posts, {'status_filter': status_filter, 'tag_filter': tag_filter}
+
+
+def _post_page_context(request, posts, fragment_url, ranked=False):
+    """
+    キーセットページングした1ページ分の context（前後のページ・続きの読み込み先の URL を含む）。
+    ranked の場合は全文検索のスコア順（search.search() の結果）にページングする。
+    """
+    paginate = search.paginate if ranked else pagination.paginate
+    page = paginate(
+        posts, after=request.GET.get('after'), before=request.GET.get('before'),
+        size=pagination.page_size(request.GET.get('size')),
+    )
+    return {
+        'posts': page.items,
+        'ranked': ranked,
+        'next_query': pagination.page_query(request, after=page.next_cursor) if page.next_cursor else '',
+        'prev_query': pagination.page_query(request, before=page.prev_cursor) if page.prev_cursor else '',
+        'fragment_url': reverse(fragment_url),
+    }
+
+
+def post_list(request):
+    posts, context = _post_list_queryset(request)
+    context.update(_post_page_context(request, posts, 'post_list_fragment'))
+    context.update({
         'all_tags': models.Tag.objects.order_by('name'),
         'status_choices': models.PhotoPost.STATUS_CHOICES,
         'priority_choices': models.PhotoPost.PRIORITY_CHOICES,
-    }
+    })
 
     return render(request, 'main/user/user_post_list.html', context)
 
 
+def post_list_fragment(request):
+    """無限スクロール用に、post_list の続きのページの報告だけを HTML で返す。"""
+    posts, context = _post_list_queryset(request)
+    context.update(_post_page_context(request, posts, 'post_list_fragment'))
+    response = render(request, 'main/user/user_post_list_items.html', context)
+    # 続きのページのクエリ文字列（最後のページでは空）
+    response['X-Next-Query'] = context['next_query']
+    return response
+
+
 @method_decorator(login_required, name='dispatch')
 class UserProfileUpdateView(UpdateView):
     model = get_user_model()
@@ -260,34 +251,8 @@ class UserProfileUpdateView(UpdateView):
 
     def get_form_kwargs(self):
         kwargs = super().get_form_kwargs()
-        user = self.request.user
-       
-
-        post_count = 0
-        card = 0
-        posts = PhotoPost.objects.filter(user=user).order_by('-posted_at')
-        for i in posts:
-            post_count += 1
-        card = post_count / 10
-        
-        badge_choices = []
-        if post_count > 10:
-            post_count -= (int(card)*10)
-            badge_choices = []
-        if card >= 1:
-            badge_choices.append(('bronze', '銅バッジ'))
-        if card >= 5:
-            badge_choices.append(('silver', '銀バッジ'))
-        if card >= 10:
-            badge_choices.append(('gold', '金バッジ'))
-        if card >= 50:
-            badge_choices.append(('rainbow', '虹バッジ'))
-
-        if not badge_choices:
-            badge_choices = [('none', '表示しない')]
-
-
-        kwargs['badge_choices'] = badge_choices
+        # 選べるバッジは記録済みの投稿数から求める（投稿は読み込まない）
+        kwargs['badge_choices'] = self.request.user.available_badges()
         return kwargs
  
   
@@ -327,34 +292,8 @@ class UserProfileUpdateView(UpdateView):
 
     def get_form_kwargs(self):
         kwargs = super().get_form_kwargs()
-        user = self.request.user
-
-
-        post_count = 0
-        card = 0
-        posts = PhotoPost.objects.filter(user=user).order_by('-posted_at')
-        for i in posts:
-            post_count += 1
-        card = post_count / 10
-
-
-        badge_choices = []
-        if post_count > 10:
-            post_count -= (int(card)*10)
-            badge_choices = []
-        if card >= 1:
-            badge_choices.append(('bronze', '銅バッジ'))
-        if card >= 5:
-            badge_choices.append(('silver', '銀バッジ'))
-        if card >= 10:
-            badge_choices.append(('gold', '金バッジ'))
-        if card >= 50:
-            badge_choices.append(('rainbow', '虹バッジ'))
-
-        if not badge_choices:
-            badge_choices = [('none', '表示しない')]
-
-        kwargs['badge_choices'] = badge_choices
+        # 選べるバッジは記録済みの投稿数から求める（投稿は読み込まない）
+        kwargs['badge_choices'] = self.request.user.available_badges()
         return kwargs
 
     def form_valid(self, form):
@@ -378,108 +317,114 @@ def user_edit_complete(request):
     return render(request, 'main/user/user_edit_complete.html', {})
 
 # 3. 投稿
-@login_required
-def photo_post_create(request):
-    post_data = request.session.get('post_data', {})
-    
-    if request.method == 'GET':
-        keys_to_remove = ['latitude', 'longitude', 'title', 'tag_pk', 'comment', 'photo_path'] 
-        
-        if any(k in post_data for k in keys_to_remove):
-            if 'photo_path' in post_data and post_data['photo_path']:
-                try:
-                    fs.delete(post_data['photo_path'])
-                    logger.info(f"--- TEMP FILE CLEANUP: {post_data['photo_path']} deleted on Step 1 GET. ---")
-                except Exception:
-                    logger.warning("Failed to delete old session photo file.")
-            
-            post_data = {k: v for k, v in post_data.items() if k not in keys_to_remove}
-            request.session['post_data'] = post_data
-            logger.info("--- SESSION CLEANUP: Old form data cleared from post_data. ---")
+def _is_valid_coord(val):
+    try:
+        f_val = float(val)
+        return abs(f_val) > 0.000001
+    except (ValueError, TypeError):
+        return False
+
+
+def _coord_or_none(val):
+    """ブラウザから送られた緯度・経度（未取得・不正な値は None）。"""
+    return decimal.Decimal(str(float(val))) if _is_valid_coord(val) else None
 
-        if 'post_photo_data' in request.session:
-            del request.session['post_photo_data']
-            logger.info("--- SESSION CLEANUP: 'post_photo_data' cleared. ---")
 
+def _draft_conflict(request, step):
+    messages.warning(request, "別の画面で投稿の下書きが更新されました。内容を確認して、もう一度送信してください。")
+    return redirect(step)
+
+
+@login_required
+def photo_post_create(request):
+    # 投稿途中の内容は下書き（PhotoPostDraft）に保存し、別の端末からも写真を送り直さずに再開できる
+    draft = drafts.get(request.user)
 
     if request.method == 'POST':
-        print("--- DEBUG: POST Request received on Step 1 (photo_post_create) ---")
-        
-        form = PhotoPostForm(request.POST, request.FILES, initial=post_data)
+        form = PhotoPostForm(request.POST, request.FILES)
+        # 下書きに写真があれば（分割・直接アップロードで受け取り済みの場合を含む）、フォームでの写真の送信は不要
+        if draft is not None and staging.exists(draft.photo_name):
+            form.fields['photo'].required = False
         
         if form.is_valid():
-            cleaned_tag = form.cleaned_data['tag'] 
-            tag_pk_to_save = cleaned_tag.pk if cleaned_tag else None    
-            current_photo_path = post_data.get('photo_path')
-        
-            new_post_data = {
+            fields = {
                 'title': form.cleaned_data['title'],
                 'comment': form.cleaned_data['comment'],
-                'tag_pk': tag_pk_to_save,
-                'latitude': request.POST.get('latitude', '0.0'),   
-                'longitude': request.POST.get('longitude', '0.0'),
-			}
-            
-            if current_photo_path and 'photo' not in request.FILES:
-                new_post_data['photo_path'] = current_photo_path
+                'tag': form.cleaned_data['tag'],
+                'latitude': _coord_or_none(request.POST.get('latitude')),
+                'longitude': _coord_or_none(request.POST.get('longitude')),
+                'location_source': '',
+            }
             
+            # 写真は正規化してステージング領域に書き込む（EXIF の位置情報・撮影日時はその前に読み取る）
             photo_file = request.FILES.get('photo')
-            if photo_file:
-                
-                if 'photo_path' in post_data and post_data['photo_path']:
-                    try:
-                        fs.delete(post_data['photo_path'])
-                        logger.info(f"--- OLD TEMP FILE DELETED: {post_data['photo_path']} ---")
-                    except Exception:
-                        logger.warning("Failed to delete old session photo file.")
-                
-                filename = fs.save(photo_file.name, photo_file)
-                new_post_data['photo_path'] = filename
-                
-            request.session['post_data'] = new_post_data
-
-            logger.info("--- SESSION SAVE: Form data and photo path saved to session. ---")
-            
+            try:
+                staged = staging.stage_upload(photo_file, request.user) if photo_file else None
+            except ingest.RejectedImage as e:
+                messages.error(request, str(e))
+                return render(request, 'main/user/user_photo_post_create.html', {'form': form, 'draft': draft, 'step': 1})
+
+            # 同じ写真が再アップロードされた場合は、下書きの写真と分類結果をそのまま使う
+            if staged and draft is not None and draft.photo_name and staged.sha256 == draft.photo_sha256:
+                staging.discard(staged.name)
+                staged = None
+
+            if staged:
+                fields.update(drafts.photo_fields(staged))
+                photo_location = (fields['photo_latitude'], fields['photo_longitude'])
+            else:
+                photo_location = (draft.photo_latitude, draft.photo_longitude) if draft else (None, None)
+
+            # ブラウザから位置情報が送られなかった場合は、写真の撮影地点を使う
+            if fields['latitude'] is None or fields['longitude'] is None:
+                if None not in photo_location:
+                    fields['latitude'], fields['longitude'] = (decimal.Decimal(str(v)) for v in photo_location)
+                    fields['location_source'] = 'photo'
+
+            previous_photo = draft.photo_name if draft else ''
+            try:
+                draft = drafts.save(request.user, fields, drafts.parse_version(request.POST.get('draft_version')))
+            except drafts.DraftConflict:
+                if staged:
+                    staging.discard(staged.name)
+                return _draft_conflict(request, 'photo_post_create')
+            if staged and previous_photo:
+                staging.discard(previous_photo)
+                logger.info(f"--- OLD TEMP FILE DELETED: {previous_photo} ---")
+
+            # 位置が決まっていれば地図の画面を経由せずに確認画面へ進む
+            if draft.latitude is not None and draft.longitude is not None:
+                return redirect('photo_post_confirm')
             return redirect('photo_post_location')
         
         else:
             logger.error("PhotoPostForm validation failed: %s", form.errors)
-            messages.error(request, "投稿内容にエラーがあります。不足している必須項目（写真、カテゴリ、タイトル）を確認するか、写真のファイルサイズ（最大5MB）を確認してください。")
+            messages.error(request, f"投稿内容にエラーがあります。不足している必須項目（写真、カテゴリ、タイトル）を確認するか、写真のファイルサイズ（最大{settings.PHOTO_UPLOAD_MAX_BYTES // (1024 * 1024)}MB）を確認してください。")
     
     else:
-        initial_data = post_data.copy()
-        
-        tag_pk = initial_data.get('tag_pk')
-        if tag_pk:
-            try:
-                initial_data['tag'] = models.Tag.objects.get(pk=tag_pk) 
-            except (models.Tag.DoesNotExist, ValueError):
-                initial_data['tag'] = None
-                
+        initial_data = {'title': draft.title, 'comment': draft.comment, 'tag': draft.tag} if draft else None
         form = PhotoPostForm(initial=initial_data)
     
-    return render(request, 'main/user/user_photo_post_create.html', {'form': form, 'step': 1})
+    return render(request, 'main/user/user_photo_post_create.html', {'form': form, 'draft': draft, 'step': 1})
+
+
+@login_required
+@require_POST
+def photo_post_draft_discard(request):
+    """下書きを破棄して、最初から投稿し直す。"""
+    drafts.discard(request.user)
+    return redirect('photo_post_create')
 
 
 @login_required
 def photo_post_manual_location(request):
-    post_data = request.session.get('post_data')
+    draft = drafts.get(request.user)
     
-    if not post_data:
+    if draft is None:
         messages.error(request, "報告のデータが見つかりませんでした。最初からやり直してください。")
         return redirect('photo_post_create')
         
-    def is_valid_coord(val):
-        try:
-            f_val = float(val)
-            return abs(f_val) > 0.000001
-        except (ValueError, TypeError):
-            return False
-
-    session_lat = post_data.get('latitude')
-    session_lng = post_data.get('longitude')
-    
-    if is_valid_coord(session_lat) and is_valid_coord(session_lng):
+    if draft.latitude is not None and draft.longitude is not None:
         return redirect('photo_post_confirm')
     
 
@@ -491,21 +436,24 @@ def photo_post_manual_location(request):
             lat = float(posted_lat)
             lng = float(posted_lng)
 
-            post_data['latitude'] = lat
-            post_data['longitude'] = lng
-            
-            request.session['post_data'] = post_data
+            drafts.save(
+                request.user,
+                {'latitude': decimal.Decimal(str(lat)), 'longitude': decimal.Decimal(str(lng))},
+                drafts.parse_version(request.POST.get('draft_version')),
+            )
             
             return redirect('photo_post_confirm')
         
         except (TypeError, ValueError):
             messages.error(request, "位置情報の値が不正です。再度地図で場所を選択してください。") 
+        except drafts.DraftConflict:
+            return _draft_conflict(request, 'photo_post_location')
           
-    form = ManualLocationForm(initial=post_data) 
+    form = ManualLocationForm() 
     
     context = {
         'manual_form': form, 
-        'post_data': post_data,
+        'draft': draft,
         'step': 2
     }
     return render(request, 'main/user/user_photo_post_manual_location.html', context)
@@ -513,9 +461,9 @@ def photo_post_manual_location(request):
 
 @login_required
 def photo_post_confirm(request):
-    post_data = request.session.get('post_data')
+    draft = drafts.get(request.user)
     
-    if not post_data or 'photo_path' not in post_data:
+    if draft is None or not draft.photo_name:
         messages.error(request, "データが不足しています。写真と必須項目を確認し、最初からやり直してください。")
         return redirect('photo_post_create')
         
@@ -539,54 +487,86 @@ def photo_post_confirm(request):
     longitude_val = None
 
     if request.method == 'POST':
-        photo_path = post_data.get('photo_path')
+        # 確認画面を開いた後に別の画面で内容が変わっていれば、確認し直してもらう
+        version = drafts.parse_version(request.POST.get('draft_version'))
+        if version is not None and version != draft.version:
+            return _draft_conflict(request, 'photo_post_confirm')
+
+        photo_path = draft.photo_name
+        ai_result = None
         
         try:
-            latitude_val = safe_float(post_data.get('latitude'))
-            longitude_val = safe_float(post_data.get('longitude'))
+            latitude_val = safe_float(draft.latitude)
+            longitude_val = safe_float(draft.longitude)
             new_post = models.PhotoPost(
                 user=request.user,
-                title=post_data.get('title'), 
-                comment=post_data.get('comment'),
+                title=draft.title, 
+                comment=draft.comment,
                 latitude=latitude_val, 
                 longitude=longitude_val,
+                tag=draft.tag,
             )
-
-            tag_pk = post_data.get('tag_pk') 
-            if tag_pk:
-                try:
-                    tag_instance = models.Tag.objects.get(pk=tag_pk)
-                    new_post.tag = tag_instance
-                except models.Tag.DoesNotExist:
-                    logger.warning(f"投稿保存時にタグID {tag_pk} が見つかりませんでした。タグなしで保存されます。")
-                    new_post.tag = None
-            else:
-                new_post.tag = None
-            
-            if photo_path and fs.exists(fs.path(photo_path)):
-                with fs.open(photo_path, 'rb') as f:
-                    file_name = os.path.basename(photo_path)
-                    new_post.photo.save(file_name, ContentFile(f.read()), save=False)
-                logger.info(f"--- PHOTO LOAD SUCCESS: Temporary photo loaded from disk at {photo_path} ---")
-            else:
-                logger.error(f"FATAL: Temporary photo file not found at path: {photo_path}")
-                raise ValidationError({'photo': '一時的な写真ファイルが見つからないか、有効期限切れです。'})
-            
-            if tag_pk:
-                print(f"--- DEBUG SAVE: Tag PK={tag_pk} found. Tag instance ID to save: {new_post.tag.pk}")
-            else:
-                print("--- DEBUG SAVE: Tag is None. ---")
-           
-            new_post.full_clean()
-            new_post.save()
-
-            del request.session['post_data']
-            if photo_path and fs.exists(fs.path(photo_path)):
-                fs.delete(photo_path)
-                logger.info(f"--- TEMP FILE DELETED: {photo_path} ---")
             
+            photo_sha256 = draft.photo_sha256
+            photo_exists = bool(photo_path) and staging.exists(photo_path)
+            if photo_exists:
+                for k, v in photo_hashing.hash_fields(photo_sha256, draft.photo_phash).items():
+                    setattr(new_post, k, v)
+                new_post.photo_taken_at = draft.photo_taken_at
+
+                # AI分類は一度だけ実行し、結果を投稿に保存する（確認画面で分類済みならその結果を使う）
+                ai_result = draft.ai_result
+                if ai_result:
+                    ai_result = classifier.result_from_json(ai_result)
+                else:
+                    try:
+                        ai_result = classifier.classify_image(path=staging.path(photo_path))
+                    except InferenceSaturated:
+                        logger.info("推論が混雑しているため、投稿確定時のAI分類を見送りました。")
+                    except Exception:
+                        logger.warning("投稿確定時のAI分類に失敗しました。詳細画面で再試行されます。", exc_info=True)
+                if ai_result:
+                    classifier.apply_classification(new_post, ai_result)
+
+            with transaction.atomic():
+                # 下書きを確定済みにしてから保存する（同時に送信された確定は、ここで1つだけが先に進み、
+                # 残りは先の確定がコミットされるのを待ってから DraftConflict になる）。保存できなければ下書きも元に戻る
+                drafts.claim(draft)
+
+                if not photo_exists:
+                    logger.error(f"FATAL: Temporary photo file not found at path: {photo_path}")
+                    raise ValidationError({'photo': '一時的な写真ファイルが見つからないか、有効期限切れです。'})
+
+                # 報告者はログイン中のユーザー、カテゴリは下書きと一緒に読み込んだもの（削除されれば下書きでも NULL になる）
+                # のため、存在の確認（SELECT）は省く
+                new_post.full_clean(exclude=['photo', 'user', 'tag'])
+
+                # 同一内容の写真が保存済みなら同じファイルを参照し、なければステージングから移す（データはコピーしない）
+                same_photo = models.PhotoPost.objects.filter(photo_sha256=photo_sha256).only('photo').first() if photo_sha256 else None
+                if same_photo and same_photo.photo and same_photo.photo.storage.exists(same_photo.photo.name):
+                    new_post.photo.name = same_photo.photo.name
+                    transaction.on_commit(lambda: staging.discard(photo_path))
+                else:
+                    staging.promote(photo_path, new_post.photo, photo_sha256)
+                logger.info(f"--- PHOTO PROMOTED: {photo_path} -> {new_post.photo.name} ---")
+
+                new_post.save()
+                if ai_result:
+                    try:
+                        with transaction.atomic():
+                            similarity.store_embedding(new_post, ai_result.get('embedding'), ai_result['model_version'])
+                    except Exception:
+                        # 投稿自体は保存するため、埋め込みは manage.py reclassify で補う
+                        logger.warning(f"報告ID {new_post.pk} の埋め込みを保存できませんでした。", exc_info=True)
+
             return redirect('photo_post_done')
-            
+
+        except drafts.DraftConflict:
+            if drafts.get(request.user) is None:
+                # 同じ下書きの確定が先に完了した（二重送信）
+                return redirect('photo_post_done')
+            return _draft_conflict(request, 'photo_post_confirm')
+
         except ValidationError as e:
             error_messages = "\n".join([f"「{k}」: {v[0]}" for k, v in e.message_dict.items()])
             logger.error("投稿のfull_clean()が失敗しました: %s", error_messages)
@@ -599,22 +579,191 @@ def photo_post_confirm(request):
             messages.error(request, f"**投稿通信エラー**：報告の保存中に予期せぬエラーが発生しました。再度投稿してください。エラー: {e}")
             return redirect('photo_post_create')
             
-    tag_pk = post_data.get('tag_pk')
-    selected_tag = None
-    if tag_pk:
+    # 同じ写真・ほぼ同じ写真の投稿を保存前に確認する
+    duplicates = {'exact': [], 'near': []}
+    if draft.photo_sha256:
+        duplicates = photo_hashing.find_duplicates(draft.photo_sha256, draft.photo_phash)
+
+    # 確認画面の表示時に分類し、似た報告が近くにあれば重複の可能性を知らせる
+    # （結果は下書きに保持し、投稿確定時に再利用する。同一写真の分類結果があれば推論しない）
+    similar_posts = []
+    ai_result = draft.ai_result
+    if not ai_result:
+        for same_photo in duplicates['exact']:
+            stored_result = classifier.result_from_post(same_photo)
+            if stored_result:
+                ai_result = classifier.result_to_json(stored_result)
+                drafts.store_ai_result(draft, ai_result)
+                break
+
+    if not ai_result:
         try:
-            selected_tag = models.Tag.objects.get(pk=tag_pk)
-        except models.Tag.DoesNotExist:
-            logger.error(f"確認画面でタグID {tag_pk} が見つかりません。")
+            ai_result = classifier.result_to_json(
+                classifier.classify_image(path=staging.path(draft.photo_name), timeout=settings.CLASSIFIER_PAGE_TIMEOUT)
+            )
+            drafts.store_ai_result(draft, ai_result)
+        except InferenceSaturated:
             pass
-            
+        except Exception:
+            logger.warning("確認画面でのAI分類に失敗しました。", exc_info=True)
+
+    if ai_result and ai_result.get('embedding'):
+        try:
+            similar_posts = similarity.find_similar(
+                classifier.result_from_json(ai_result)['embedding'],
+                tag_id=draft.tag_id,
+                latitude=draft.latitude,
+                longitude=draft.longitude,
+            )
+        except Exception:
+            logger.warning("類似報告の検索に失敗しました。", exc_info=True)
+
+    duplicate_ids = {p.pk for p in duplicates['exact']} | {p.pk for p, _ in duplicates['near']}
+    similar_posts = [(p, score) for p, score in similar_posts if p.pk not in duplicate_ids]
+
     context = {
-        'post_data': post_data,
-        'selected_tag': selected_tag, 
+        'draft': draft,
+        'selected_tag': draft.tag, 
+        'similar_posts': similar_posts,
+        'exact_duplicates': duplicates['exact'],
+        'near_duplicates': duplicates['near'],
+        'photo_taken_at': draft.photo_taken_at,
         'step': 3
     }
     return render(request, 'main/user/user_photo_post_confirm.html', context)
 
+@login_required
+def photo_post_staged_photo(request):
+    """投稿途中（ステージング中）の写真を、投稿中の本人にのみ返す（確認画面のプレビュー用）。"""
+    draft = drafts.get(request.user)
+    photo_path = draft.photo_name if draft else None
+    if not staging.exists(photo_path):
+        raise Http404
+    content_type = mimetypes.guess_type(photo_path)[0] or 'application/octet-stream'
+    return FileResponse(open(staging.path(photo_path), 'rb'), content_type=content_type)
+
+@require_http_methods(['GET', 'HEAD'])
+def media_file(request, name):
+    """投稿写真とその縮小画像、サイトの画像を返す。投稿から参照されていないファイルは 404。"""
+    if media_delivery.is_public_asset(name):
+        storage = default_storage
+    elif media_delivery.referenced_photo(name) is not None:
+        storage = photo_storage()
+    else:
+        raise Http404
+    response = media_delivery.serve(request, storage, name)
+    if response is None:
+        raise Http404
+    return response
+
+# 分割・再開可能な写真アップロード（通信が不安定な端末向け）
+#   POST post/upload/ で開始し、PUT post/upload/<id>/?offset=N でチャンクを送る。
+#   途切れた場合は GET post/upload/<id>/ で受信済みの offset を確認して続きから送り、
+#   POST post/upload/<id>/finalize/ で投稿フローの写真として確定する。
+#   写真の保存先がオブジェクトストレージの場合は、開始時に署名付き URL を返してストレージへ直接送らせ、
+#   POST post/upload/direct/finalize/ にトークン（とマルチパートの ETag）だけを受け取る。
+
+def _upload_json(upload):
+    return {
+        'mode': 'chunked',
+        'upload_id': str(upload.pk),
+        'offset': upload.offset,
+        'size': upload.size,
+        'chunk_size': chunked_uploads.chunk_size(),
+        'expires_at': upload.expires_at.isoformat(),
+        'upload_url': reverse('photo_upload_chunk', args=[upload.pk]),
+        'finalize_url': reverse('photo_upload_finalize', args=[upload.pk]),
+    }
+
+
+def _get_chunked_upload(request, upload_id):
+    upload = get_object_or_404(
+        models.ChunkedUpload, pk=upload_id, user=request.user, expires_at__gt=timezone.now(),
+    )
+    # 利用者で絞り込んでいるため、ステージング時に upload.user を読み直さない
+    upload.user = request.user
+    return upload
+
+
+@login_required
+@require_POST
+def photo_upload_initiate(request):
+    try:
+        size = int(request.POST.get('size', ''))
+    except ValueError:
+        return JsonResponse({'error': "写真のファイルサイズが不正です。"}, status=400)
+
+    if direct_uploads.is_available():
+        try:
+            upload = direct_uploads.initiate(request.user, request.POST.get('filename', ''), size)
+        except chunked_uploads.UploadError as e:
+            return JsonResponse({'error': str(e)}, status=400)
+        upload.update(mode='direct', finalize_url=reverse('photo_upload_direct_finalize'))
+        return JsonResponse(upload, status=201)
+
+    try:
+        upload = chunked_uploads.initiate(
+            request.user, request.POST.get('filename', ''), size, request.POST.get('sha256', ''),
+        )
+    except chunked_uploads.UploadError as e:
+        return JsonResponse({'error': str(e)}, status=400)
+    return JsonResponse(_upload_json(upload), status=201)
+
+
+@login_required
+@require_http_methods(['GET', 'PUT'])
+def photo_upload_chunk(request, upload_id):
+    upload = _get_chunked_upload(request, upload_id)
+    if request.method == 'GET':
+        return JsonResponse(_upload_json(upload))
+
+    try:
+        offset = int(request.GET.get('offset', ''))
+        length = int(request.META.get('CONTENT_LENGTH') or 0)
+    except ValueError:
+        return JsonResponse({'error': "offset が不正です。"}, status=400)
+    try:
+        chunked_uploads.append(upload, offset, request, length)
+    except chunked_uploads.OffsetMismatch as e:
+        return JsonResponse({'error': str(e), 'offset': e.offset}, status=409)
+    except chunked_uploads.UploadError as e:
+        return JsonResponse({'error': str(e)}, status=400)
+    return JsonResponse(_upload_json(upload))
+
+
+@login_required
+@require_POST
+def photo_upload_finalize(request, upload_id):
+    upload = _get_chunked_upload(request, upload_id)
+    try:
+        staged = chunked_uploads.finalize(upload)
+    except chunked_uploads.OffsetMismatch as e:
+        return JsonResponse({'error': str(e), 'offset': e.offset}, status=409)
+    except chunked_uploads.UploadError as e:
+        return JsonResponse({'error': str(e)}, status=400)
+    return _staged_upload_response(request, staged)
+
+
+@login_required
+@require_POST
+def photo_upload_direct_finalize(request):
+    try:
+        staged = direct_uploads.finalize(request.user, request.POST.get('token', ''), request.POST.get('parts'))
+    except chunked_uploads.UploadError as e:
+        return JsonResponse({'error': str(e)}, status=400)
+    return _staged_upload_response(request, staged)
+
+
+def _staged_upload_response(request, staged):
+    """アップロードを終えた写真を下書きの写真にする（投稿画面は新しい draft_version で送信する）。"""
+    draft = drafts.replace_photo(request.user, staged)
+    return JsonResponse({
+        'photo_url': reverse('photo_post_staged_photo'),
+        'has_location': staged.metadata['latitude'] is not None,
+        'draft_version': draft.version,
+    })
+
+
 @login_required
 def photo_post_done(request):
     return render(request, 'main/user/user_photo_post_complete.html', {})
@@ -622,7 +771,7 @@ def photo_post_done(request):
 
 def post_detail(request, post_id):
     post = get_object_or_404(
-        models.PhotoPost.objects, 
+        models.PhotoPost.objects.select_related('user', 'tag'), 
         pk=post_id
     )
     
@@ -724,13 +873,13 @@ def admin_user_delete_complete(request):
     }
     return render(request, 'main/admin/admin_user_delete_complete.html', context)
 
-@user_passes_test(is_staff_user, login_url='/')
-def admin_post_list(request):
+def _admin_post_list_queryset(request):
     status_filter = request.GET.get('status', None)
     tag_filter = request.GET.get('tag', None)
     priority_filter = request.GET.get('priority', None)
+    search_query = request.GET.get('q', '').strip()
 
-    posts = models.PhotoPost.objects.all().select_related('user').select_related('tag').order_by('-posted_at')
+    posts = models.PhotoPost.objects.all().select_related('user').select_related('tag')
   
     valid_statuses = dict(models.PhotoPost.STATUS_CHOICES).keys()
     if status_filter in valid_statuses:
@@ -750,48 +899,105 @@ def admin_post_list(request):
         else:
             posts = posts.filter(priority=priority_filter)
 
-    all_tags = models.Tag.objects.all().order_by('name')
+    # タイトル・コメントの全文検索（絞り込みと組み合わせ, 関連の高い順）
+    ranked = False
+    if search_query:
+        posts, ranked = search.search(posts, search_query)
 
-    context = {
-        'posts': posts,
-        'status_filter': status_filter,
-        'tag_filter': tag_filter,
-        'priority_filter': priority_filter,
-        'all_tags': all_tags,
+    return posts, {
+        'status_filter': status_filter, 'tag_filter': tag_filter, 'priority_filter': priority_filter,
+        'search_query': search_query, 'ranked': ranked,
     }
+
+
+@user_passes_test(is_staff_user, login_url='/')
+def admin_post_list(request):
+    posts, context = _admin_post_list_queryset(request)
+    context.update(_post_page_context(request, posts, 'admin_post_list_fragment', context['ranked']))
+    context.update({
+        'all_tags': models.Tag.objects.all().order_by('name'),
+        'status_choices': models.PhotoPost.STATUS_CHOICES,
+        'priority_choices': models.PhotoPost.PRIORITY_CHOICES,
+    })
     return render(request, 'main/admin/admin_post_list.html', context)
 
+
+@user_passes_test(is_staff_user, login_url='/')
+def admin_post_list_fragment(request):
+    """無限スクロール用に、admin_post_list の続きのページの行だけを HTML で返す。"""
+    posts, context = _admin_post_list_queryset(request)
+    context.update(_post_page_context(request, posts, 'admin_post_list_fragment', context['ranked']))
+    response = render(request, 'main/admin/admin_post_list_rows.html', context)
+    # 続きのページのクエリ文字列（最後のページでは空）
+    response['X-Next-Query'] = context['next_query']
+    return response
+
 @user_passes_test(is_staff_user, login_url='/')
 def admin_post_detail(request, post_id):
-    post = get_object_or_404(models.PhotoPost, pk=post_id)    
-    image_path = post.photo.path
+    post = get_object_or_404(models.PhotoPost.objects.select_related('user', 'tag', 'embedding'), pk=post_id)    
     form = StatusUpdateForm(instance=post)
     context = {'post': post,'form': form }
 
-    print("hello")
-    with open(image_path, 'rb') as f:
-        file_data = f.read()
-    
-    input_tensor = preprocess_image(file_data)
+    # 保存済みのAI分類結果を表示する（未分類の既存投稿のみここで分類して保存）
+    # 推論が混雑している場合は待たずに「AI分類待ち」として表示する
+    classification_pending = False
+    if not post.is_classified:
+        try:
+            classifier.classify_post(post, timeout=settings.CLASSIFIER_PAGE_TIMEOUT)
+        except InferenceSaturated:
+            classification_pending = True
+        except Exception:
+            logger.error(f"報告ID {post_id} のAI分類に失敗しました。", exc_info=True)
+
+    confidence_score = post.ai_confidence_percent
+    result_label = post.ai_label
 
-    with torch.no_grad():
-        output = predict_model(input_tensor)
-        probabilities = torch.nn.functional.softmax(output, dim=1)
-        confidence, predicted_idx = torch.max(probabilities, 1)
-        confidence_score = round(confidence.item() * 100, 1)
-        category_idx = predicted_idx.item()        
-        categories = ['倒木', '正常（対象外）', '道路のひび割れ', '水質汚濁']
-        result_label = categories[category_idx]
+    similar_posts = []
+    if hasattr(post, 'embedding'):
+        try:
+            similar_posts = similarity.find_similar(
+                post.embedding.vector, tag_id=post.tag_id,
+                latitude=post.latitude, longitude=post.longitude, exclude=post.pk,
+            )
+        except Exception:
+            logger.warning(f"報告ID {post_id} の類似報告の検索に失敗しました。", exc_info=True)
 
     context.update({
+        'similar_posts': similar_posts,
         'confidence': confidence_score,
         'result_label': result_label,
-        'is_valid': result_label != '正常（対象外）' and confidence_score > 30,
+        'classification_pending': classification_pending,
+        'is_valid': classification_pending or (result_label != classifier.NORMAL_LABEL and (confidence_score or 0) > 30),
     })
 
     return render(request, 'main/admin/admin_post_detail.html', context)
 
 
+@user_passes_test(is_staff_user, login_url='/')
+def admin_classifier_metrics(request):
+    """AI分類の待ち行列・待ち時間などの指標を JSON で返す（監視用）。"""
+    from . import model_loader
+
+    metrics = {
+        'model_version': model_loader.model_version(),
+        'backend': model_loader.backend_name(),
+        'model_loaded': model_loader.is_loaded(),
+        'governor': get_governor().stats(),
+    }
+
+    if settings.CLASSIFIER_BATCHING and model_loader.is_loaded():
+        from .batching import get_batcher
+        metrics['batcher'] = get_batcher().stats()
+
+    if inference_server.socket_path():
+        try:
+            metrics['inference_server'] = inference_server.server_stats()
+        except inference_server.InferenceServerUnavailable:
+            metrics['inference_server'] = None
+
+    return JsonResponse(metrics)
+
+
 @user_passes_test(is_staff_user, login_url='/')
 def manage_post_status_edit(request, post_id):
     post = get_object_or_404(models.PhotoPost, pk=post_id)
@@ -0,0 +1,33 @@
+# Generated by Django 5.2.7 on 2026-10-17 04:17
+
+from django.db import migrations, models
+from django.db.models import Count, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+
+def count_posts(apps, schema_editor):
+    """既存のユーザーの投稿数を数えて記録する。"""
+    CustomUser = apps.get_model('users', 'CustomUser')
+    PhotoPost = apps.get_model('main', 'PhotoPost')
+    counts = (
+        PhotoPost.objects.filter(user=OuterRef('pk')).order_by()
+        .values('user').annotate(n=Count('pk')).values('n')
+    )
+    CustomUser.objects.update(post_count=Coalesce(Subquery(counts), 0))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0005_alter_customuser_badge_rank'),
+        ('main', '0014_photopost_posted_at_id_idx'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='customuser',
+            name='post_count',
+            field=models.PositiveIntegerField(default=0, verbose_name='投稿数'),
+        ),
+        migrations.RunPython(count_posts, migrations.RunPython.noop),
+    ]
@@ -72,6 +72,11 @@ class CustomUser(AbstractBaseUser):
     
     date_joined = models.DateTimeField(_("date joined"), default=timezone.now)
 
+    # 投稿数。main の PhotoPost の作成・削除時に同じトランザクションで増減する（main/signals.py）。
+    # bulk_create などシグナルを送らない操作の後は manage.py reconcile_post_counts で数え直す。
+    # 読み込んだユーザーを保存すると読み込んだ時点の値で上書きするため、既存のユーザーの保存では update_fields を指定する。
+    post_count = models.PositiveIntegerField(default=0, verbose_name='投稿数')
+
     objects = CustomUserManager()
 
     EMAIL_FIELD = "email"
@@ -95,6 +100,29 @@ class CustomUser(AbstractBaseUser):
     def get_short_name(self):
         return self.username
 
+    # -----------------------------------------------------
+    # スタンプカードとバッジ（post_count から求め、投稿を読み込まない）
+    # -----------------------------------------------------
+    STAMPS_PER_CARD = 10
+    # バッジを選べるようになるスタンプカードの枚数
+    BADGE_CARD_THRESHOLDS = [('bronze', 1), ('silver', 5), ('gold', 10), ('rainbow', 50)]
+
+    @property
+    def stamp_cards(self):
+        """スタンプが貯まったカードの枚数。"""
+        return self.post_count // self.STAMPS_PER_CARD
+
+    @property
+    def stamps(self):
+        """現在のカードのスタンプの数。"""
+        return self.post_count % self.STAMPS_PER_CARD
+
+    def available_badges(self):
+        """選べるバッジの (値, 表示名)。まだ選べるバッジがなければ [('none', '表示しない')]。"""
+        labels = dict(self.BADGE_CHOICES)
+        badges = [(rank, labels[rank]) for rank, cards in self.BADGE_CARD_THRESHOLDS if self.stamp_cards >= cards]
+        return badges or [('none', '表示しない')]
+
     class Meta:
         verbose_name = _("user")
         verbose_name_plural = _("users")
@@ -1,3 +1,46 @@
+from django.contrib.auth import get_user_model
 from django.test import TestCase
 
-# Create your tests here.
+
+# -----------------------------------------------------
+# スタンプカードとバッジ（CustomUser.post_count から求める）
+# -----------------------------------------------------
+
+class StampCardTests(TestCase):
+
+    def make_user(self, post_count):
+        return get_user_model()(username=f'stamp_{post_count}', post_count=post_count)
+
+    def test_stamps(self):
+        for post_count, cards, stamps in [(0, 0, 0), (9, 0, 9), (10, 1, 0), (23, 2, 3)]:
+            with self.subTest(post_count=post_count):
+                user = self.make_user(post_count)
+                self.assertEqual((user.stamp_cards, user.stamps), (cards, stamps))
+
+    def test_available_badges(self):
+        def ranks(post_count):
+            return [rank for rank, _ in self.make_user(post_count).available_badges()]
+
+        self.assertEqual(ranks(0), ['none'])
+        self.assertEqual(ranks(9), ['none'])
+        self.assertEqual(ranks(10), ['bronze'])
+        self.assertEqual(ranks(50), ['bronze', 'silver'])
+        self.assertEqual(ranks(100), ['bronze', 'silver', 'gold'])
+        self.assertEqual(ranks(500), ['bronze', 'silver', 'gold', 'rainbow'])
+
+
+class CustomUserManagerTests(TestCase):
+
+    def test_create_user(self):
+        user = get_user_model().objects.create_user('manager_user', 'Manager@EXAMPLE.com', 'pw')
+        self.assertEqual(user.email, 'Manager@example.com')
+        self.assertEqual(user.post_count, 0)
+        self.assertTrue(user.check_password('pw'))
+        self.assertFalse(user.is_staff)
+
+    def test_create_superuser(self):
+        user = get_user_model().objects.create_superuser('manager_admin', 'admin@example.com', 'pw')
+        self.assertTrue(user.is_staff and user.is_superuser)
+        self.assertTrue(user.has_perm('main.change_photopost'))
+        with self.assertRaises(ValueError):
+            get_user_model().objects.create_superuser('manager_admin2', 'admin2@example.com', 'pw', is_staff=False)